@@ -1,3 +1,4 @@
+import click
 from flask import Flask
 from dotenv import load_dotenv
 from .extensions import db, jwt
@@ -11,6 +12,8 @@ from .loans.routes import bp as loans_bp
 from .notification.routes import bp as notification_bp
 from .reports.routes import bp as reports_bp
 from .common.models import create_all_tables, TokenBlocklist
+from .common.degraded import register_degraded_header
+from .common.schema import ensure_schema
 
 def create_app(config_obj=Config):
     load_dotenv()
@@ -43,6 +46,27 @@ def create_app(config_obj=Config):
     app.register_blueprint(notification_bp, url_prefix="/notifications")
     app.register_blueprint(reports_bp, url_prefix="/reports")
 
+    # Cabecera X-Degraded cuando la respuesta se sirvió desde un fallback
+    register_degraded_header(app)
+
+    # Tablas, columnas e índices nuevos (y el índice de búsqueda) al arrancar,
+    # nunca dentro de una petición (ver app/common/schema.py)
+    if app.config.get("SCHEMA_AUTO_UPGRADE", True):
+        with app.app_context():
+            try:
+                ensure_schema()
+            except Exception as e:
+                print(f"[SCHEMA] No se pudo actualizar el esquema: {e}")
+
+    @app.cli.command("ensure-schema")
+    def ensure_schema_command():
+        """
+        Crea o actualiza tablas, columnas e índices de una base existente (idempotente).
+        Usage: flask --app app.wsgi ensure-schema
+        """
+        summary = ensure_schema(force=True)
+        click.echo(f"Esquema actualizado: {len(summary['columns'])} columnas y {len(summary['indexes'])} índices nuevos.")
+
     @app.get("/health")
     def health():
         return {"status": "ok"}
@@ -1,9 +1,10 @@
 from typing import Optional
 from datetime import datetime, timedelta
 import secrets
+from flask import current_app
 from flask_jwt_extended import create_access_token, create_refresh_token
 from app.common.security import verify_password, hash_password
-from app.common.models import Credential, UserProfile, Notification, NotificationType, TokenBlocklist
+from app.common.models import Credential, UserProfile, Notification, NotificationType, TokenBlocklist, UserLoanCounters
 from app.extensions import db
 from infrastructure.events import publish_user_registered
 from .dtos import (
@@ -11,6 +12,12 @@ from .dtos import (
 )
 
 
+def _roles(email: str) -> list:
+    """Roles del token: todos son lectores; los correos de STAFF_EMAILS además son personal."""
+    staff = {e.strip().lower() for e in current_app.config.get("STAFF_EMAILS", "").split(",") if e.strip()}
+    return ["reader", "staff"] if email and email.lower() in staff else ["reader"]
+
+
 def login(data: LoginIn) -> Optional[LoginOut]:
     # Buscar credenciales por email
     credential = Credential.query.filter_by(email=data.email).first()
@@ -27,7 +34,7 @@ def login(data: LoginIn) -> Optional[LoginOut]:
     if not verify_password(data.password, credential.password_hash):
         return None
 
-    claims = {"roles": ["reader"]}
+    claims = {"roles": _roles(credential.email)}
     access = create_access_token(identity=str(credential.id), additional_claims=claims)
     refresh = create_refresh_token(identity=str(credential.id))
     return LoginOut(access_token=access, refresh_token=refresh)
@@ -55,7 +62,8 @@ def me(credential_id: int) -> MeOut:
 
 
 def refresh(credential_id: int) -> RefreshOut:
-    claims = {"roles": ["reader"]}
+    credential = db.session.get(Credential, credential_id)
+    claims = {"roles": _roles(credential.email if credential else "")}
     new_access = create_access_token(identity=str(credential_id), additional_claims=claims)
     return RefreshOut(access_token=new_access)
 
@@ -89,6 +97,9 @@ def register(data: RegisterIn) -> Optional[RegisterOut]:
         )
         db.session.add(new_profile)
 
+        # Contadores de préstamos y reservas (app/loans/counters.py), a cero
+        db.session.add(UserLoanCounters(credential_id=new_credential.id))
+
         # Crear notificación de bienvenida
         welcome_notification = Notification(
             credential_id=new_credential.id,
@@ -0,0 +1,384 @@
+"""
+Caché de metadatos de Google Books.
+
+Dos niveles para las consultas por volume_id:
+  1. LRU en memoria del proceso (acotado en tamaño y con TTL).
+  2. Redis compartido entre workers, con TTL y caché negativa para 404.
+
+Se guarda directamente el dict de `_format_book_volume_info`.
+
+Los listados (búsqueda, categoría, populares) usan `QueryCache`, que sirve
+entradas caducadas mientras se refrescan en segundo plano
+(stale-while-revalidate) y evita que varios fallos simultáneos de la misma
+consulta vayan todos a Google.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import redis
+from flask import current_app, has_app_context
+
+from app.common.singleflight import SingleFlight
+from infrastructure.redis_client import get_redis, redis_available, mark_redis_down
+
+# Centinelas: MISS = no hay nada en caché, NOT_FOUND = 404 cacheado
+MISS = object()
+NOT_FOUND = object()
+
+_NOT_FOUND_MARKER = {"__not_found__": True}
+
+
+class LRUCache:
+    """LRU thread-safe con TTL por entrada y contadores."""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class VolumeCache:
+    """Caché de dos niveles para `get_book_by_volume_id`."""
+
+    KEY_PREFIX = "catalog:volume:"
+
+    def __init__(self, maxsize: int = 2048, ttl: int = 86400, negative_ttl: int = 600):
+        self.local = LRUCache(maxsize)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        self.negative_hits = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, volume_id: str):
+        """Devuelve el dict cacheado, NOT_FOUND si hay un 404 cacheado, o MISS."""
+        value = self.local.get(volume_id)
+        if value is MISS and redis_available():
+            try:
+                raw = get_redis().get(self.KEY_PREFIX + volume_id)
+            except redis.RedisError:
+                self._count("redis_errors")
+                mark_redis_down()
+                return MISS
+            if raw is None:
+                self._count("redis_misses")
+            else:
+                self._count("redis_hits")
+                data = json.loads(raw)
+                value = NOT_FOUND if data == _NOT_FOUND_MARKER else data
+                # Promover al nivel local
+                self.local.set(volume_id, value, self.negative_ttl if value is NOT_FOUND else self.ttl)
+
+        if value is NOT_FOUND:
+            self._count("negative_hits")
+        return value
+
+    def _store(self, volume_id: str, value: Any, payload: Dict[str, Any], ttl: int) -> None:
+        self.local.set(volume_id, value, ttl)
+        if not redis_available():
+            return
+        try:
+            get_redis().set(self.KEY_PREFIX + volume_id, json.dumps(payload), ex=ttl)
+        except redis.RedisError:
+            self._count("redis_errors")
+            mark_redis_down()
+
+    def set(self, volume_id: str, data: Dict[str, Any]) -> None:
+        self._store(volume_id, data, data, self.ttl)
+
+    def set_not_found(self, volume_id: str) -> None:
+        self._store(volume_id, NOT_FOUND, _NOT_FOUND_MARKER, self.negative_ttl)
+
+    def invalidate(self, volume_id: str) -> None:
+        self.local.delete(volume_id)
+        if not redis_available():
+            return
+        try:
+            get_redis().delete(self.KEY_PREFIX + volume_id)
+        except redis.RedisError:
+            self._count("redis_errors")
+            mark_redis_down()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            remote = {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors,
+            }
+            negative_hits = self.negative_hits
+        return {"local": self.local.stats(), "redis": remote, "negative_hits": negative_hits}
+
+
+class QueryCache:
+    """
+    Caché de resultados de listados con stale-while-revalidate.
+
+    Cada entrada guarda `{"data": [...], "fetched_at": epoch}`. Mientras su
+    edad es menor que `fresh_ttl` se sirve tal cual; hasta `fresh_ttl + stale_ttl`
+    se sirve igualmente pero se programa un refresco en segundo plano.
+    """
+
+    KEY_PREFIX = "catalog:query:"
+    REFRESH_PREFIX = "catalog:query-refresh:"
+
+    def __init__(self, fresh_ttl: int = 300, stale_ttl: int = 3600, local_size: int = 256,
+                 lease_ttl: int = 10, wait_timeout: float = 5.0):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.lease_ttl = lease_ttl
+        self.wait_timeout = wait_timeout
+        self.local = LRUCache(local_size)
+        self._flight = SingleFlight("catalog-query", lease_ttl=lease_ttl, wait_timeout=wait_timeout)
+        self._pending_refresh: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.refreshes_scheduled = 0
+        self.prefetches_scheduled = 0
+        self.redis_errors = 0
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    @classmethod
+    def make_key(cls, kind: str, term: Optional[str], max_results: int, start_index: int = 0) -> str:
+        normalized = " ".join((term or "").lower().split())
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"{kind}:{max_results}:{start_index}:{digest}"
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["fetched_at"] < self.fresh_ttl
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.local.get(key)
+        if entry is not MISS and self._is_fresh(entry):
+            return entry
+        local_entry = None if entry is MISS else entry
+
+        if not redis_available():
+            return local_entry
+        try:
+            raw = get_redis().get(self.KEY_PREFIX + key)
+        except redis.RedisError:
+            self._count("redis_errors")
+            mark_redis_down()
+            return local_entry
+        if raw is None:
+            return local_entry
+
+        remote_entry = json.loads(raw)
+        if local_entry is None or remote_entry["fetched_at"] > local_entry["fetched_at"]:
+            self.local.set(key, remote_entry, self.fresh_ttl + self.stale_ttl)
+            return remote_entry
+        return local_entry
+
+    def store(self, key: str, data: list) -> None:
+        entry = {"data": data, "fetched_at": time.time()}
+        ttl = self.fresh_ttl + self.stale_ttl
+        self.local.set(key, entry, ttl)
+        if not redis_available():
+            return
+        try:
+            get_redis().set(self.KEY_PREFIX + key, json.dumps(entry), ex=ttl)
+        except redis.RedisError:
+            self._count("redis_errors")
+            mark_redis_down()
+
+    def _try_claim(self, redis_key: str, local_key: str) -> bool:
+        """
+        Reserva de corta duración para programar un único refresco por clave:
+        en Redis (entre workers) o, si Redis no está disponible, en el proceso.
+        """
+        if redis_available():
+            try:
+                return bool(get_redis().set(redis_key, "1", nx=True, ex=self.lease_ttl))
+            except redis.RedisError:
+                self._count("redis_errors")
+                mark_redis_down()
+        now = time.monotonic()
+        with self._lock:
+            if self._pending_refresh.get(local_key, 0) > now:
+                return False
+            self._pending_refresh[local_key] = now + self.lease_ttl
+            return True
+
+    def _release(self, redis_key: str, local_key: str) -> None:
+        with self._lock:
+            self._pending_refresh.pop(local_key, None)
+        if not redis_available():
+            return
+        try:
+            get_redis().delete(redis_key)
+        except redis.RedisError:
+            self._count("redis_errors")
+            mark_redis_down()
+
+    def _claim_refresh(self, key: str) -> bool:
+        return self._try_claim(self.REFRESH_PREFIX + key, "refresh:" + key)
+
+    def release_refresh(self, key: str) -> None:
+        self._release(self.REFRESH_PREFIX + key, "refresh:" + key)
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[list]],
+                    refresh: Callable[[], None]) -> Optional[list]:
+        """
+        Devuelve los datos de `key`. `loader` obtiene los datos de Google de
+        forma síncrona (None si falla) y `refresh` programa un refresco en
+        segundo plano que termina llamando a `store`.
+        """
+        entry = self._read(key)
+        if entry is not None:
+            if self._is_fresh(entry):
+                self._count("fresh_hits")
+            else:
+                self._count("stale_hits")
+                if self._claim_refresh(key):
+                    self._count("refreshes_scheduled")
+                    refresh()
+            return entry["data"]
+
+        self._count("misses")
+        return self._load_coalesced(key, loader)
+
+    def prefetch(self, key: str, refresh: Callable[[], None]) -> bool:
+        """
+        Programa la carga en segundo plano de `key` (p.ej. la página siguiente)
+        si no está ya fresca en caché ni hay otra carga en curso.
+        """
+        entry = self._read(key)
+        if entry is not None and self._is_fresh(entry):
+            return False
+        if not self._claim_refresh(key):
+            return False
+        self._count("prefetches_scheduled")
+        refresh()
+        return True
+
+    def _load_coalesced(self, key: str, loader: Callable[[], Optional[list]]) -> Optional[list]:
+        def load():
+            # Otro worker pudo haberla cargado mientras esperábamos el lease
+            entry = self._read(key)
+            if entry is not None:
+                return entry["data"]
+            self._count("loads")
+            data = loader()
+            if data is not None:
+                self.store(key, data)
+            return data
+
+        def read_shared():
+            entry = self._read(key)
+            return None if entry is None else entry["data"]
+
+        return self._flight.do(key, load, reader=read_shared)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {
+                "fresh_hits": self.fresh_hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "refreshes_scheduled": self.refreshes_scheduled,
+                "prefetches_scheduled": self.prefetches_scheduled,
+                "redis_errors": self.redis_errors,
+            }
+        counters["local"] = self.local.stats()
+        counters["singleflight"] = self._flight.stats()
+        return counters
+
+
+_volume_cache: Optional[VolumeCache] = None
+_query_cache: Optional[QueryCache] = None
+_init_lock = threading.Lock()
+
+
+def _config(name: str, default):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return default
+
+
+def get_volume_cache() -> VolumeCache:
+    global _volume_cache
+    if _volume_cache is None:
+        with _init_lock:
+            if _volume_cache is None:
+                _volume_cache = VolumeCache(
+                    maxsize=int(_config("VOLUME_CACHE_SIZE", 2048)),
+                    ttl=int(_config("VOLUME_CACHE_TTL", 86400)),
+                    negative_ttl=int(_config("VOLUME_CACHE_NEGATIVE_TTL", 600)),
+                )
+    return _volume_cache
+
+
+def get_query_cache() -> QueryCache:
+    global _query_cache
+    if _query_cache is None:
+        with _init_lock:
+            if _query_cache is None:
+                _query_cache = QueryCache(
+                    fresh_ttl=int(_config("CATALOG_QUERY_FRESH_TTL", 300)),
+                    stale_ttl=int(_config("CATALOG_QUERY_STALE_TTL", 3600)),
+                    local_size=int(_config("CATALOG_QUERY_CACHE_SIZE", 256)),
+                )
+    return _query_cache
@@ -0,0 +1,92 @@
+"""
+Clasificación de las categorías de Google Books en `BookCategory`.
+
+El mapeo de palabras clave se construye una sola vez al importar el módulo
+(un dict para la coincidencia exacta y una tupla ordenada para la búsqueda
+por subcadena) y el resultado por cadena de categoría se memoiza: Google
+repite muy pocas cadenas distintas ("Fiction", "Computers / Programming"...).
+
+Se conserva la semántica original: primero coincidencia exacta; si no, gana
+la palabra clave que aparece antes en `CATEGORY_KEYWORDS`; y entre varias
+categorías de Google, la primera que coincida.
+"""
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence
+
+from app.common.models import BookCategory
+
+DEFAULT_CATEGORY = BookCategory.FICTION
+
+# El orden importa: ante varias coincidencias parciales gana la primera
+CATEGORY_KEYWORDS = (
+    ("fiction", BookCategory.FICTION),
+    ("novel", BookCategory.FICTION),
+    ("non-fiction", BookCategory.NON_FICTION),
+    ("nonfiction", BookCategory.NON_FICTION),
+    ("science", BookCategory.SCIENCE),
+    ("physics", BookCategory.SCIENCE),
+    ("chemistry", BookCategory.SCIENCE),
+    ("biology", BookCategory.SCIENCE),
+    ("mathematics", BookCategory.SCIENCE),
+    ("math", BookCategory.SCIENCE),
+    ("technology", BookCategory.TECHNOLOGY),
+    ("computers", BookCategory.TECHNOLOGY),
+    ("computer", BookCategory.TECHNOLOGY),
+    ("programming", BookCategory.TECHNOLOGY),
+    ("software", BookCategory.TECHNOLOGY),
+    ("history", BookCategory.HISTORY),
+    ("historical", BookCategory.HISTORY),
+    ("biography", BookCategory.BIOGRAPHY),
+    ("autobiography", BookCategory.BIOGRAPHY),
+    ("memoir", BookCategory.BIOGRAPHY),
+    ("self-help", BookCategory.SELF_HELP),
+    ("self help", BookCategory.SELF_HELP),
+    ("psychology", BookCategory.SELF_HELP),
+    ("business", BookCategory.BUSINESS),
+    ("economics", BookCategory.BUSINESS),
+    ("entrepreneurship", BookCategory.BUSINESS),
+    ("management", BookCategory.BUSINESS),
+    ("finance", BookCategory.BUSINESS),
+    ("education", BookCategory.EDUCATION),
+    ("teaching", BookCategory.EDUCATION),
+    ("learning", BookCategory.EDUCATION),
+    ("literature", BookCategory.LITERATURE),
+    ("literary", BookCategory.LITERATURE),
+    ("poetry", BookCategory.LITERATURE),
+    ("drama", BookCategory.LITERATURE),
+)
+
+_EXACT = dict(CATEGORY_KEYWORDS)
+
+
+@lru_cache(maxsize=4096)
+def classify_category(google_category: str) -> Optional[BookCategory]:
+    """Clasifica una categoría de Google ya normalizada. None si no coincide ninguna palabra clave."""
+    exact = _EXACT.get(google_category)
+    if exact is not None:
+        return exact
+    # `in` sobre la tupla precompilada resultó más rápido en CPython que una
+    # única regex en alternancia (que además necesita lookahead por los solapes
+    # como "nonfiction" ⊃ "fiction")
+    for keyword, category in CATEGORY_KEYWORDS:
+        if keyword in google_category:
+            return category
+    return None
+
+
+def classify(google_categories: Optional[Iterable[str]]) -> BookCategory:
+    """Categoría del libro a partir de la lista de categorías de Google Books."""
+    for google_category in google_categories or ():
+        category = classify_category(google_category.lower().strip())
+        if category is not None:
+            return category
+    return DEFAULT_CATEGORY
+
+
+def classify_many(categories_per_book: Sequence[Optional[Iterable[str]]]) -> List[BookCategory]:
+    """Clasifica un lote de libros (una lista de categorías de Google por libro)."""
+    return [classify(categories) for categories in categories_per_book]
+
+
+def cache_info():
+    return classify_category.cache_info()._asdict()
@@ -0,0 +1,335 @@
+"""
+Proxy de portadas: `GET /catalog/covers/<volume_id>`.
+
+La primera petición de una portada descarga el `thumbnail` de Google una
+sola vez (coalesciendo peticiones simultáneas) y la guarda en disco
+direccionada por contenido:
+
+    <dir>/blobs/ab/ab12...   imagen, nombrada por su sha256
+    <dir>/refs/<volume_id>   "<sha256> <content-type>" (vacío = sin portada)
+
+Portadas idénticas (p.ej. la imagen genérica de Google) se guardan una vez,
+el sha256 sirve como ETag fuerte y las imágenes se sirven con `send_file`
+(sendfile del servidor WSGI). El directorio tiene un tope de tamaño: al
+superarlo se borran las imágenes usadas hace más tiempo (LRU por mtime).
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, NamedTuple, Optional
+
+import requests
+from flask import current_app
+from sqlalchemy import select
+from werkzeug.exceptions import NotFound
+
+from app.common.circuit_breaker import OPEN
+from app.common.models import Book
+from app.common.singleflight import SingleFlight
+from app.extensions import db
+from .google_client import get_breaker, get_client
+
+VOLUME_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Google devuelve los thumbnails con http://; estos hosts admiten https
+HTTPS_COVER_HOSTS = ("books.google.com", "googleusercontent.com", "googleapis.com")
+
+# Refrescar el mtime (marca LRU) como mucho una vez por intervalo
+TOUCH_INTERVAL = 600
+# Al superar el tope se recorta hasta esta fracción, para no desalojar en cada escritura
+EVICT_TARGET_RATIO = 0.9
+
+cover_flight = SingleFlight("catalog-cover", lease_ttl=15.0, wait_timeout=10.0)
+
+
+class CoverUnavailable(Exception):
+    """No se pudo descargar la portada (Google no responde); reintentar más tarde."""
+
+
+class Cover(NamedTuple):
+    path: str
+    sha256: str
+    mimetype: str
+
+
+MISSING = object()  # el volumen no tiene portada (cacheado)
+
+
+class CoverStore:
+    """Caché de portadas en disco, compartida por los procesos de la máquina."""
+
+    def __init__(self, root: str, max_bytes: int, negative_ttl: int = 86400):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self._blobs = os.path.join(root, "blobs")
+        self._refs = os.path.join(root, "refs")
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._refs, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "deduplicated": 0,
+                       "evictions": 0, "evicted_bytes": 0}
+
+    def _count(self, **increments) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self._blobs, sha256[:2], sha256)
+
+    def _ref_path(self, volume_id: str) -> str:
+        return os.path.join(self._refs, volume_id)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def lookup(self, volume_id: str):
+        """`Cover`, `MISSING` (sin portada) o None si no está en caché."""
+        try:
+            with open(self._ref_path(volume_id), "r", encoding="ascii") as f:
+                ref = f.read().split()
+            ref_mtime = os.stat(self._ref_path(volume_id)).st_mtime
+        except (FileNotFoundError, UnicodeDecodeError):
+            self._count(misses=1)
+            return None
+
+        if not ref:
+            if time.time() - ref_mtime < self.negative_ttl:
+                self._count(hits=1)
+                return MISSING
+            self._count(misses=1)
+            return None
+
+        sha256, mimetype = ref[0], ref[1] if len(ref) > 1 else "image/jpeg"
+        path = self._blob_path(sha256)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            # La imagen fue desalojada; la referencia queda huérfana hasta el siguiente put
+            self._count(misses=1)
+            return None
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        self._count(hits=1)
+        return Cover(path, sha256, mimetype)
+
+    def put(self, volume_id: str, data: bytes, mimetype: str) -> Cover:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha256)
+        if os.path.exists(path):
+            now = time.time()
+            os.utime(path, (now, now))
+            self._count(deduplicated=1)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, data)
+            self._count(stored=1)
+            self._grow(len(data))
+        self._write_atomic(self._ref_path(volume_id), f"{sha256} {mimetype}\n".encode("ascii"))
+        return Cover(path, sha256, mimetype)
+
+    def put_missing(self, volume_id: str) -> None:
+        self._write_atomic(self._ref_path(volume_id), b"")
+
+    def _scan(self):
+        entries = []
+        for shard in os.scandir(self._blobs):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _grow(self, added: int) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += added
+            if self._size <= self.max_bytes:
+                return
+        self.evict()
+
+    def evict(self) -> int:
+        """Borra las imágenes menos usadas hasta bajar del tope. Devuelve los bytes liberados."""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * EVICT_TARGET_RATIO)
+        freed = removed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            freed += size
+            removed += 1
+        with self._lock:
+            # Recalculado con el recorrido: corrige lo escrito por otros procesos
+            self._size = total - freed
+            self._stats["evictions"] += removed
+            self._stats["evicted_bytes"] += freed
+        return freed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["bytes"] = self._size
+        snapshot["max_bytes"] = self.max_bytes
+        return snapshot
+
+
+_store: Optional[CoverStore] = None
+_store_lock = threading.Lock()
+
+
+def get_cover_store() -> CoverStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = current_app.config
+                _store = CoverStore(
+                    config.get("COVER_CACHE_DIR") or os.path.join(current_app.instance_path, "covers"),
+                    max_bytes=int(config.get("COVER_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+                    negative_ttl=int(config.get("COVER_NEGATIVE_TTL", 86400)),
+                )
+    return _store
+
+
+def _thumbnail_url(volume_id: str) -> Optional[str]:
+    """URL de la portada en Google (None si el volumen no tiene)."""
+    from app.catalog.service import get_book_by_volume_id
+
+    book = get_book_by_volume_id(volume_id)
+    if book is None or book.get("source") == "local":
+        # Respuesta degradada: no sabemos si tiene portada
+        raise CoverUnavailable("Google Books no está disponible")
+    url = book.get("thumbnail")
+    if url and url.startswith("http://") and (urlsplit(url).hostname or "").endswith(HTTPS_COVER_HOSTS):
+        url = "https://" + url[len("http://"):]
+    return url
+
+
+def _download(volume_id: str):
+    store = get_cover_store()
+    url = _thumbnail_url(volume_id)
+    if not url:
+        store.put_missing(volume_id)
+        return MISSING
+
+    max_bytes = int(current_app.config.get("COVER_MAX_IMAGE_BYTES", 2 * 1024 * 1024))
+    try:
+        response = get_client().get(url)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            store.put_missing(volume_id)
+            return MISSING
+        raise CoverUnavailable(str(e))
+    except requests.exceptions.RequestException as e:
+        raise CoverUnavailable(str(e))
+
+    mimetype = response.headers.get("Content-Type", "").split(";")[0].strip()
+    if not mimetype.startswith("image/") or len(response.content) > max_bytes:
+        store.put_missing(volume_id)
+        return MISSING
+    return store.put(volume_id, response.content, mimetype)
+
+
+def get_cover(volume_id: str):
+    """
+    Portada cacheada de un volumen (`Cover`) o `MISSING` si no tiene.
+    Lanza `NotFound` si el volumen no existe y `CoverUnavailable` si Google no responde.
+    """
+    if not VOLUME_ID_RE.match(volume_id):
+        raise NotFound("Volumen no encontrado")
+    store = get_cover_store()
+    cached = store.lookup(volume_id)
+    if cached is not None:
+        return cached
+    # Los workers de la máquina comparten el disco: el resultado de otro worker se lee de ahí
+    return cover_flight.do(volume_id, lambda: _download(volume_id), reader=lambda: store.lookup(volume_id))
+
+
+def _prewarm_one(app, volume_id: str) -> str:
+    with app.app_context():
+        try:
+            return "missing" if get_cover(volume_id) is MISSING else "fetched"
+        except NotFound:
+            return "missing"
+        except Exception:
+            return "error"
+
+
+def prewarm_covers(chunk_size: int = 200, after_id: int = 0, max_workers: int = 8,
+                   progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Descarga las portadas de todos los libros de `books` con id > `after_id`
+    que aún no están en caché, por bloques de `chunk_size` (keyset por id).
+
+    Se detiene si el circuito de Google Books se abre; `last_id` permite
+    continuar después desde ese punto.
+    """
+    app = current_app._get_current_object()
+    store = get_cover_store()
+    summary = {"scanned": 0, "cached": 0, "fetched": 0, "missing": 0, "errors": 0,
+               "last_id": after_id, "interrupted": False}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            rows = db.session.execute(
+                select(Book.id, Book.volume_id)
+                .where(Book.id > summary["last_id"], Book.volume_id.isnot(None))
+                .order_by(Book.id).limit(chunk_size)
+            ).all()
+            # Cerrar la transacción de lectura mientras se descarga
+            db.session.rollback()
+            if not rows:
+                break
+            if get_breaker().state() == OPEN:
+                summary["interrupted"] = True
+                break
+
+            pending = [row.volume_id for row in rows if store.lookup(row.volume_id) is None]
+            summary["cached"] += len(rows) - len(pending)
+            for outcome in executor.map(lambda volume_id: _prewarm_one(app, volume_id), pending):
+                key = "errors" if outcome == "error" else outcome
+                summary[key] += 1
+
+            summary["scanned"] += len(rows)
+            summary["last_id"] = rows[-1].id
+            print(f"[COVERS] hasta id {summary['last_id']}: {summary['fetched']} descargadas, "
+                  f"{summary['cached']} ya en caché, {summary['missing']} sin portada")
+            if progress:
+                progress(dict(summary))
+
+    return summary
@@ -0,0 +1,52 @@
+"""
+Cursores opacos para paginar los listados del catálogo.
+
+El cursor codifica (en base64 url-safe) el tipo de listado, el término, el
+`startIndex` de Google y el tamaño de página. Los clientes solo lo reenvían
+tal cual en `?cursor=` para pedir la página siguiente.
+"""
+import base64
+import binascii
+import json
+from typing import NamedTuple, Optional
+
+# Google Books no devuelve más de 40 resultados por petición
+MAX_PAGE_SIZE = 40
+LISTING_KINDS = ("search", "popular", "category")
+
+
+class InvalidCursor(ValueError):
+    """El cursor no se pudo decodificar o no corresponde a este listado."""
+
+
+class PageRequest(NamedTuple):
+    kind: str
+    term: str
+    start_index: int
+    page_size: int
+
+
+def encode_cursor(page: PageRequest) -> str:
+    raw = json.dumps([page.kind, page.term, page.start_index, page.page_size], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> PageRequest:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, term, start_index, page_size = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursor("El cursor no es válido")
+
+    if (kind not in LISTING_KINDS or not isinstance(term, str)
+            or not isinstance(start_index, int) or start_index < 0
+            or not isinstance(page_size, int) or not 1 <= page_size <= MAX_PAGE_SIZE):
+        raise InvalidCursor("El cursor no es válido")
+    return PageRequest(kind, term, start_index, page_size)
+
+
+def next_page(page: PageRequest, returned: int) -> Optional[PageRequest]:
+    """Página siguiente, o None si la actual vino incompleta (no hay más resultados)."""
+    if returned < page.page_size:
+        return None
+    return page._replace(start_index=page.start_index + page.page_size)
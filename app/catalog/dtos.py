@@ -0,0 +1,34 @@
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Optional
+
+
+def _require_non_empty(items: List[str]) -> List[str]:
+    if any(not item for item in items):
+        raise ValueError('Los identificadores no pueden estar vacíos')
+    return items
+
+
+class BulkImportIn(BaseModel):
+    volume_ids: List[str] = []
+    isbns: List[str] = []
+    initial_stock: Optional[int] = Field(None, ge=0, description="Copias iniciales; aleatorio entre 1 y 5 si se omite")
+
+    @field_validator('volume_ids')
+    @classmethod
+    def strip_volume_ids(cls, v):
+        # Los volume_id de Google pueden contener '-': solo se recortan espacios
+        return _require_non_empty([item.strip() if item else "" for item in v])
+
+    @field_validator('isbns')
+    @classmethod
+    def strip_isbns(cls, v):
+        return _require_non_empty([item.strip().replace("-", "") if item else "" for item in v])
+
+    @model_validator(mode='after')
+    def require_items(self):
+        if not self.volume_ids and not self.isbns:
+            raise ValueError('Debe indicar al menos un volume_id o un isbn')
+        return self
+
+    def to_items(self) -> List[dict]:
+        return [{"volume_id": v} for v in self.volume_ids] + [{"isbn": i} for i in self.isbns]
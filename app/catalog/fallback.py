@@ -0,0 +1,89 @@
+"""
+Respuestas del catálogo sin Google Books.
+
+Cuando Google no responde (o el circuit breaker está abierto) y la caché no
+tiene nada que servir, los listados y las fichas se construyen a partir de
+nuestra tabla `books`, con el mismo formato que `_format_book_volume_info`
+y marcados con `"source": "local"`.
+"""
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app.common.models import Book, Inventory, Loan
+from app.extensions import db
+from .classifier import classify
+from .search import search_local_books
+
+
+def _split_isbn(isbn: Optional[str]):
+    if not isbn:
+        return None, None
+    return (isbn, None) if len(isbn) == 13 else (None, isbn)
+
+
+def format_local_book(book: Book) -> dict:
+    isbn_13, isbn_10 = _split_isbn(book.isbn)
+    return {
+        "id": book.volume_id,
+        "title": book.title,
+        "authors": book.author.split(", ") if book.author else [],
+        "publisher": None,
+        "published_date": str(book.publication_year) if book.publication_year else None,
+        "description": book.description,
+        "isbn_13": isbn_13,
+        "isbn_10": isbn_10,
+        "page_count": book.pages,
+        "categories": [book.category.value] if book.category else [],
+        "thumbnail": None,
+        "cover_url": f"/catalog/covers/{book.volume_id}" if book.volume_id else None,
+        "available_copies": book.inventory.available_copies if book.inventory else 0,
+        "source": "local",
+    }
+
+
+def local_volume(volume_id: str) -> Optional[dict]:
+    book = Book.query.options(joinedload(Book.inventory)).filter_by(volume_id=volume_id).first()
+    return format_local_book(book) if book else None
+
+
+def _books_by_ids(ids: List[int]) -> List[Book]:
+    if not ids:
+        return []
+    books = {b.id: b for b in Book.query.options(joinedload(Book.inventory)).filter(Book.id.in_(ids)).all()}
+    return [books[i] for i in ids if i in books]
+
+
+def local_listing(kind: str, term: str, max_results: int, start_index: int = 0) -> List[dict]:
+    """Equivalente local de los listados de Google ("search", "category", "popular")."""
+    if kind == "search":
+        ids = [row["id"] for row in search_local_books(term, limit=max_results, offset=start_index)]
+        books = _books_by_ids(ids)
+    elif kind == "category":
+        category = classify([term])
+        books = (
+            Book.query.outerjoin(Inventory)
+            .options(contains_eager(Book.inventory))
+            .filter(Book.category == category)
+            .order_by(func.coalesce(Inventory.available_copies, 0).desc(), Book.id)
+            .offset(start_index)
+            .limit(max_results)
+            .all()
+        )
+    else:
+        # "Populares": los libros más prestados de la biblioteca
+        loan_counts = (
+            db.session.query(Loan.book_id, func.count(Loan.id).label("loans"))
+            .group_by(Loan.book_id)
+            .subquery()
+        )
+        books = (
+            Book.query.options(joinedload(Book.inventory))
+            .outerjoin(loan_counts, loan_counts.c.book_id == Book.id)
+            .order_by(func.coalesce(loan_counts.c.loans, 0).desc(), Book.id.desc())
+            .offset(start_index)
+            .limit(max_results)
+            .all()
+        )
+    return [format_local_book(book) for book in books]
@@ -0,0 +1,228 @@
+"""
+Cliente HTTP compartido para Google Books API.
+
+Mantiene una única `requests.Session` por proceso (pool de conexiones
+keep-alive), aplica timeouts de conexión/lectura en cada llamada, reintenta
+con backoff exponencial + jitter ante 429/5xx y errores de red, y lleva
+contadores de latencia y errores.
+
+Todas las llamadas pasan por un circuit breaker compartido entre workers:
+si Google empieza a fallar o a responder lento, el circuito se abre y las
+llamadas fallan al instante con `CircuitOpenError` hasta que una sonda
+confirma que Google se ha recuperado.
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+from app.common.circuit_breaker import CircuitBreaker
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+DEFAULT_SETTINGS = {
+    "GOOGLE_BOOKS_CONNECT_TIMEOUT": 3.05,
+    "GOOGLE_BOOKS_READ_TIMEOUT": 10.0,
+    "GOOGLE_BOOKS_MAX_RETRIES": 2,
+    "GOOGLE_BOOKS_BACKOFF_BASE": 0.25,
+    "GOOGLE_BOOKS_BACKOFF_MAX": 4.0,
+    "GOOGLE_BOOKS_POOL_SIZE": 10,
+    "GOOGLE_BOOKS_CB_FAILURE_RATE": 0.5,
+    "GOOGLE_BOOKS_CB_SLOW_CALL_MS": 4000,
+    "GOOGLE_BOOKS_CB_SLOW_CALL_RATE": 0.8,
+    "GOOGLE_BOOKS_CB_MIN_CALLS": 10,
+    "GOOGLE_BOOKS_CB_WINDOW": 30,
+    "GOOGLE_BOOKS_CB_OPEN_SECONDS": 30,
+}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """El circuito está abierto: no se llamó a Google Books."""
+
+
+class GoogleBooksClient:
+    """Sesión HTTP con pool, timeouts, reintentos y métricas."""
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        pool_size: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        # Los reintentos los gestionamos nosotros para poder medirlos
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "status_429": 0,
+            "status_5xx": 0,
+            "status_4xx": 0,
+            "rejected": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
+
+    def _record(self, latency_ms: Optional[float] = None, **increments) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+            if latency_ms is not None:
+                self._stats["total_latency_ms"] += latency_ms
+                self._stats["max_latency_ms"] = max(self._stats["max_latency_ms"], latency_ms)
+
+    def _report(self, success: bool, latency_ms: float) -> None:
+        if self.breaker is not None:
+            self.breaker.record(success, latency_ms)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full jitter: espera aleatoria entre 0 y base * 2^attempt (acotada)."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, timeout=None) -> requests.Response:
+        """
+        GET con reintentos acotados.
+
+        Lanza `requests.exceptions.HTTPError` para respuestas de error finales
+        (p.ej. 404) y `requests.exceptions.RequestException` si se agotan los
+        reintentos por errores de red. Con el circuito abierto lanza
+        `CircuitOpenError` sin llegar a llamar a Google.
+        """
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                self._record(rejected=1)
+                raise CircuitOpenError(f"Circuito abierto para Google Books ({self.breaker.name})")
+
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                is_timeout = isinstance(e, requests.exceptions.Timeout)
+                latency_ms = (time.monotonic() - start) * 1000
+                self._report(False, latency_ms)
+                self._record(
+                    latency_ms=latency_ms,
+                    requests=1,
+                    errors=1,
+                    timeouts=1 if is_timeout else 0,
+                )
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if retryable and attempt < self.max_retries:
+                    self._record(retries=1)
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                raise
+
+            status = response.status_code
+            latency_ms = (time.monotonic() - start) * 1000
+            # 404 y demás 4xx son respuestas válidas de Google; 429 y 5xx no
+            self._report(status not in RETRYABLE_STATUS_CODES, latency_ms)
+            self._record(
+                latency_ms=latency_ms,
+                requests=1,
+                errors=1 if status >= 400 and status != 404 else 0,
+                status_429=1 if status == 429 else 0,
+                status_5xx=1 if status >= 500 else 0,
+                status_4xx=1 if 400 <= status < 500 and status != 429 else 0,
+            )
+
+            if status in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                self._record(retries=1)
+                time.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
+                response.close()
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._stats)
+        completed = snapshot["requests"]
+        snapshot["avg_latency_ms"] = round(snapshot["total_latency_ms"] / completed, 2) if completed else 0.0
+        snapshot["total_latency_ms"] = round(snapshot["total_latency_ms"], 2)
+        snapshot["max_latency_ms"] = round(snapshot["max_latency_ms"], 2)
+        return snapshot
+
+
+_client: Optional[GoogleBooksClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def _setting(name: str):
+    if has_app_context():
+        value = current_app.config.get(name)
+        if value is not None:
+            return value
+    return DEFAULT_SETTINGS[name]
+
+
+def get_client() -> GoogleBooksClient:
+    """
+    Devuelve el cliente del proceso actual.
+    Se recrea tras un fork (workers de gunicorn/celery) para no compartir sockets.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = GoogleBooksClient(
+                    connect_timeout=float(_setting("GOOGLE_BOOKS_CONNECT_TIMEOUT")),
+                    read_timeout=float(_setting("GOOGLE_BOOKS_READ_TIMEOUT")),
+                    max_retries=int(_setting("GOOGLE_BOOKS_MAX_RETRIES")),
+                    backoff_base=float(_setting("GOOGLE_BOOKS_BACKOFF_BASE")),
+                    backoff_max=float(_setting("GOOGLE_BOOKS_BACKOFF_MAX")),
+                    pool_size=int(_setting("GOOGLE_BOOKS_POOL_SIZE")),
+                    breaker=CircuitBreaker(
+                        "google-books",
+                        failure_rate=float(_setting("GOOGLE_BOOKS_CB_FAILURE_RATE")),
+                        slow_call_ms=float(_setting("GOOGLE_BOOKS_CB_SLOW_CALL_MS")),
+                        slow_call_rate=float(_setting("GOOGLE_BOOKS_CB_SLOW_CALL_RATE")),
+                        min_calls=int(_setting("GOOGLE_BOOKS_CB_MIN_CALLS")),
+                        window=int(_setting("GOOGLE_BOOKS_CB_WINDOW")),
+                        open_seconds=float(_setting("GOOGLE_BOOKS_CB_OPEN_SECONDS")),
+                    ),
+                )
+                _client_pid = pid
+    return _client
+
+
+def get_stats() -> Dict[str, Any]:
+    return get_client().stats()
+
+
+def get_breaker() -> CircuitBreaker:
+    return get_client().breaker
@@ -0,0 +1,332 @@
+"""
+Importación idempotente de libros desde Google Books.
+
+Único punto de entrada para "traer de Google y crear Book + Inventory".
+Lo usan el catálogo, los préstamos, el inventario y la lista de espera,
+y `import_books_bulk` para importar listas completas en un solo lote.
+
+La inserción es un upsert `INSERT ... ON CONFLICT DO NOTHING`: en Postgres
+el libro y su inventario se insertan en una sola sentencia (CTE con
+`RETURNING`); en SQLite se usan dos sentencias dentro de la misma
+transacción. Si el libro ya existía se devuelve la fila existente.
+"""
+import hashlib
+import json
+import random
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+from sqlalchemy import select, literal, or_
+from werkzeug.exceptions import NotFound
+
+from app.common.models import Book, Inventory
+from app.common.singleflight import SingleFlight
+from app.common.upsert import dialect_insert
+from app.extensions import db
+from .classifier import classify
+
+# Serializa las importaciones del mismo volume_id entre hilos y workers
+book_import_flight = SingleFlight("book-import", lease_ttl=15.0, wait_timeout=10.0)
+
+StockPolicy = Union[int, Callable[[], int]]
+
+
+class BookImportError(Exception):
+    """Google no devolvió datos suficientes o falló la escritura."""
+
+
+class ImportResult(NamedTuple):
+    book: Book
+    created: bool
+
+
+def random_stock(low: int, high: int) -> Callable[[], int]:
+    return lambda: random.randint(low, high)
+
+
+def parse_publication_year(published_date: Optional[str]) -> Optional[int]:
+    """'2008', '2008-08' y '2008-08-01' -> 2008. Cualquier otra cosa -> None."""
+    if not published_date:
+        return None
+    year = published_date.split("-")[0]
+    return int(year) if year.isdigit() and len(year) == 4 else None
+
+
+# Columnas que provienen de Google Books (las que cubre `content_hash`)
+METADATA_FIELDS = ("title", "author", "description", "isbn", "pages", "publication_year", "category")
+
+
+def metadata_hash(values: dict) -> str:
+    """sha256 de los metadatos de un libro, para detectar cambios sin comparar columna a columna."""
+    canonical = [
+        getattr(values.get(field), "value", values.get(field)) for field in METADATA_FIELDS
+    ]
+    return hashlib.sha256(json.dumps(canonical, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def book_values_from_volume(google_book_data: dict) -> dict:
+    """Mapea el dict de `_format_book_volume_info` a columnas de `books`."""
+    values = {
+        "volume_id": google_book_data.get("id"),
+        "title": (google_book_data.get("title") or "Título no disponible")[:200],
+        "author": ", ".join(google_book_data.get("authors") or []) or "Autor desconocido",
+        "description": google_book_data.get("description"),
+        "isbn": google_book_data.get("isbn_13") or google_book_data.get("isbn_10"),
+        "pages": google_book_data.get("page_count") or 0,
+        "publication_year": parse_publication_year(google_book_data.get("published_date")),
+        "category": classify(google_book_data.get("categories")),
+    }
+    values["content_hash"] = metadata_hash(values)
+    values["refreshed_at"] = datetime.utcnow()
+    return values
+
+
+def _inventory_values(stock: int) -> dict:
+    return {
+        "available_copies": stock,
+        "reserved_copies": 0,
+        "damaged_copies": 0,
+        "total_copies": stock,
+    }
+
+
+def _upsert_book_and_inventory(values: dict, stock: int) -> Optional[int]:
+    """
+    Inserta el libro y su inventario si no existen.
+    Devuelve el id del libro creado, o None si ya existía (conflicto).
+    """
+    book_insert = dialect_insert(Book).values(**values).on_conflict_do_nothing().returning(Book.id)
+
+    if db.session.get_bind().dialect.name == "postgresql":
+        new_book = book_insert.cte("new_book")
+        inventory = _inventory_values(stock)
+        new_inventory = dialect_insert(Inventory).from_select(
+            ["book_id", *inventory.keys()],
+            select(new_book.c.id, *(literal(v) for v in inventory.values())),
+        ).on_conflict_do_nothing().cte("new_inventory")
+        return db.session.execute(select(new_book.c.id).add_cte(new_inventory)).scalar()
+
+    book_id = db.session.execute(book_insert).scalar()
+    if book_id is not None:
+        db.session.execute(
+            dialect_insert(Inventory)
+            .values(book_id=book_id, **_inventory_values(stock))
+            .on_conflict_do_nothing()
+        )
+    return book_id
+
+
+def ensure_inventory(book: Book, stock: StockPolicy = 0) -> None:
+    """Crea el registro de inventario de un libro existente si le falta (idempotente)."""
+    if book.inventory:
+        return
+    initial = stock() if callable(stock) else stock
+    db.session.execute(
+        dialect_insert(Inventory)
+        .values(book_id=book.id, **_inventory_values(initial))
+        .on_conflict_do_nothing()
+    )
+    db.session.commit()
+    db.session.refresh(book)
+
+
+def _find_existing(values: dict) -> Optional[Book]:
+    book = Book.query.filter_by(volume_id=values["volume_id"]).first()
+    if not book and values.get("isbn"):
+        # Mismo ISBN importado con otro volume_id
+        book = Book.query.filter_by(isbn=values["isbn"]).first()
+    return book
+
+
+def import_book(volume_id: str, initial_stock: StockPolicy = 0) -> ImportResult:
+    """
+    Devuelve el libro con ese volume_id, importándolo de Google Books si no existe.
+
+    Args:
+        volume_id: ID de volumen de Google Books.
+        initial_stock: copias iniciales del inventario nuevo (entero o callable).
+
+    Raises:
+        NotFound: el volumen no existe en Google Books.
+        BookImportError: Google no respondió o devolvió datos incompletos.
+    """
+    book = Book.query.filter_by(volume_id=volume_id).first()
+    if book:
+        ensure_inventory(book, initial_stock)
+        return ImportResult(book, False)
+
+    from app.catalog.service import get_book_by_volume_id
+
+    with book_import_flight.lock(volume_id):
+        # Quien esperaba el lock encuentra ya el libro que importó el anterior: sin otra llamada a Google
+        book = Book.query.filter_by(volume_id=volume_id).first()
+        if book:
+            ensure_inventory(book, initial_stock)
+            return ImportResult(book, False)
+
+        google_book_data = get_book_by_volume_id(volume_id)
+        if not google_book_data:
+            raise BookImportError(f"Google Books no respondió para el volumen {volume_id}")
+        if not google_book_data.get("id") or not google_book_data.get("title"):
+            print(f"Datos incompletos del libro de Google Books: {google_book_data}")
+            raise BookImportError(f"Datos incompletos para el volumen {volume_id}")
+
+        values = book_values_from_volume(google_book_data)
+        stock = initial_stock() if callable(initial_stock) else initial_stock
+        try:
+            book_id = _upsert_book_and_inventory(values, stock)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise BookImportError(f"Error al importar el libro {volume_id}: {e}") from e
+
+        if book_id is not None:
+            return ImportResult(db.session.get(Book, book_id), True)
+
+        book = _find_existing(values)
+        if not book:
+            raise BookImportError(f"Conflicto al importar el libro {volume_id}")
+        ensure_inventory(book, initial_stock)
+        return ImportResult(book, False)
+
+
+def _fetch_for_bulk(app, item: dict) -> dict:
+    """Obtiene los metadatos de un elemento del lote (volume_id o ISBN) en un hilo del pool."""
+    from app.catalog.service import get_book_by_volume_id, fetch_listing
+
+    with app.app_context():
+        try:
+            if item.get("volume_id"):
+                data = get_book_by_volume_id(item["volume_id"])
+            else:
+                matches = fetch_listing("search", f"isbn:{item['isbn']}", 1)
+                data = matches[0] if matches else None
+                if matches == []:
+                    raise NotFound(f"ISBN {item['isbn']} no encontrado")
+        except NotFound:
+            return {"status": "not_found"}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    if not data:
+        return {"status": "error", "error": "Google Books no respondió"}
+    if not data.get("id") or not data.get("title"):
+        return {"status": "error", "error": "Datos incompletos en Google Books"}
+    return {"status": "fetched", "data": data}
+
+
+def import_books_bulk(items: List[dict], initial_stock: StockPolicy = random_stock(1, 5),
+                      max_workers: int = 8, progress: Optional[Callable[[int, int], None]] = None) -> List[dict]:
+    """
+    Importa un lote de libros identificados por `{"volume_id": ...}` o `{"isbn": ...}`.
+
+    1. Resuelve en una sola consulta los que ya existen localmente.
+    2. Descarga los que faltan en paralelo con un pool acotado.
+    3. Inserta todos los libros e inventarios nuevos en una única transacción.
+
+    Devuelve un resultado por elemento, en el mismo orden de entrada.
+    """
+    from flask import current_app
+
+    results: List[dict] = [
+        {"input": item, "status": "pending", "book_id": None, "volume_id": None, "title": None}
+        for item in items
+    ]
+    total = len(items)
+    done = 0
+
+    volume_ids = {item["volume_id"] for item in items if item.get("volume_id")}
+    isbns = {item["isbn"] for item in items if item.get("isbn")}
+    existing = Book.query.filter(or_(Book.volume_id.in_(volume_ids), Book.isbn.in_(isbns))).all() \
+        if (volume_ids or isbns) else []
+    by_volume = {b.volume_id: b for b in existing if b.volume_id}
+    by_isbn = {b.isbn: b for b in existing if b.isbn}
+
+    # Elementos pendientes agrupados por clave, para no pedir dos veces el mismo volumen
+    pending: Dict[tuple, List[int]] = {}
+    for index, item in enumerate(items):
+        book = by_volume.get(item.get("volume_id")) or by_isbn.get(item.get("isbn"))
+        if book:
+            results[index].update(status="existing", book_id=book.id, volume_id=book.volume_id, title=book.title)
+            done += 1
+        else:
+            key = ("volume_id", item["volume_id"]) if item.get("volume_id") else ("isbn", item["isbn"])
+            pending.setdefault(key, []).append(index)
+    if progress:
+        progress(done, total)
+
+    app = current_app._get_current_object()
+    fetched: Dict[tuple, dict] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch_for_bulk, app, {key[0]: key[1]}): key for key in pending}
+        for future in as_completed(futures):
+            key = futures[future]
+            outcome = future.result()
+            fetched[key] = outcome
+            if outcome["status"] != "fetched":
+                for index in pending[key]:
+                    results[index].update(status=outcome["status"], error=outcome.get("error"))
+            done += len(pending[key])
+            if progress:
+                progress(done, total)
+
+    rows: Dict[str, dict] = {}
+    for key, outcome in fetched.items():
+        if outcome["status"] == "fetched":
+            values = book_values_from_volume(outcome["data"])
+            rows.setdefault(values["volume_id"], values)
+
+    created_ids: Dict[str, int] = {}
+    if rows:
+        try:
+            inserted = db.session.execute(
+                dialect_insert(Book)
+                .values(list(rows.values()))
+                .on_conflict_do_nothing()
+                .returning(Book.id, Book.volume_id)
+            ).all()
+            created_ids = {volume_id: book_id for book_id, volume_id in inserted}
+            if created_ids:
+                db.session.execute(
+                    dialect_insert(Inventory)
+                    .values([
+                        {"book_id": book_id, **_inventory_values(initial_stock() if callable(initial_stock) else initial_stock)}
+                        for book_id in created_ids.values()
+                    ])
+                    .on_conflict_do_nothing()
+                )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for key, outcome in fetched.items():
+                if outcome["status"] == "fetched":
+                    for index in pending[key]:
+                        results[index].update(status="error", error=f"Error al insertar el lote: {e}")
+            return results
+
+    # Filas que no se crearon por conflicto (importadas por otra petición o ISBN repetido)
+    conflicted = [v for v in rows.values() if v["volume_id"] not in created_ids]
+    if conflicted:
+        found = Book.query.filter(or_(
+            Book.volume_id.in_([v["volume_id"] for v in conflicted]),
+            Book.isbn.in_([v["isbn"] for v in conflicted if v["isbn"]])
+        )).all()
+        by_volume = {b.volume_id: b for b in found}
+        by_isbn = {b.isbn: b for b in found if b.isbn}
+    else:
+        by_volume, by_isbn = {}, {}
+
+    for key, outcome in fetched.items():
+        if outcome["status"] != "fetched":
+            continue
+        values = rows[outcome["data"]["id"]]
+        if values["volume_id"] in created_ids:
+            update = {"status": "created", "book_id": created_ids[values["volume_id"]]}
+        else:
+            book = by_volume.get(values["volume_id"]) or by_isbn.get(values["isbn"])
+            update = {"status": "existing", "book_id": book.id if book else None}
+        for index in pending[key]:
+            results[index].update(volume_id=values["volume_id"], title=values["title"], **update)
+
+    return results
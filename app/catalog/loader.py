@@ -0,0 +1,237 @@
+"""
+Carga masiva de libros desde volcados offline (JSONL o CSV, opcionalmente .gz).
+
+Cada registro tiene la forma de Google Books: un recurso de volumen
+(`{"id": ..., "volumeInfo": {...}}`) o directamente un `volumeInfo` con `id`.
+El fichero se lee en streaming y se escribe por lotes, así que la memoria
+no depende de su tamaño:
+
+  - PostgreSQL: `COPY` a una tabla temporal y `INSERT ... SELECT ... ON CONFLICT
+    DO NOTHING` hacia `books` e `inventory`.
+  - SQLite: `executemany` con `INSERT ... ON CONFLICT DO NOTHING`.
+
+Es idempotente: volver a cargar el mismo volcado no duplica libros.
+"""
+import csv
+import gzip
+import json
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, literal, or_, select, text
+
+from app.common.models import Book, Inventory
+from app.common.upsert import dialect_insert
+from app.extensions import db
+from .importer import _inventory_values, book_values_from_volume
+from .search import deferred_search_index
+
+# Indexar fila a fila con triggers cuesta ~5 veces lo que reconstruir una fila del
+# índice: compensa reconstruir cuando el volcado supera 1/4 de la tabla actual
+DEFER_INDEX_RATIO = 0.25
+
+BOOK_COLUMNS = ("volume_id", "isbn", "title", "author", "description", "pages", "publication_year", "category",
+                "content_hash")
+CSV_LIST_SEPARATOR = ";"
+
+
+class DumpFormatError(ValueError):
+    """El volcado no tiene un formato reconocible."""
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    raise DumpFormatError(f"No se reconoce el formato de {path} (usar --format jsonl|csv)")
+
+
+def _count_records(path: str) -> int:
+    """Número aproximado de registros (líneas) sin cargar el fichero en memoria."""
+    opener = gzip.open if path.endswith(".gz") else open
+    count = 0
+    with opener(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count += chunk.count(b"\n")
+    return count
+
+
+def _should_defer_index(path: str) -> bool:
+    existing = db.session.query(func.count(Book.id)).scalar() or 0
+    return _count_records(path) > existing * DEFER_INDEX_RATIO
+
+
+def _jsonl_records(stream) -> Iterator[dict]:
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _csv_records(stream) -> Iterator[dict]:
+    """Filas CSV con columnas de `volumeInfo` (listas separadas por ';') + ISBN_13/ISBN_10."""
+    for row in csv.DictReader(stream):
+        def as_list(name):
+            return [v.strip() for v in (row.get(name) or "").split(CSV_LIST_SEPARATOR) if v.strip()]
+
+        identifiers = [
+            {"type": kind, "identifier": row[kind].strip()}
+            for kind in ("ISBN_13", "ISBN_10") if (row.get(kind) or "").strip()
+        ]
+        page_count = (row.get("pageCount") or "").strip()
+        yield {
+            "id": (row.get("id") or "").strip() or None,
+            "volumeInfo": {
+                "title": row.get("title"),
+                "authors": as_list("authors"),
+                "publisher": row.get("publisher"),
+                "publishedDate": row.get("publishedDate"),
+                "description": row.get("description") or None,
+                "industryIdentifiers": identifiers,
+                "pageCount": int(page_count) if page_count.isdigit() else None,
+                "categories": as_list("categories"),
+            },
+        }
+
+
+def iter_book_values(stream, fmt: str, stats: Dict[str, int]) -> Iterator[dict]:
+    """Convierte cada registro del volcado en columnas de `books` (o lo descarta)."""
+    from app.catalog.service import _format_book_volume_info
+
+    records = _jsonl_records(stream) if fmt == "jsonl" else _csv_records(stream)
+    for record in records:
+        stats["read"] += 1
+        volume_info = record.get("volumeInfo", record)
+        formatted = _format_book_volume_info(volume_info, volume_id=record.get("id"))
+        if not formatted or not formatted.get("title") or not (formatted.get("id") or formatted.get("isbn_13") or formatted.get("isbn_10")):
+            stats["invalid"] += 1
+            continue
+        values = book_values_from_volume(formatted)
+        values["category"] = values["category"].name
+        # No sabemos de cuándo es el volcado: el refresco (refresh.py) los pondrá al día
+        values["refreshed_at"] = None
+        yield values
+
+
+def _batches(values: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    batch: List[dict] = []
+    for item in values:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_batch_sqlite(batch: List[dict], copies: int) -> int:
+    # Insert de Core sobre la tabla (no el bulk del ORM) para tener executemany y rowcount
+    result = db.session.execute(dialect_insert(Book.__table__).on_conflict_do_nothing(), batch)
+    inserted = max(result.rowcount, 0)
+
+    volume_ids = [v["volume_id"] for v in batch if v["volume_id"]]
+    isbns = [v["isbn"] for v in batch if v["isbn"]]
+    inventory = _inventory_values(copies)
+    db.session.execute(
+        dialect_insert(Inventory).from_select(
+            ["book_id", *inventory.keys()],
+            select(Book.id, *(literal(v) for v in inventory.values())).where(
+                or_(Book.volume_id.in_(volume_ids), Book.isbn.in_(isbns))
+            ),
+        ).on_conflict_do_nothing()
+    )
+    return inserted
+
+
+_PG_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS books_load (
+        volume_id text, isbn text, title text, author text, description text,
+        pages integer, publication_year integer, category text, content_hash text
+    ) ON COMMIT DELETE ROWS
+"""
+
+_PG_INSERT_BOOKS = """
+    INSERT INTO books (volume_id, isbn, title, author, description, pages, publication_year, category, content_hash)
+    SELECT volume_id, isbn, title, author, description, pages, publication_year, category::bookcategory, content_hash
+    FROM books_load
+    ON CONFLICT DO NOTHING
+"""
+
+_PG_INSERT_INVENTORY = """
+    INSERT INTO inventory (book_id, available_copies, reserved_copies, damaged_copies, total_copies, last_updated)
+    SELECT b.id, :copies, 0, 0, :copies, now()
+    FROM books b
+    WHERE b.volume_id IN (SELECT volume_id FROM books_load WHERE volume_id IS NOT NULL)
+       OR b.isbn IN (SELECT isbn FROM books_load WHERE isbn IS NOT NULL)
+    ON CONFLICT (book_id) DO NOTHING
+"""
+
+
+def _write_batch_postgres(batch: List[dict], copies: int) -> int:
+    connection = db.session.connection()
+    connection.execute(text(_PG_STAGING_DDL))
+    raw = connection.connection.driver_connection
+    with raw.cursor() as cursor:
+        with cursor.copy(f"COPY books_load ({', '.join(BOOK_COLUMNS)}) FROM STDIN") as copy:
+            for values in batch:
+                copy.write_row(tuple(values[column] for column in BOOK_COLUMNS))
+    inserted = connection.execute(text(_PG_INSERT_BOOKS)).rowcount
+    connection.execute(text(_PG_INSERT_INVENTORY), {"copies": copies})
+    return inserted
+
+
+def load_dump(path: str, fmt: Optional[str] = None, batch_size: int = 5000, copies: int = 1,
+              defer_index: Optional[bool] = None,
+              progress: Optional[Callable[[Dict[str, float]], None]] = None) -> Dict[str, float]:
+    """
+    Carga un volcado en `books` + `inventory`. Cada lote se confirma por
+    separado, así que una carga interrumpida se puede relanzar sin más.
+    Si el volcado es grande respecto a la tabla (o `defer_index=True`), el
+    índice de búsqueda local se reconstruye una vez al final en lugar de
+    actualizarse fila a fila (ver `deferred_search_index`).
+
+    Devuelve contadores: leídos, descartados, insertados, ya existentes,
+    segundos y filas por segundo.
+    """
+    fmt = fmt or _detect_format(path)
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        write_batch = _write_batch_postgres
+    elif dialect == "sqlite":
+        write_batch = _write_batch_sqlite
+    else:
+        raise DumpFormatError(f"Dialecto no soportado para la carga masiva: {dialect}")
+
+    if defer_index is None:
+        defer_index = _should_defer_index(path)
+
+    stats: Dict[str, float] = {"read": 0, "invalid": 0, "inserted": 0, "existing": 0}
+    start = time.perf_counter()
+    with deferred_search_index(defer_index), _open(path) as stream:
+        for batch in _batches(iter_book_values(stream, fmt, stats), batch_size):
+            try:
+                inserted = write_batch(batch, copies)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            stats["inserted"] += inserted
+            stats["existing"] += len(batch) - inserted
+            elapsed = time.perf_counter() - start
+            stats["seconds"] = round(elapsed, 2)
+            stats["rows_per_second"] = round(stats["read"] / elapsed, 1) if elapsed else 0.0
+            if progress:
+                progress(dict(stats))
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["rows_per_second"] = round(stats["read"] / elapsed, 1) if elapsed else 0.0
+    return stats
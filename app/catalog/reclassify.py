@@ -0,0 +1,83 @@
+"""
+Reclasificación de la categoría de los libros del catálogo.
+
+Hasta que la importación pasó a clasificar siempre (`importer.book_values_from_volume`),
+los libros que entraban por préstamos o inventario quedaban como FICTION.
+Este job recorre `books` por id en bloques (keyset), vuelve a obtener los
+metadatos de Google (pasando por la caché de volúmenes), los clasifica en
+lote y actualiza solo las filas cuya categoría cambia.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from app.common.circuit_breaker import OPEN
+from app.common.models import Book, BookCategory
+from app.extensions import db
+from .classifier import DEFAULT_CATEGORY, classify_many
+from .google_client import get_breaker
+from .importer import _fetch_for_bulk
+
+
+def _candidates(after_id: int, chunk_size: int, only_default: bool):
+    query = select(Book.id, Book.volume_id, Book.category).where(
+        Book.id > after_id, Book.volume_id.isnot(None)
+    )
+    if only_default:
+        query = query.where(Book.category == DEFAULT_CATEGORY)
+    return db.session.execute(query.order_by(Book.id).limit(chunk_size)).all()
+
+
+def reclassify_books(chunk_size: int = 200, after_id: int = 0, only_default: bool = True,
+                     max_workers: int = 8,
+                     progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Reclasifica los libros con id > `after_id`, un bloque de `chunk_size` cada vez.
+
+    Args:
+        only_default: solo los libros con la categoría por defecto (FICTION),
+            que son los sospechosos de estar mal clasificados.
+
+    Se detiene si el circuito de Google Books se abre; `last_id` permite
+    continuar después desde ese punto.
+    """
+    app = current_app._get_current_object()
+    summary = {"scanned": 0, "changed": 0, "errors": 0, "last_id": after_id, "interrupted": False}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            rows = _candidates(summary["last_id"], chunk_size, only_default)
+            if not rows:
+                break
+            if get_breaker().state() == OPEN:
+                summary["interrupted"] = True
+                break
+
+            outcomes = list(executor.map(
+                lambda row: _fetch_for_bulk(app, {"volume_id": row.volume_id}), rows
+            ))
+            fetched = [(row, o["data"]) for row, o in zip(rows, outcomes) if o["status"] == "fetched"]
+            summary["errors"] += sum(1 for o in outcomes if o["status"] == "error")
+
+            categories = classify_many([data.get("categories") for _, data in fetched])
+            changes = [
+                {"id": row.id, "category": category}
+                for (row, _), category in zip(fetched, categories)
+                if BookCategory(row.category) != category
+            ]
+            if changes:
+                # UPDATE por clave primaria en lote (executemany)
+                db.session.execute(update(Book), changes)
+            db.session.commit()
+
+            summary["scanned"] += len(rows)
+            summary["changed"] += len(changes)
+            summary["last_id"] = rows[-1].id
+            print(f"[RECLASSIFY] hasta id {summary['last_id']}: "
+                  f"{summary['changed']} cambiados de {summary['scanned']}")
+            if progress:
+                progress(dict(summary))
+
+    return summary
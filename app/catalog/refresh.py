@@ -0,0 +1,196 @@
+"""
+Refresco en segundo plano de los metadatos de los libros locales.
+
+Las filas de `books` se congelan al importarlas, y algunas quedaron a
+medias (título "Título no disponible", sin autor, sin descripción...).
+Este job recorre `books` por id en bloques (keyset) seleccionando las filas
+viejas o incompletas, las vuelve a pedir a Google con concurrencia acotada y
+un límite de peticiones por segundo, y aplica los cambios con UPDATE en lote.
+
+`content_hash` guarda la huella de los metadatos que dio Google la última
+vez: si no cambia, solo se actualiza `refreshed_at`.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+from werkzeug.exceptions import NotFound
+
+from app.common.circuit_breaker import OPEN
+from app.common.models import Book
+from app.extensions import db
+from .google_client import get_breaker
+from .importer import METADATA_FIELDS, book_values_from_volume
+
+PLACEHOLDER_TITLE = "Título no disponible"
+PLACEHOLDER_AUTHOR = "Autor desconocido"
+
+
+class RateLimiter:
+    """Reparte las llamadas a un ritmo máximo de `rate` por segundo entre hilos."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _incomplete():
+    return or_(
+        Book.title == PLACEHOLDER_TITLE,
+        Book.author.is_(None),
+        Book.author == PLACEHOLDER_AUTHOR,
+        Book.description.is_(None),
+        Book.publication_year.is_(None),
+        Book.pages == 0,
+    )
+
+
+def _candidates(after_id: int, chunk_size: int, stale_before: datetime, retry_incomplete_before: datetime):
+    """Libros nunca refrescados, refrescados antes de `stale_before`, o incompletos (con un reintento más corto)."""
+    query = (
+        select(Book.id, Book.volume_id, Book.content_hash, *(getattr(Book, f) for f in METADATA_FIELDS))
+        .where(
+            Book.id > after_id,
+            Book.volume_id.isnot(None),
+            or_(
+                Book.refreshed_at.is_(None),
+                Book.refreshed_at < stale_before,
+                _incomplete() & (Book.refreshed_at < retry_incomplete_before),
+            ),
+        )
+        .order_by(Book.id)
+        .limit(chunk_size)
+    )
+    return db.session.execute(query).all()
+
+
+def _fetch(app, limiter: RateLimiter, volume_id: str) -> dict:
+    """Metadatos frescos de Google (sin pasar por la caché de volúmenes)."""
+    from app.catalog.service import _fetch_volume
+
+    limiter.wait()
+    with app.app_context():
+        try:
+            data = _fetch_volume(volume_id)
+        except NotFound:
+            return {"status": "not_found"}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+    if not data or not data.get("title"):
+        return {"status": "error", "error": "Google Books no respondió"}
+    return {"status": "fetched", "data": data}
+
+
+def _merge(row, fresh: dict) -> dict:
+    """Valores a escribir: lo nuevo de Google, sin pisar datos buenos con vacíos ni placeholders."""
+    values = {}
+    for field in METADATA_FIELDS:
+        new = fresh[field]
+        if new in (None, "", 0) or (field == "title" and new == PLACEHOLDER_TITLE):
+            continue
+        if field == "isbn" and row.isbn:
+            # El ISBN identifica el libro: solo se rellena si faltaba
+            continue
+        values[field] = new
+    return values
+
+
+def refresh_books(chunk_size: int = 200, after_id: int = 0, max_age_days: int = 30,
+                  incomplete_retry_days: int = 1, max_workers: int = 4, rate: float = 5.0,
+                  progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Refresca los libros con id > `after_id`, un bloque de `chunk_size` cada vez.
+
+    Args:
+        max_age_days: antigüedad a partir de la cual un libro se vuelve a consultar.
+        incomplete_retry_days: los libros incompletos se reintentan con esta frecuencia.
+        max_workers: peticiones simultáneas a Google.
+        rate: peticiones por segundo como máximo (entre todos los hilos).
+
+    Se detiene si el circuito de Google Books se abre; `last_id` permite
+    continuar después desde ese punto.
+    """
+    app = current_app._get_current_object()
+    limiter = RateLimiter(rate)
+    now = datetime.utcnow()
+    stale_before = now - timedelta(days=max_age_days)
+    retry_incomplete_before = now - timedelta(days=incomplete_retry_days)
+    summary = {"scanned": 0, "updated": 0, "unchanged": 0, "not_found": 0, "errors": 0,
+               "last_id": after_id, "interrupted": False}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            rows = _candidates(summary["last_id"], chunk_size, stale_before, retry_incomplete_before)
+            # No mantener abierta la transacción de lectura durante las descargas
+            db.session.rollback()
+            if not rows:
+                break
+            if get_breaker().state() == OPEN:
+                summary["interrupted"] = True
+                break
+
+            outcomes = list(executor.map(lambda row: _fetch(app, limiter, row.volume_id), rows))
+            refreshed_at = datetime.utcnow()
+            # touched: solo se actualiza refreshed_at (sin cambios, o ya no existe en Google)
+            touched_ids, changes = [], []
+            for row, outcome in zip(rows, outcomes):
+                if outcome["status"] == "not_found":
+                    summary["not_found"] += 1
+                    touched_ids.append(row.id)
+                    continue
+                if outcome["status"] != "fetched":
+                    summary["errors"] += 1
+                    continue
+                fresh = book_values_from_volume(outcome["data"])
+                if fresh["content_hash"] == row.content_hash:
+                    summary["unchanged"] += 1
+                    touched_ids.append(row.id)
+                    continue
+                values = {f: v for f, v in _merge(row, fresh).items() if getattr(row, f) != v}
+                changes.append({"id": row.id, **values, "content_hash": fresh["content_hash"],
+                                "refreshed_at": refreshed_at})
+                summary["updated" if values else "unchanged"] += 1
+
+            # Un ISBN nuevo no puede chocar con el de otro libro (columna única)
+            new_isbns = [c["isbn"] for c in changes if c.get("isbn")]
+            if new_isbns:
+                taken = set(db.session.execute(select(Book.isbn).where(Book.isbn.in_(new_isbns))).scalars())
+                for change in changes:
+                    isbn = change.get("isbn")
+                    if isbn in taken:
+                        del change["isbn"]
+                    elif isbn:
+                        taken.add(isbn)
+
+            if touched_ids:
+                db.session.execute(
+                    update(Book).where(Book.id.in_(touched_ids)).values(refreshed_at=refreshed_at)
+                )
+            # UPDATE por clave primaria en lote (executemany), agrupado por columnas modificadas
+            for columns in {tuple(sorted(c)) for c in changes}:
+                db.session.execute(update(Book), [c for c in changes if tuple(sorted(c)) == columns])
+            db.session.commit()
+
+            summary["scanned"] += len(rows)
+            summary["last_id"] = rows[-1].id
+            print(f"[REFRESH] hasta id {summary['last_id']}: {summary['updated']} actualizados, "
+                  f"{summary['unchanged']} sin cambios de {summary['scanned']}")
+            if progress:
+                progress(dict(summary))
+
+    return summary
@@ -1,7 +1,23 @@
-from flask import Blueprint, request, jsonify
+from collections import Counter
+import click
+from flask import Blueprint, request, jsonify, current_app, url_for, send_file
+from pydantic import ValidationError as PydanticValidationError
 from werkzeug.exceptions import NotFound, BadRequest
 from flask_jwt_extended import jwt_required
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from app.common.security import role_required
 from . import service as catalog_service
+from . import google_client
+from . import classifier
+from . import covers
+from . import search as local_search
+from .cache import get_volume_cache, get_query_cache
+from .cursor import InvalidCursor, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from .dtos import BulkImportIn
+from .importer import import_books_bulk, random_stock, book_import_flight
+from .loader import load_dump
+from .tasks import bulk_import_async
 
 bp = Blueprint("catalog", __name__)
 
@@ -22,6 +38,15 @@ def handle_bad_request(e):
         "message": "La solicitud no es válida"
     }), 400
 
+@bp.errorhandler(JWTExtendedException)
+@bp.errorhandler(PyJWTError)
+def handle_auth_error(e):
+    # Sin esto el manejador genérico de abajo convierte un token ausente o inválido en 500
+    return jsonify({
+        "code": "UNAUTHORIZED",
+        "message": "Token ausente o inválido"
+    }), 401
+
 @bp.errorhandler(Exception)
 def handle_internal_error(e):
     # Proper logging should be implemented here
@@ -31,15 +56,44 @@ def handle_internal_error(e):
         "message": "Ha ocurrido un error interno en el servidor"
     }), 500
 
+def _paged_listing(kind: str, term, default_page_size: int) -> dict:
+    """
+    Resuelve la página pedida (`?cursor=` o `?page_size=`) de un listado y
+    devuelve el cuerpo de la respuesta con `next_cursor`.
+    """
+    cursor = request.args.get("cursor")
+    if cursor:
+        page = decode_cursor(cursor)
+        if page.kind != kind or (term is not None and " ".join(term.split()).lower() != page.term.lower()):
+            raise InvalidCursor("El cursor no corresponde a este listado")
+    else:
+        page_size = request.args.get("page_size", default_page_size, type=int)
+        page = catalog_service.first_page(kind, term, max(1, min(page_size, MAX_PAGE_SIZE)))
+
+    results, following = catalog_service.list_page(page)
+    return {
+        "books": results,
+        "count": len(results),
+        "next_cursor": encode_cursor(following) if following else None
+    }
+
+@bp.errorhandler(InvalidCursor)
+def handle_invalid_cursor(e):
+    return jsonify({
+        "code": "INVALID_CURSOR",
+        "message": str(e)
+    }), 400
+
 @bp.route("/books", methods=["GET"])
 def list_books():
     """
-    Lista libros populares/destacados de Google Books API.
-    Usage: GET /catalog/books
+    Lista libros populares/destacados de Google Books API, paginados con cursor.
+    Usage: GET /catalog/books?page_size=20  ->  GET /catalog/books?cursor=<next_cursor>
     """
     try:
-        results = catalog_service.list_popular_books(max_results=20)
-        return jsonify({"books": results, "count": len(results)}), 200
+        return jsonify(_paged_listing("popular", "bestseller", 20)), 200
+    except InvalidCursor:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
@@ -59,14 +113,8 @@ def add_book():
     volume_id = json_data["volume_id"]
     
     try:
-        # Usamos la función add_book_to_catalog que devuelve el libro (nuevo o existente)
-        book = catalog_service.add_book_to_catalog(volume_id)
-        
-        # Determinamos si el libro fue recién creado para el mensaje y código de estado
-        # Asumimos que si la operación fue un commit, fue nuevo. SQLAlchemy no da un feedback directo.
-        # Una forma simple es ver si ya tenía un id antes, pero la lógica está encapsulada.
-        # Por simplicidad, podemos retornar un mensaje más genérico o basarnos en si ya existía.
-        # La lógica en el servicio ya previene duplicados, así que podemos confiar en ella.
+        # Importación idempotente: devuelve el libro existente o lo crea
+        book, created = catalog_service.add_book_to_catalog(volume_id)
         
         # Manually serialize the book object for the response
         book_data = {
@@ -78,11 +126,15 @@ def add_book():
             "isbn": book.isbn
         }
         
-        # Aunque no podemos saber con certeza si fue creado en esta llamada, informamos del éxito.
+        if created:
+            return jsonify({
+                "message": "Libro añadido exitosamente al catálogo.",
+                "book": book_data
+            }), 201
         return jsonify({
-            "message": "Libro procesado exitosamente en el catálogo.",
+            "message": "El libro ya existía en el catálogo.",
             "book": book_data
-        }), 200 # HTTP 200 OK es más adecuado que 201 si no garantizamos la creación.
+        }), 200
     except NotFound as e:
         return jsonify({"code": "BOOK_NOT_FOUND_IN_GOOGLE", "message": str(e)}), 404
     except Exception as e:
@@ -91,24 +143,104 @@ def add_book():
         return jsonify({"code": "INTERNAL_ERROR", "message": "Ocurrió un error al procesar su solicitud."}), 500
 
 
+@bp.route("/books/bulk", methods=["POST"])
+@jwt_required()
+def bulk_add_books():
+    """
+    Importa una lista de libros (volume_ids y/o ISBNs) en un solo lote.
+    Las listas grandes se procesan en segundo plano con Celery (202 + task_id).
+    Usage: POST /catalog/books/bulk {"volume_ids": [...], "isbns": [...]}
+    """
+    try:
+        data = BulkImportIn.model_validate(request.get_json() or {})
+    except PydanticValidationError as e:
+        errors = [{"field": ".".join(map(str, err["loc"])), "message": err["msg"]} for err in e.errors()]
+        return jsonify({"code": "VALIDATION_ERROR", "errors": errors}), 422
+
+    items = data.to_items()
+    max_items = current_app.config["BULK_IMPORT_MAX_ITEMS"]
+    if len(items) > max_items:
+        return jsonify({
+            "code": "TOO_MANY_ITEMS",
+            "message": f"El lote admite como máximo {max_items} libros."
+        }), 422
+
+    if len(items) > current_app.config["BULK_IMPORT_SYNC_LIMIT"]:
+        task = bulk_import_async.delay(items, data.initial_stock)
+        return jsonify({
+            "task_id": task.id,
+            "status": "QUEUED",
+            "total": len(items),
+            "status_url": url_for("catalog.bulk_import_status", task_id=task.id)
+        }), 202
+
+    results = import_books_bulk(
+        items,
+        initial_stock=data.initial_stock if data.initial_stock is not None else random_stock(1, 5),
+        max_workers=current_app.config["BULK_IMPORT_WORKERS"]
+    )
+    return jsonify({
+        "results": results,
+        "summary": dict(Counter(r["status"] for r in results)),
+        "total": len(results)
+    }), 200
+
+
+@bp.route("/books/bulk/<string:task_id>", methods=["GET"])
+@jwt_required()
+def bulk_import_status(task_id):
+    """
+    Estado y progreso de una importación masiva en segundo plano.
+    Usage: GET /catalog/books/bulk/<task_id>
+    """
+    result = bulk_import_async.AsyncResult(task_id)
+    response = {"task_id": task_id, "status": result.state}
+    if result.state == "PROGRESS":
+        response.update(result.info or {})
+    elif result.state == "SUCCESS":
+        response.update(result.result or {})
+    elif result.state == "FAILURE":
+        response["error"] = str(result.info)
+    return jsonify(response), 200
+
+
 @bp.route("/books/search", methods=["GET"])
 def search_books():
     """
-    Searches for books on the external Google Books API.
-    Usage: GET /catalog/books/search?q=clean+code
+    Searches for books on the external Google Books API (cursor-paginated).
+    Usage: GET /catalog/books/search?q=clean+code&page_size=10
+           GET /catalog/books/search?cursor=<next_cursor>
     """
     query = request.args.get("q")
-    if not query:
+    if not query and not request.args.get("cursor"):
         return jsonify({"error": "El parámetro 'q' (query) es requerido"}), 400
 
     try:
-        results = catalog_service.search_books_online(query)
-        return jsonify({"books": results, "count": len(results)}), 200
+        return jsonify(_paged_listing("search", query, 10)), 200
+    except InvalidCursor:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
         raise e
 
+@bp.route("/local/search", methods=["GET"])
+def search_local_books():
+    """
+    Busca en los libros que tenemos en la biblioteca (sin consultar Google).
+    Usage: GET /catalog/local/search?q=clean+code&available=true&limit=20&offset=0
+    """
+    query = request.args.get("q")
+    if not query:
+        return jsonify({"error": "El parámetro 'q' (query) es requerido"}), 400
+
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    available_only = request.args.get("available", "false").lower() in ("1", "true", "yes")
+
+    results = local_search.search_local_books(query, limit=limit, offset=offset, available_only=available_only)
+    return jsonify({"books": results, "count": len(results), "limit": limit, "offset": offset}), 200
+
 @bp.route("/books/id/<string:volume_id>", methods=["GET"])
 def get_book_details(volume_id):
     """
@@ -117,6 +249,11 @@ def get_book_details(volume_id):
     """
     try:
         book = catalog_service.get_book_by_volume_id(volume_id)
+        if book is None:
+            return jsonify({
+                "code": "GOOGLE_BOOKS_UNAVAILABLE",
+                "message": "Google Books no está disponible y el libro no está en el catálogo local."
+            }), 503
         return jsonify(book), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
@@ -128,13 +265,105 @@ def get_book_details(volume_id):
 @bp.route("/books/category/<string:category>", methods=["GET"])
 def search_by_category(category):
     """
-    Searches for books by category/subject on Google Books API.
-    Usage: GET /catalog/books/category/Technology
+    Searches for books by category/subject on Google Books API (cursor-paginated).
+    Usage: GET /catalog/books/category/Technology?page_size=10&cursor=<next_cursor>
     """
     try:
-        results = catalog_service.search_books_by_category(category)
-        return jsonify({"books": results, "category": category, "count": len(results)}), 200
+        body = _paged_listing("category", category, 10)
+        body["category"] = category
+        return jsonify(body), 200
+    except InvalidCursor:
+        raise
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
     except Exception as e:
-        raise e
\ No newline at end of file
+        raise e
+
+@bp.route("/covers/<string:volume_id>", methods=["GET"])
+def get_cover(volume_id):
+    """
+    Portada de un libro servida desde la caché local en disco (se descarga
+    de Google la primera vez). Admite If-None-Match (ETag = sha256 de la imagen).
+    Usage: GET /catalog/covers/zvQYMgAACAAJ
+    """
+    try:
+        cover = covers.get_cover(volume_id)
+    except covers.CoverUnavailable:
+        response = jsonify({
+            "code": "COVER_UNAVAILABLE",
+            "message": "No se pudo obtener la portada en este momento."
+        })
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    if cover is covers.MISSING:
+        return jsonify({"code": "COVER_NOT_FOUND", "message": "El libro no tiene portada."}), 404
+
+    return send_file(
+        cover.path,
+        mimetype=cover.mimetype,
+        etag=cover.sha256,
+        max_age=current_app.config.get("COVER_MAX_AGE", 30 * 86400),
+        conditional=True,
+    )
+
+@bp.route("/metrics", methods=["GET"])
+@role_required("staff")
+def catalog_metrics():
+    """
+    Contadores del cliente de Google Books y de las cachés del catálogo (por proceso)
+    y estado del circuit breaker (compartido entre workers). Solo personal.
+    Usage: GET /catalog/metrics
+    """
+    return jsonify({
+        "google_books": google_client.get_stats(),
+        "volume_cache": get_volume_cache().stats(),
+        "query_cache": get_query_cache().stats(),
+        "singleflight": {
+            "volume": catalog_service.volume_flight.stats(),
+            "book_import": book_import_flight.stats()
+        },
+        "circuit_breaker": google_client.get_breaker().stats(),
+        "classifier": classifier.cache_info(),
+        "covers": covers.get_cover_store().stats()
+    }), 200
+
+
+@bp.cli.command("load-dump")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]), default=None,
+              help="Formato del volcado (por defecto, según la extensión).")
+@click.option("--batch-size", default=5000, show_default=True, help="Filas por lote/transacción.")
+@click.option("--copies", default=1, show_default=True, help="Copias iniciales en el inventario de cada libro nuevo.")
+@click.option("--defer-index/--no-defer-index", default=None,
+              help="Reconstruir el índice de búsqueda al final (por defecto, si el volcado es grande).")
+def load_dump_command(path, fmt, batch_size, copies, defer_index):
+    """
+    Carga un volcado de metadatos (JSONL/CSV con forma de Google Books) en el catálogo.
+    Usage: flask --app app.wsgi catalog load-dump libros.jsonl.gz --copies 2
+    """
+    def report(stats):
+        click.echo(
+            f"[LOAD] {int(stats['read'])} leídos, {int(stats['inserted'])} nuevos, "
+            f"{int(stats['existing'])} ya existían, {int(stats['invalid'])} descartados "
+            f"({stats['rows_per_second']} filas/s)"
+        )
+
+    stats = load_dump(path, fmt=fmt, batch_size=batch_size, copies=copies,
+                      defer_index=defer_index, progress=report)
+    click.echo(
+        f"Carga completada en {stats['seconds']}s: {int(stats['inserted'])} libros nuevos, "
+        f"{stats['rows_per_second']} filas/s"
+    )
+
+
+@bp.cli.command("ensure-schema")
+def ensure_schema_command():
+    """
+    Alias de `flask --app app.wsgi ensure-schema` (app/common/schema.py).
+    Usage: flask --app app.wsgi catalog ensure-schema
+    """
+    from app.common.schema import ensure_schema
+
+    ensure_schema(force=True)
+    click.echo("Esquema del catálogo actualizado.")
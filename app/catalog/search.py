@@ -0,0 +1,207 @@
+"""
+Búsqueda local de texto completo sobre la tabla `books`.
+
+- Postgres: índice GIN sobre una expresión `tsvector` ponderada
+  (título/ISBN > autor > descripción), consultas con prefijo `palabra:*`
+  y orden por `ts_rank_cd`.
+- SQLite: tabla virtual FTS5 con contenido externo (`content='books'`),
+  sincronizada con triggers, y orden por `bm25`.
+
+En ambos casos el índice se mantiene dentro de la base de datos: cualquier
+INSERT/UPDATE sobre `books` (importación individual, masiva o carga offline)
+queda indexado sin pasos adicionales. `ensure_search_index()` crea el índice
+si falta; se ejecuta al arrancar la aplicación, fuera de las peticiones.
+"""
+import re
+import threading
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import inspect, text
+
+from app.extensions import db
+
+MAX_QUERY_TERMS = 8
+
+# Debe coincidir exactamente con la expresión del índice para que Postgres lo use
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(books.title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(books.isbn, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(books.author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(books.description, '')), 'C')"
+)
+
+_PG_INDEX_DDL = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_books_search ON books USING GIN (({PG_SEARCH_VECTOR}))"
+
+_SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, description, isbn,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, description, isbn)
+        VALUES (new.id, new.title, new.author, new.description, new.isbn);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.description, old.isbn);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.description, old.isbn);
+        INSERT INTO books_fts(rowid, title, author, description, isbn)
+        VALUES (new.id, new.title, new.author, new.description, new.isbn);
+    END
+    """,
+]
+
+_index_ready = False
+_index_lock = threading.Lock()
+
+
+def _dialect() -> str:
+    return db.session.get_bind().dialect.name
+
+
+def ensure_search_index() -> None:
+    """
+    Crea el índice de búsqueda si no existe (una vez por proceso). Se ejecuta
+    al arrancar la aplicación y en `catalog ensure-schema`, nunca desde una
+    petición: usa su propia conexión y no toca la sesión del llamador.
+    """
+    global _index_ready
+    if _index_ready:
+        return
+    with _index_lock:
+        if _index_ready:
+            return
+        if not inspect(db.engine).has_table("books"):
+            return
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            # CONCURRENTLY no bloquea las escrituras sobre `books` y no admite transacción
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text(_PG_INDEX_DDL))
+        elif dialect == "sqlite":
+            with db.engine.begin() as connection:
+                exists = connection.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+                ).first()
+                for statement in _SQLITE_FTS_DDL:
+                    connection.execute(text(statement))
+                if not exists:
+                    # Indexar las filas que ya existían antes de crear la tabla FTS
+                    connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+        _index_ready = True
+
+
+def rebuild_search_index() -> None:
+    """Reconstruye el índice completo (p.ej. tras una carga masiva sin triggers)."""
+    ensure_search_index()
+    dialect = _dialect()
+    if dialect == "postgresql":
+        db.session.execute(text("REINDEX INDEX ix_books_search"))
+    elif dialect == "sqlite":
+        db.session.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+@contextmanager
+def deferred_search_index(enabled: bool = True):
+    """
+    Para cargas masivas en SQLite: quita los triggers de FTS5 durante la carga
+    y reconstruye el índice una sola vez al terminar (varias veces más rápido
+    que indexar fila a fila, pero la reconstrucción recorre toda la tabla).
+    En Postgres el índice GIN se mantiene solo.
+    """
+    ensure_search_index()
+    if not enabled or _dialect() != "sqlite":
+        yield
+        return
+    for trigger in ("books_fts_ai", "books_fts_ad", "books_fts_au"):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    db.session.commit()
+    try:
+        yield
+    finally:
+        db.session.rollback()
+        for statement in _SQLITE_FTS_DDL[1:]:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+        db.session.commit()
+
+
+def _terms(query: str) -> List[str]:
+    return re.findall(r"\w+", (query or "").lower())[:MAX_QUERY_TERMS]
+
+
+def search_local_books(query: str, limit: int = 20, offset: int = 0,
+                       available_only: bool = False) -> List[dict]:
+    """
+    Busca en los libros locales por título, autor, descripción e ISBN.
+    Cada término se busca como prefijo ("clea cod" encuentra "Clean Code").
+    Devuelve los libros ordenados por relevancia con su disponibilidad.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+
+    dialect = _dialect()
+    availability_filter = "AND COALESCE(inventory.available_copies, 0) > 0" if available_only else ""
+    columns = """
+        books.id, books.volume_id, books.title, books.author, books.isbn,
+        books.category, books.publication_year,
+        COALESCE(inventory.available_copies, 0) AS available_copies,
+        COALESCE(inventory.total_copies, 0) AS total_copies
+    """
+
+    if dialect == "postgresql":
+        sql = f"""
+            SELECT {columns}, ts_rank_cd({PG_SEARCH_VECTOR}, q) AS rank
+            FROM books
+            LEFT JOIN inventory ON inventory.book_id = books.id,
+                 to_tsquery('simple', :tsquery) AS q
+            WHERE {PG_SEARCH_VECTOR} @@ q {availability_filter}
+            ORDER BY rank DESC, books.id
+            LIMIT :limit OFFSET :offset
+        """
+        params = {"tsquery": " & ".join(f"{t}:*" for t in terms)}
+    elif dialect == "sqlite":
+        sql = f"""
+            SELECT {columns}, -bm25(books_fts, 10.0, 4.0, 1.0, 10.0) AS rank
+            FROM books_fts
+            JOIN books ON books.id = books_fts.rowid
+            LEFT JOIN inventory ON inventory.book_id = books.id
+            WHERE books_fts MATCH :match {availability_filter}
+            ORDER BY rank DESC, books.id
+            LIMIT :limit OFFSET :offset
+        """
+        params = {"match": " ".join(f'"{t}"*' for t in terms)}
+    else:
+        raise ValueError(f"Búsqueda local no soportada para el dialecto {dialect}")
+
+    params.update(limit=limit, offset=offset)
+    rows = db.session.execute(text(sql), params).mappings().all()
+    return [
+        {
+            "id": row["id"],
+            "volume_id": row["volume_id"],
+            "title": row["title"],
+            "author": row["author"],
+            "isbn": row["isbn"],
+            "category": row["category"],
+            "publication_year": row["publication_year"],
+            "available_copies": row["available_copies"],
+            "total_copies": row["total_copies"],
+            "rank": round(float(row["rank"]), 4),
+        }
+        for row in rows
+    ]
@@ -1,16 +1,34 @@
 import requests
-import random
+import threading
+import time
 from flask import current_app
 from werkzeug.exceptions import NotFound
-from app.common.models import Book, Inventory, BookCategory
-from app.extensions import db
+from app.common.singleflight import SingleFlight
+from app.common.circuit_breaker import CLOSED
+from app.common.degraded import mark_degraded
+from .google_client import get_client, get_breaker
+from .classifier import classify
+from .fallback import local_listing, local_volume
+from .cursor import PageRequest, next_page
+from .cache import get_volume_cache, get_query_cache, MISS, NOT_FOUND
+from .tasks import refresh_listing_async
+from .importer import import_book, random_stock
 
+# Valor por defecto; se puede sobrescribir con GOOGLE_BOOKS_API_URL en la configuración
 GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes"
 
+# Coalesce las consultas simultáneas del mismo volumen
+volume_flight = SingleFlight("catalog-volume")
+
+# Tras un fallo al encolar en Celery, los refrescos van a un hilo local durante este tiempo
+BROKER_RETRY_SECONDS = 30.0
+_broker_down_until = 0.0
+
 def _map_google_category_to_book_category(google_categories):
     """
     Mapea las categorías de Google Books al enum BookCategory.
     Google Books puede devolver múltiples categorías, tomamos la primera que coincida.
+    Delegado en `app.catalog.classifier` (matcher precompilado y memoizado).
     
     Args:
         google_categories: Lista de categorías de Google Books (ej: ["Computers", "Programming"])
@@ -18,63 +36,7 @@ def _map_google_category_to_book_category(google_categories):
     Returns:
         BookCategory enum value
     """
-    if not google_categories:
-        return BookCategory.FICTION  # Default
-    
-    # Mapeo de palabras clave de Google Books a nuestras categorías
-    category_mapping = {
-        "fiction": BookCategory.FICTION,
-        "novel": BookCategory.FICTION,
-        "non-fiction": BookCategory.NON_FICTION,
-        "nonfiction": BookCategory.NON_FICTION,
-        "science": BookCategory.SCIENCE,
-        "physics": BookCategory.SCIENCE,
-        "chemistry": BookCategory.SCIENCE,
-        "biology": BookCategory.SCIENCE,
-        "mathematics": BookCategory.SCIENCE,
-        "math": BookCategory.SCIENCE,
-        "technology": BookCategory.TECHNOLOGY,
-        "computers": BookCategory.TECHNOLOGY,
-        "computer": BookCategory.TECHNOLOGY,
-        "programming": BookCategory.TECHNOLOGY,
-        "software": BookCategory.TECHNOLOGY,
-        "history": BookCategory.HISTORY,
-        "historical": BookCategory.HISTORY,
-        "biography": BookCategory.BIOGRAPHY,
-        "autobiography": BookCategory.BIOGRAPHY,
-        "memoir": BookCategory.BIOGRAPHY,
-        "self-help": BookCategory.SELF_HELP,
-        "self help": BookCategory.SELF_HELP,
-        "psychology": BookCategory.SELF_HELP,
-        "business": BookCategory.BUSINESS,
-        "economics": BookCategory.BUSINESS,
-        "entrepreneurship": BookCategory.BUSINESS,
-        "management": BookCategory.BUSINESS,
-        "finance": BookCategory.BUSINESS,
-        "education": BookCategory.EDUCATION,
-        "teaching": BookCategory.EDUCATION,
-        "learning": BookCategory.EDUCATION,
-        "literature": BookCategory.LITERATURE,
-        "literary": BookCategory.LITERATURE,
-        "poetry": BookCategory.LITERATURE,
-        "drama": BookCategory.LITERATURE,
-    }
-    
-    # Buscar en todas las categorías de Google Books
-    for google_cat in google_categories:
-        google_cat_lower = google_cat.lower().strip()
-        
-        # Primero intentar coincidencia exacta
-        if google_cat_lower in category_mapping:
-            return category_mapping[google_cat_lower]
-        
-        # Luego buscar si alguna palabra clave está contenida en la categoría
-        for keyword, book_category in category_mapping.items():
-            if keyword in google_cat_lower:
-                return book_category
-    
-    # Si no hay coincidencia, retornar default
-    return BookCategory.FICTION
+    return classify(google_categories)
 
 def _format_book_volume_info(volume_info, volume_id=None):
     if not volume_info:
@@ -94,23 +56,55 @@ def _format_book_volume_info(volume_info, volume_id=None):
         "isbn_10": next((i["identifier"] for i in volume_info.get("industryIdentifiers", []) if i["type"] == "ISBN_10"), None),
         "page_count": volume_info.get("pageCount"),
         "categories": volume_info.get("categories", []),
-        "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail")
+        "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail"),
+        # Misma portada servida por nuestro proxy (caché en disco)
+        "cover_url": f"/catalog/covers/{book_id}" if book_id and volume_info.get("imageLinks") else None
     }
 
-def get_book_by_volume_id(volume_id: str):
-   
+def _get_api_key():
     api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
     if not api_key:
         raise ValueError("La API Key de Google Books no está configurada.")
+    return api_key
+
+def _api_url():
+    return (current_app.config.get("GOOGLE_BOOKS_API_URL") or GOOGLE_BOOKS_API_URL).rstrip("/")
 
-    url = f"{GOOGLE_BOOKS_API_URL}/{volume_id}"
+def _fetch_volumes(params: dict):
+    """
+    Ejecuta una búsqueda en Google Books y devuelve la lista de libros formateados.
+    Ante errores de conexión devuelve None (para no cachear un fallo como lista vacía).
+    """
+    try:
+        response = get_client().get(_api_url(), params=params)
+    except requests.exceptions.RequestException as e:
+        print(f"Error al conectar con Google Books API: {e}")
+        return None
+
+    data = response.json()
+    items = data.get("items", [])
+
+    return [_format_book_volume_info(item.get("volumeInfo"), volume_id=item.get("id")) for item in items]
+
+def _read_cached_volume(volume_id: str):
+    """Lector para single-flight: el resultado que otro worker dejó en caché."""
+    cached = get_volume_cache().get(volume_id)
+    if cached is NOT_FOUND:
+        raise NotFound(f"No se encontró ningún libro con el ID de volumen: {volume_id}")
+    return None if cached is MISS else cached
+
+def _fetch_volume(volume_id: str):
+    volume_cache = get_volume_cache()
+    api_key = _get_api_key()
+
+    url = f"{_api_url()}/{volume_id}"
     params = {"key": api_key}
 
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        response = get_client().get(url, params=params)
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 404:
+            volume_cache.set_not_found(volume_id)
             raise NotFound(f"No se encontró ningún libro con el ID de volumen: {volume_id}")
         print(f"Error HTTP al conectar con Google Books API: {e}")
         return None
@@ -119,62 +113,144 @@ def get_book_by_volume_id(volume_id: str):
         return None
 
     data = response.json()
-    return _format_book_volume_info(data.get("volumeInfo"), volume_id=data.get("id"))
+    result = _format_book_volume_info(data.get("volumeInfo"), volume_id=data.get("id"))
+    if result:
+        volume_cache.set(volume_id, result)
+    return result
 
-def search_books_online(query: str, max_results: int = 10):
+def get_book_by_volume_id(volume_id: str):
+    """
+    Obtiene los metadatos de un volumen de Google Books.
+    Se sirve desde la caché de volúmenes (memoria -> Redis) y solo va a
+    Google en caso de fallo de caché. Los 404 también se cachean.
+    Las consultas simultáneas del mismo volumen comparten una única llamada.
+    Si Google no responde se devuelve el libro de nuestra tabla `books`,
+    si lo tenemos (respuesta degradada).
+    """
+    cached = _read_cached_volume(volume_id)
+    if cached is not None:
+        return dict(cached)
 
-    api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-    if not api_key:
-        raise ValueError("La API Key de Google Books no está configurada.")
+    result = volume_flight.do(
+        volume_id,
+        lambda: _fetch_volume(volume_id),
+        reader=lambda: _read_cached_volume(volume_id)
+    )
+    if result is not None:
+        return dict(result)
 
-    params = {
-        "q": query,
-        "key": api_key,
-        "maxResults": max_results
-    }
+    mark_degraded("google-books")
+    return local_volume(volume_id)
+
+def _listing_params(kind: str, term: str, max_results: int, start_index: int = 0) -> dict:
+    if kind == "popular":
+        params = {"q": "bestseller", "orderBy": "relevance", "maxResults": max_results}
+    elif kind == "category":
+        params = {"q": f"subject:{term}", "maxResults": max_results}
+    else:
+        params = {"q": term, "maxResults": max_results}
+    if start_index:
+        params["startIndex"] = start_index
+    return params
+
+def fetch_listing(kind: str, term: str, max_results: int, start_index: int = 0):
+    """
+    Consulta un listado directamente a Google Books, sin caché.
+    Devuelve None si Google no respondió correctamente.
+    """
+    params = _listing_params(kind, term, max_results, start_index)
+    params["key"] = _get_api_key()
+    return _fetch_volumes(params)
 
+def refresh_listing(kind: str, term: str, max_results: int, start_index: int = 0) -> bool:
+    """
+    Recarga un listado en la caché de consultas. Lo usan el refresco en
+    segundo plano y la precarga de la página siguiente.
+    """
+    query_cache = get_query_cache()
+    key = query_cache.make_key(kind, term, max_results, start_index)
     try:
-        response = requests.get(GOOGLE_BOOKS_API_URL, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con Google Books API: {e}")
-        return []
+        data = fetch_listing(kind, term, max_results, start_index)
+        if data is None:
+            return False
+        query_cache.store(key, data)
+        return True
+    finally:
+        query_cache.release_refresh(key)
 
-    data = response.json()
-    items = data.get("items", [])
-    
-    results = [_format_book_volume_info(item.get("volumeInfo"), volume_id=item.get("id")) for item in items]
-        
+def _refresh_listing_in_thread(app, kind: str, term: str, max_results: int, start_index: int = 0):
+    with app.app_context():
+        refresh_listing(kind, term, max_results, start_index)
+
+def _schedule_listing_refresh(kind: str, term: str, max_results: int, start_index: int = 0):
+    global _broker_down_until
+    if time.monotonic() >= _broker_down_until:
+        try:
+            refresh_listing_async.delay(kind, term, max_results, start_index)
+            return
+        except Exception as e:
+            # No volver a esperar al broker en cada petición durante un rato
+            _broker_down_until = time.monotonic() + BROKER_RETRY_SECONDS
+            print(f"[CATALOG CACHE] No se pudo encolar el refresco ({e}), usando hilo local")
+
+    # Sin broker disponible, refrescar en un hilo del propio proceso
+    app = current_app._get_current_object()
+    threading.Thread(
+        target=_refresh_listing_in_thread,
+        args=(app, kind, term, max_results, start_index),
+        daemon=True
+    ).start()
+
+def _cached_listing(kind: str, term: str, max_results: int, start_index: int = 0):
+    _get_api_key()
+    term = " ".join((term or "").split())
+    query_cache = get_query_cache()
+    key = query_cache.make_key(kind, term, max_results, start_index)
+    results = query_cache.get_or_load(
+        key,
+        loader=lambda: fetch_listing(kind, term, max_results, start_index),
+        refresh=lambda: _schedule_listing_refresh(kind, term, max_results, start_index)
+    )
+    if results is None:
+        # Google no respondió y no hay nada en caché: servir desde la biblioteca local
+        mark_degraded("google-books")
+        return local_listing(kind, term, max_results, start_index)
+    if get_breaker().state() != CLOSED:
+        # Con el circuito abierto la caché puede estar sirviendo datos caducados
+        mark_degraded("google-books")
     return results
 
-def list_popular_books(max_results: int = 20):
+def first_page(kind: str, term: str, page_size: int) -> PageRequest:
+    return PageRequest(kind, " ".join((term or "").split()), 0, page_size)
+
+def list_page(page: PageRequest):
     """
-    Lista libros populares/destacados de Google Books.
-    Usa una búsqueda general de bestsellers.
+    Devuelve `(libros, página siguiente o None)` de un listado paginado.
+    Si hay página siguiente se precarga en caché en segundo plano, para que
+    el "cargar más" del cliente se sirva desde memoria.
     """
-    api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-    if not api_key:
-        raise ValueError("La API Key de Google Books no está configurada.")
+    results = _cached_listing(page.kind, page.term, page.page_size, page.start_index)
+    following = next_page(page, len(results))
+    if following is not None and get_breaker().state() == CLOSED:
+        query_cache = get_query_cache()
+        query_cache.prefetch(
+            query_cache.make_key(following.kind, following.term, following.page_size, following.start_index),
+            lambda: _schedule_listing_refresh(
+                following.kind, following.term, following.page_size, following.start_index
+            )
+        )
+    return results, following
 
-    params = {
-        "q": "bestseller",
-        "orderBy": "relevance",
-        "key": api_key,
-        "maxResults": max_results
-    }
+def search_books_online(query: str, max_results: int = 10):
 
-    try:
-        response = requests.get(GOOGLE_BOOKS_API_URL, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con Google Books API: {e}")
-        return []
+    return _cached_listing("search", query, max_results)
 
-    data = response.json()
-    items = data.get("items", [])
-    
-    results = [_format_book_volume_info(item.get("volumeInfo"), volume_id=item.get("id")) for item in items]
-    return results
+def list_popular_books(max_results: int = 20):
+    """
+    Lista libros populares/destacados de Google Books.
+    Usa una búsqueda general de bestsellers.
+    """
+    return _cached_listing("popular", "bestseller", max_results)
 
 def search_books_by_category(category: str, max_results: int = 10):
     """
@@ -187,86 +263,13 @@ def search_books_by_category(category: str, max_results: int = 10):
     Returns:
         Lista de libros formateados
     """
-    api_key = current_app.config["GOOGLE_BOOKS_API_KEY"]
-    if not api_key:
-        raise ValueError("La API Key de Google Books no está configurada.")
-
-    params = {
-        "q": f"subject:{category}",
-        "key": api_key,
-        "maxResults": max_results
-    }
-
-    try:
-        response = requests.get(GOOGLE_BOOKS_API_URL, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con Google Books API: {e}")
-        return []
-
-    data = response.json()
-    items = data.get("items", [])
-    
-    results = [_format_book_volume_info(item.get("volumeInfo"), volume_id=item.get("id")) for item in items]
-    return results
+    return _cached_listing("category", category, max_results)
 
 def add_book_to_catalog(volume_id: str):
     """
     Añade un libro al catálogo local desde Google Books API si no existe,
     y le asigna un stock inicial aleatorio. Si el libro ya existe pero
     no tiene inventario, se lo crea y asigna.
+    Devuelve `ImportResult(book, created)`.
     """
-    # 1. Verificar si el libro ya existe en la base de datos local
-    book = Book.query.filter_by(volume_id=volume_id).first()
-    if book:
-        if not book.inventory:
-            # El libro existe pero no tiene inventario, se lo creamos
-            random_stock = random.randint(1, 5)
-            book.inventory = Inventory(
-                available_copies=random_stock,
-                total_copies=random_stock
-            )
-            db.session.commit()
-        return book  # Devolver el libro existente (con su inventario)
-
-    # 2. Si no existe, obtener datos de Google Books API
-    google_book_data = get_book_by_volume_id(volume_id)
-    if not google_book_data:
-        raise NotFound(f"No se pudo encontrar el libro con volume_id {volume_id} en Google Books.")
-
-    # 3. Mapear datos de Google a nuestro modelo `Book`
-    published_date = google_book_data.get("published_date", "")
-    publication_year = None
-    if published_date:
-        try:
-            publication_year = int(published_date.split('-')[0])
-        except (ValueError, IndexError):
-            publication_year = None # Mantener como None si el formato no es parseable
-
-    # Mapear la categoría de Google Books a nuestro enum
-    google_categories = google_book_data.get("categories", [])
-    book_category = _map_google_category_to_book_category(google_categories)
-
-    new_book = Book(
-        volume_id=google_book_data.get("id"),
-        title=google_book_data.get("title"),
-        author=", ".join(google_book_data.get("authors") or []),
-        description=google_book_data.get("description"),
-        isbn=google_book_data.get("isbn_13") or google_book_data.get("isbn_10"),
-        pages=google_book_data.get("page_count"),
-        publication_year=publication_year,
-        category=book_category
-    )
-
-    # 4. Crear y asociar inventario con stock aleatorio
-    random_stock = random.randint(1, 5)
-    new_book.inventory = Inventory(
-        available_copies=random_stock,
-        total_copies=random_stock
-    )
-
-    # 5. Guardar en la base de datos (SQLAlchemy guardará Book e Inventory)
-    db.session.add(new_book)
-    db.session.commit()
-
-    return new_book
\ No newline at end of file
+    return import_book(volume_id, initial_stock=random_stock(1, 5))
@@ -0,0 +1,119 @@
+from infrastructure.celery_app import celery
+
+@celery.task(
+    name="catalog.refresh_listing_async",
+    bind=True,
+    max_retries=0,
+    ignore_result=True,
+)
+def refresh_listing_async(self, kind: str, term: str, max_results: int, start_index: int = 0):
+    from app.catalog.service import refresh_listing
+
+    refreshed = refresh_listing(kind, term, max_results, start_index)
+    return {"status": "refreshed" if refreshed else "upstream_error", "kind": kind, "term": term,
+            "start_index": start_index}
+
+
+@celery.task(
+    name="catalog.bulk_import_async",
+    bind=True,
+    max_retries=0,
+)
+def bulk_import_async(self, items: list, initial_stock=None):
+    from flask import current_app
+    from app.catalog.importer import import_books_bulk, random_stock
+
+    def report_progress(done: int, total: int):
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total})
+
+    results = import_books_bulk(
+        items,
+        initial_stock=initial_stock if initial_stock is not None else random_stock(1, 5),
+        max_workers=current_app.config.get("BULK_IMPORT_WORKERS", 8),
+        progress=report_progress,
+    )
+    return {"status": "completed", "total": len(results), "results": results}
+
+
+@celery.task(
+    name="catalog.reclassify_books_async",
+    bind=True,
+    max_retries=10,
+)
+def reclassify_books_async(self, chunk_size: int = 200, after_id: int = 0, only_default: bool = True):
+    from flask import current_app
+    from app.catalog.reclassify import reclassify_books
+
+    def report_progress(summary: dict):
+        self.update_state(state="PROGRESS", meta=summary)
+
+    summary = reclassify_books(
+        chunk_size=chunk_size,
+        after_id=after_id,
+        only_default=only_default,
+        max_workers=current_app.config.get("BULK_IMPORT_WORKERS", 8),
+        progress=report_progress,
+    )
+    if summary["interrupted"]:
+        # Google no está disponible: continuar desde el último bloque procesado
+        raise self.retry(
+            kwargs={"chunk_size": chunk_size, "after_id": summary["last_id"], "only_default": only_default},
+            countdown=current_app.config.get("GOOGLE_BOOKS_CB_OPEN_SECONDS", 30) * 2,
+        )
+    return {"status": "completed", **summary}
+
+
+@celery.task(
+    name="catalog.prewarm_covers_async",
+    bind=True,
+    max_retries=10,
+)
+def prewarm_covers_async(self, chunk_size: int = 200, after_id: int = 0):
+    from flask import current_app
+    from app.catalog.covers import prewarm_covers
+
+    def report_progress(summary: dict):
+        self.update_state(state="PROGRESS", meta=summary)
+
+    summary = prewarm_covers(
+        chunk_size=chunk_size,
+        after_id=after_id,
+        max_workers=current_app.config.get("BULK_IMPORT_WORKERS", 8),
+        progress=report_progress,
+    )
+    if summary["interrupted"]:
+        raise self.retry(
+            kwargs={"chunk_size": chunk_size, "after_id": summary["last_id"]},
+            countdown=current_app.config.get("GOOGLE_BOOKS_CB_OPEN_SECONDS", 30) * 2,
+        )
+    return {"status": "completed", **summary}
+
+
+@celery.task(
+    name="catalog.refresh_books_async",
+    bind=True,
+    max_retries=10,
+)
+def refresh_books_async(self, chunk_size: int = 200, after_id: int = 0):
+    from flask import current_app
+    from app.catalog.refresh import refresh_books
+
+    def report_progress(summary: dict):
+        self.update_state(state="PROGRESS", meta=summary)
+
+    config = current_app.config
+    summary = refresh_books(
+        chunk_size=chunk_size,
+        after_id=after_id,
+        max_age_days=config.get("BOOK_REFRESH_MAX_AGE_DAYS", 30),
+        incomplete_retry_days=config.get("BOOK_REFRESH_INCOMPLETE_RETRY_DAYS", 1),
+        max_workers=config.get("BOOK_REFRESH_WORKERS", 4),
+        rate=config.get("BOOK_REFRESH_RATE", 5.0),
+        progress=report_progress,
+    )
+    if summary["interrupted"]:
+        raise self.retry(
+            kwargs={"chunk_size": chunk_size, "after_id": summary["last_id"]},
+            countdown=config.get("GOOGLE_BOOKS_CB_OPEN_SECONDS", 30) * 2,
+        )
+    return {"status": "completed", **summary}
@@ -0,0 +1,249 @@
+"""
+Circuit breaker shared across workers.
+
+Call outcomes are counted in fixed time buckets that make up a sliding
+window. Once the window holds at least `min_calls` calls and either the
+failure rate or the slow-call rate crosses its threshold, the circuit opens
+and calls are rejected immediately for `open_seconds`. After that a single
+probe call is let through (half-open): if it succeeds the circuit closes,
+otherwise it opens again.
+
+The state lives in Redis so every gunicorn and celery worker sees the same
+circuit. If Redis is unavailable each process falls back to its own state.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+
+import redis
+
+from infrastructure.redis_client import get_redis, redis_available, mark_redis_down
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# (calls, failures, slow)
+Window = Tuple[int, int, int]
+
+
+class _RedisStore:
+    def __init__(self, name: str, bucket_ttl: int):
+        self.prefix = f"circuit:{name}:"
+        self.bucket_ttl = bucket_ttl
+
+    def _bucket_key(self, bucket: int) -> str:
+        return f"{self.prefix}bucket:{bucket}"
+
+    def add(self, bucket: int, failures: int, slow: int) -> None:
+        pipe = get_redis().pipeline(transaction=False)
+        key = self._bucket_key(bucket)
+        pipe.hincrby(key, "calls", 1)
+        if failures:
+            pipe.hincrby(key, "failures", failures)
+        if slow:
+            pipe.hincrby(key, "slow", slow)
+        pipe.expire(key, self.bucket_ttl)
+        pipe.execute()
+
+    def window(self, buckets: Iterable[int]) -> Window:
+        pipe = get_redis().pipeline(transaction=False)
+        for bucket in buckets:
+            pipe.hmget(self._bucket_key(bucket), "calls", "failures", "slow")
+        totals = [0, 0, 0]
+        for values in pipe.execute():
+            for i, value in enumerate(values):
+                totals[i] += int(value or 0)
+        return tuple(totals)
+
+    def flags(self) -> Tuple[bool, bool]:
+        is_open, half_open = get_redis().mget(self.prefix + "open", self.prefix + "half_open")
+        return is_open is not None, half_open is not None
+
+    def claim_probe(self, ttl: float) -> bool:
+        return bool(get_redis().set(self.prefix + "probe", "1", nx=True, px=int(ttl * 1000)))
+
+    def trip(self, open_seconds: float) -> None:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.set(self.prefix + "open", str(time.time()), px=int(open_seconds * 1000))
+        # Outlives the open period: the circuit stays half-open until a probe closes it
+        pipe.set(self.prefix + "half_open", "1", ex=int(open_seconds * 20))
+        pipe.delete(self.prefix + "probe")
+        pipe.execute()
+
+    def close(self, buckets: Iterable[int]) -> None:
+        get_redis().delete(
+            self.prefix + "open", self.prefix + "half_open", self.prefix + "probe",
+            *(self._bucket_key(b) for b in buckets)
+        )
+
+
+class _LocalStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, list] = {}
+        self._open_until = 0.0
+        self._half_open = False
+        self._probe_until = 0.0
+
+    def add(self, bucket: int, failures: int, slow: int) -> None:
+        with self._lock:
+            counts = self._buckets.setdefault(bucket, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += failures
+            counts[2] += slow
+            for old in [b for b in self._buckets if b < bucket - 100]:
+                del self._buckets[old]
+
+    def window(self, buckets: Iterable[int]) -> Window:
+        totals = [0, 0, 0]
+        with self._lock:
+            for bucket in buckets:
+                for i, value in enumerate(self._buckets.get(bucket, ())):
+                    totals[i] += value
+        return tuple(totals)
+
+    def flags(self) -> Tuple[bool, bool]:
+        with self._lock:
+            return time.monotonic() < self._open_until, self._half_open
+
+    def claim_probe(self, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._probe_until:
+                return False
+            self._probe_until = now + ttl
+            return True
+
+    def trip(self, open_seconds: float) -> None:
+        with self._lock:
+            self._open_until = time.monotonic() + open_seconds
+            self._half_open = True
+            self._probe_until = 0.0
+
+    def close(self, buckets: Iterable[int]) -> None:
+        with self._lock:
+            self._open_until = 0.0
+            self._half_open = False
+            self._probe_until = 0.0
+            for bucket in buckets:
+                self._buckets.pop(bucket, None)
+
+
+class CircuitBreaker:
+    """
+    Args:
+        name: identifies the circuit (and its Redis keys).
+        failure_rate: fraction of failed calls in the window that opens the circuit.
+        slow_call_ms: calls slower than this count as slow.
+        slow_call_rate: fraction of slow calls in the window that opens the circuit.
+        min_calls: calls needed in the window before the rates are evaluated.
+        window: length of the sliding window in seconds.
+        open_seconds: how long calls are rejected before a probe is allowed.
+        probe_timeout: how long a probe may take before another one is allowed.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, slow_call_ms: float = 5000.0,
+                 slow_call_rate: float = 0.8, min_calls: int = 10, window: int = 30,
+                 open_seconds: float = 30.0, probe_timeout: float = 15.0, buckets: int = 6):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.bucket_count = buckets
+        self.bucket_seconds = max(1, window // buckets)
+        self._redis = _RedisStore(name, bucket_ttl=self.bucket_seconds * (buckets + 1))
+        self._local = _LocalStore()
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.probes = 0
+        self.opened = 0
+        self.closed = 0
+        self.redis_errors = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _store(self, method: str, *args):
+        if redis_available():
+            try:
+                return getattr(self._redis, method)(*args)
+            except redis.RedisError:
+                self._count("redis_errors")
+                mark_redis_down()
+        return getattr(self._local, method)(*args)
+
+    def _buckets(self) -> range:
+        current = int(time.time() // self.bucket_seconds)
+        return range(current - self.bucket_count + 1, current + 1)
+
+    def state(self) -> str:
+        is_open, half_open = self._store("flags")
+        if is_open:
+            return OPEN
+        return HALF_OPEN if half_open else CLOSED
+
+    def allow(self) -> bool:
+        """True if the call may go ahead; False means fail fast."""
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._store("claim_probe", self.probe_timeout):
+            self._count("probes")
+            return True
+        self._count("rejected")
+        return False
+
+    def record(self, success: bool, latency_ms: float) -> None:
+        """Report the outcome of a call that `allow()` let through."""
+        slow = latency_ms >= self.slow_call_ms
+        failed = not success
+        buckets = self._buckets()
+        self._store("add", buckets[-1], int(failed), int(slow))
+
+        is_open, half_open = self._store("flags")
+        if is_open:
+            return
+        if half_open:
+            # Outcome of the probe: close or open again
+            if failed or slow:
+                self._trip()
+            else:
+                self._store("close", buckets)
+                self._count("closed")
+            return
+
+        if failed or slow:
+            calls, failures, slow_calls = self._store("window", buckets)
+            if calls >= self.min_calls and (
+                failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate
+            ):
+                self._trip()
+
+    def _trip(self) -> None:
+        print(f"[CIRCUIT] {self.name} opened for {self.open_seconds}s")
+        self._store("trip", self.open_seconds)
+        self._count("opened")
+
+    def reset(self) -> None:
+        self._store("close", self._buckets())
+
+    def stats(self) -> Dict[str, object]:
+        calls, failures, slow_calls = self._store("window", self._buckets())
+        with self._lock:
+            counters = {
+                "rejected": self.rejected,
+                "probes": self.probes,
+                "opened": self.opened,
+                "closed": self.closed,
+                "redis_errors": self.redis_errors,
+            }
+        return {
+            "state": self.state(),
+            "window": {"calls": calls, "failures": failures, "slow": slow_calls},
+            **counters,
+        }
@@ -0,0 +1,27 @@
+"""
+Degraded-mode marker for responses.
+
+Services call `mark_degraded("google-books")` when they answer from a
+fallback (local data, stale cache) because a dependency is unavailable.
+The `X-Degraded` response header lists the affected dependencies so clients
+and load balancers can tell a degraded answer from a normal one.
+"""
+from flask import g, has_request_context
+
+DEGRADED_HEADER = "X-Degraded"
+
+
+def mark_degraded(dependency: str) -> None:
+    if not has_request_context():
+        return
+    degraded = g.setdefault("degraded", set())
+    degraded.add(dependency)
+
+
+def register_degraded_header(app) -> None:
+    @app.after_request
+    def add_degraded_header(response):
+        degraded = g.get("degraded")
+        if degraded:
+            response.headers[DEGRADED_HEADER] = ", ".join(sorted(degraded))
+        return response
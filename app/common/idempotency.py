@@ -0,0 +1,179 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+A client that retries a request with the same `Idempotency-Key` header gets
+the response of the first attempt instead of running the handler again:
+
+    @bp.post("/")
+    @jwt_required()
+    @idempotent
+    def create_loan(): ...
+
+Keys are scoped per user and live in the `idempotency_keys` table (not in
+Redis: a retry must not re-run the checkout just because Redis is down).
+
+  - The first request claims the key (INSERT ... ON CONFLICT DO NOTHING,
+    committed at once) and runs the handler. Responses below 500 are
+    stored; 5xx responses and exceptions release the key so it can be retried.
+  - A retry of a finished request replays the stored status and body
+    (`Idempotent-Replayed: true`) without touching the domain tables.
+  - A duplicate that arrives while the first one is still running waits
+    for it and replays its response; after IDEMPOTENCY_WAIT_SECONDS it gets
+    409 with Retry-After.
+  - Reusing a key for a different request (method, path or body) is a 422.
+
+A claim left behind by a request that never finished (killed worker) can be
+taken over once `locked_until` has passed. Expired keys are deleted by the
+periodic `common.purge_idempotency_keys` task.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Optional
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import and_, delete, or_, select, update
+
+from app.common.models import IdempotencyKey
+from app.common.upsert import dialect_insert
+from app.extensions import db
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def _request_hash() -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _row(credential_id: int, key: str):
+    return (IdempotencyKey.credential_id == credential_id) & (IdempotencyKey.key == key)
+
+
+def _claim(credential_id: int, key: str, request_hash: str) -> bool:
+    """Try to become the request that runs the handler for this key."""
+    config = current_app.config
+    now = datetime.utcnow()
+    claim = {
+        "request_hash": request_hash,
+        "locked_until": now + timedelta(seconds=config.get("IDEMPOTENCY_LOCK_SECONDS", 60)),
+        "expires_at": now + timedelta(hours=config.get("IDEMPOTENCY_TTL_HOURS", 24)),
+    }
+    try:
+        claimed = db.session.execute(
+            dialect_insert(IdempotencyKey)
+            .values(credential_id=credential_id, key=key, **claim)
+            .on_conflict_do_nothing()
+            # Without it SQLAlchemy drops the rowcount of an INSERT (psycopg then reports -1)
+            .execution_options(preserve_rowcount=True)
+        ).rowcount == 1
+        if not claimed:
+            # Expired key, or a claim whose request never finished
+            claimed = db.session.execute(
+                update(IdempotencyKey)
+                .where(_row(credential_id, key), or_(
+                    IdempotencyKey.expires_at <= now,
+                    and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.locked_until <= now),
+                ))
+                .values(status_code=None, response_body=None, content_type=None, **claim)
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return claimed
+
+
+def _stored(credential_id: int, key: str):
+    row = db.session.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.status_code,
+               IdempotencyKey.response_body, IdempotencyKey.content_type)
+        .where(_row(credential_id, key))
+    ).first()
+    # Don't keep a read snapshot open while polling
+    db.session.rollback()
+    return row
+
+
+def _finish(credential_id: int, key: str, response) -> None:
+    """Store the response, or release the key if the request failed."""
+    try:
+        if response is None or response.status_code >= 500:
+            db.session.execute(delete(IdempotencyKey).where(_row(credential_id, key)))
+        else:
+            db.session.execute(
+                update(IdempotencyKey)
+                .where(_row(credential_id, key))
+                .values(status_code=response.status_code, response_body=response.get_data(as_text=True),
+                        content_type=response.content_type)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # The response already happened; at worst the claim expires via locked_until
+        print(f"[IDEMPOTENCY] Could not store response for key {key!r}: {e}")
+
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.status_code, content_type=row.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(fn):
+    """Honour the `Idempotency-Key` header on an authenticated endpoint (place it under `jwt_required`)."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key: Optional[str] = request.headers.get(HEADER)
+        if key is None:
+            return fn(*args, **kwargs)
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return {"code": "INVALID_IDEMPOTENCY_KEY",
+                    "message": f"{HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"}, 400
+
+        credential_id = int(get_jwt_identity())
+        request_hash = _request_hash()
+        wait_seconds = current_app.config.get("IDEMPOTENCY_WAIT_SECONDS", 10)
+        deadline = time.monotonic() + wait_seconds
+        while not _claim(credential_id, key, request_hash):
+            row = _stored(credential_id, key)
+            if row is not None:
+                if row.request_hash != request_hash:
+                    return {"code": "IDEMPOTENCY_KEY_REUSED",
+                            "message": f"{HEADER} ya se usó con otra petición"}, 422
+                if row.status_code is not None:
+                    return _replay(row)
+            if time.monotonic() >= deadline:
+                return ({"code": "IDEMPOTENCY_IN_PROGRESS",
+                         "message": "La petición original sigue en curso; reintenta más tarde"},
+                        409, {"Retry-After": str(max(1, int(wait_seconds)))})
+            time.sleep(POLL_INTERVAL)
+
+        response = None
+        try:
+            response = current_app.make_response(fn(*args, **kwargs))
+            return response
+        finally:
+            # Whatever the handler left open is not part of the stored result
+            db.session.rollback()
+            _finish(credential_id, key, response)
+    return wrapper
+
+
+def purge_expired_keys(now: Optional[datetime] = None) -> int:
+    """Delete expired idempotency keys. Returns the number of rows removed."""
+    now = now or datetime.utcnow()
+    deleted = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now)
+    ).rowcount
+    db.session.commit()
+    return deleted
@@ -54,6 +54,10 @@ class Book(db.Model):
     pages = db.Column(db.Integer, default=0)
     publication_year = db.Column(db.Integer, nullable=True)
     description = db.Column(db.Text, nullable=True)
+    # Huella de los metadatos de Google y fecha de la última actualización
+    # (ver app/catalog/refresh.py)
+    content_hash = db.Column(db.String(64), nullable=True)
+    refreshed_at = db.Column(db.DateTime, nullable=True, index=True)
     
     # Relación con Inventory
     inventory = db.relationship('Inventory', backref='book', uselist=False, lazy=True, cascade="all, delete-orphan")
@@ -95,6 +99,13 @@ class Loan(db.Model):
 
     history = db.relationship('LoanHistory', backref='loan', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Listado paginado de préstamos de un usuario (keyset sobre loan_date, id)
+        db.Index("ix_loans_credential_loan_date", "credential_id", "loan_date", "id"),
+        # Barrido de vencimientos: rangos de due_date por estado
+        db.Index("ix_loans_status_due_date", "status", "due_date"),
+    )
+
 
 class LoanEventType(str, Enum):
     CREATED = "CREATED"
@@ -112,6 +123,25 @@ class LoanHistory(db.Model):
     notes = db.Column(db.String(500), nullable=True)
 
 
+class LoanArchive(db.Model):
+    """Préstamos devueltos antiguos, fuera de `loans`, con su historial compactado (app/loans/archive.py)"""
+    __tablename__ = "loans_archive"
+    # Mismo id que tenía en `loans`
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    credential_id = db.Column(db.Integer, nullable=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    loan_date = db.Column(db.DateTime, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=False)
+    return_date = db.Column(db.DateTime, nullable=True)
+    renewed = db.Column(db.Boolean, default=False, nullable=False)
+    # Eventos de loan_history en JSON: [[tipo, fecha ISO, notas], ...]
+    history = db.Column(db.Text, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_loans_archive_credential_loan_date", "credential_id", "loan_date", "id"),
+    )
+
 
 class WaitlistStatus(str, Enum):
     PENDING = "PENDING"
@@ -127,6 +157,13 @@ class Waitlist(db.Model):
     status = db.Column(db.Enum(WaitlistStatus), default=WaitlistStatus.PENDING, nullable=False)
     created_at = db.Column(db.DateTime, server_default=func.now())
 
+    __table_args__ = (
+        # Conteo por usuario y estado (contadores y su conciliación)
+        db.Index("ix_waitlist_credential_status", "credential_id", "status"),
+        # Cola FIFO de cada libro (promoción de la lista de espera)
+        db.Index("ix_waitlist_book_status_created", "book_id", "status", "created_at"),
+    )
+
 class NotificationType(str, Enum):
     INFO = "INFO"
     WARNING = "WARNING"
@@ -186,6 +223,41 @@ class FailedTask(db.Model):
 
 
 
+class JobCheckpoint(db.Model):
+    """Marca de avance (high-water mark) de los jobs periódicos"""
+    __tablename__ = "job_checkpoints"
+    name = db.Column(db.String(100), primary_key=True)
+    high_water = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserLoanCounters(db.Model):
+    """Contadores de préstamos y reservas por usuario, mantenidos en cada transición (app/loans/counters.py)"""
+    __tablename__ = "user_loan_counters"
+    credential_id = db.Column(db.Integer, db.ForeignKey('auth.id'), primary_key=True)
+    # Fuera de la biblioteca: ACTIVE + RENEWED
+    active_loans = db.Column(db.Integer, default=0, nullable=False)
+    pending_waitlist = db.Column(db.Integer, default=0, nullable=False)
+    held_waitlist = db.Column(db.Integer, default=0, nullable=False)
+    total_loans = db.Column(db.Integer, default=0, nullable=False)
+    returned_loans = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdempotencyKey(db.Model):
+    """Respuesta guardada de una petición con cabecera Idempotency-Key (app/common/idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    credential_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # NULL mientras la primera petición sigue en curso
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 def create_all_tables():
     db.create_all()
 
@@ -0,0 +1,120 @@
+"""
+Schema upgrade step: brings an existing database up to the current models.
+
+    flask --app app.wsgi ensure-schema
+
+It also runs from `create_app` at startup unless SCHEMA_AUTO_UPGRADE is off
+(then run the command from the deploy, before starting the new version).
+Every part is idempotent and a no-op once the schema is current:
+
+  - creates missing tables (with their indexes),
+  - adds nullable columns that were added to existing tables,
+  - creates the indexes declared on the models that are missing; on
+    Postgres with CREATE INDEX CONCURRENTLY (partitioned tables excepted,
+    Postgres does not support it there), so writers are not blocked,
+  - creates the local search index (app/catalog/search.py).
+
+Non-nullable columns are never added automatically: they need a default
+or a backfill and are reported instead. On Postgres the step holds an
+advisory lock, so gunicorn workers and celery processes starting at the
+same time run it one after another.
+"""
+import threading
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+from app.extensions import db
+
+# Arbitrary key for pg_advisory_lock, shared by every process of the app
+_ADVISORY_LOCK_KEY = 7_301_024_511
+_done = set()
+_done_lock = threading.Lock()
+
+
+def _add_missing_columns(connection) -> List[str]:
+    inspector = inspect(connection)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                print(f"[SCHEMA] {table.name}.{column.name} is NOT NULL and missing: add it with a backfill")
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _create_missing_indexes(connection) -> List[str]:
+    inspector = inspect(connection)
+    postgres = connection.dialect.name == "postgresql"
+    invalid = set()
+    if postgres:
+        # Left behind by an interrupted CREATE INDEX CONCURRENTLY: drop and build again
+        invalid = set(connection.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+        )).scalars())
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        partitioned = postgres and connection.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table.name}
+        ).scalar()
+        for index in table.indexes:
+            if index.name in existing and index.name not in invalid:
+                continue
+            ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+            if postgres and not partitioned:
+                if index.name in invalid:
+                    connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+            connection.execute(text(ddl))
+            created.append(index.name)
+    return created
+
+
+def _upgrade(connection) -> dict:
+    db.metadata.create_all(connection)
+    return {
+        "columns": _add_missing_columns(connection),
+        "indexes": _create_missing_indexes(connection),
+    }
+
+
+def ensure_schema(force: bool = False) -> dict:
+    """Applies the upgrade once per process and database (see the module docstring)."""
+    from app.catalog.search import ensure_search_index
+
+    url = str(db.engine.url)
+    with _done_lock:
+        if url in _done and not force:
+            return {"columns": [], "indexes": []}
+        # Autocommit: each DDL statement stands on its own, as CONCURRENTLY requires
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+                try:
+                    summary = _upgrade(connection)
+                finally:
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+            else:
+                try:
+                    summary = _upgrade(connection)
+                except DBAPIError as e:
+                    # Another process upgraded the same SQLite file at the same time
+                    if "already exists" not in str(e) and "duplicate column" not in str(e):
+                        raise
+                    summary = _upgrade(connection)
+        ensure_search_index()
+        _done.add(url)
+    if summary["columns"] or summary["indexes"]:
+        print(f"[SCHEMA] Upgraded: {summary}")
+    return summary
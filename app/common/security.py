@@ -1,3 +1,6 @@
+from functools import wraps
+
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
 
 def hash_password(plain: str) -> str:
@@ -5,3 +8,15 @@ def hash_password(plain: str) -> str:
 
 def verify_password(plain: str, hashed: str) -> bool:
     return check_password_hash(hashed, plain)
+
+def role_required(role: str):
+    """Like `jwt_required()`, but also requires `role` in the token's `roles` claim (403 otherwise)."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            verify_jwt_in_request()
+            if role not in get_jwt().get("roles", []):
+                return {"code": "FORBIDDEN", "message": "No tienes permiso para esta operación"}, 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
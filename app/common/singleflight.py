@@ -0,0 +1,216 @@
+"""
+Single-flight: coalesce concurrent identical operations.
+
+Within a process, callers for the same key share one in-flight call and all
+receive its result (or its exception). Across workers, a short Redis lease
+elects a single leader; the other workers wait for the leader's result to
+show up where `reader` looks for it (a cache, the database...).
+
+If Redis is unavailable only the in-process coalescing applies.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import redis
+
+from infrastructure.redis_client import get_redis, redis_available, mark_redis_down
+
+# Deletes the lease only if we still own it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Args:
+        namespace: prefix for the Redis lease keys.
+        lease_ttl: seconds a leader may hold a lease before it expires on its own.
+        wait_timeout: how long followers wait before doing the work themselves.
+    """
+
+    def __init__(self, namespace: str, lease_ttl: float = 10.0, wait_timeout: float = 5.0,
+                 poll_interval: float = 0.05):
+        self.namespace = namespace
+        self.lease_ttl = lease_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._mu = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._locks: Dict[str, list] = {}
+        self.leaders = 0
+        self.local_waiters = 0
+        self.remote_waits = 0
+        self.timeouts = 0
+        self.locked_sections = 0
+
+    # -- Redis lease -------------------------------------------------------
+
+    def _lease_key(self, key: str) -> str:
+        return f"singleflight:{self.namespace}:{key}"
+
+    def _acquire_lease(self, key: str) -> Optional[str]:
+        """Return a token if we own the lease (or Redis is down), None if another worker owns it."""
+        token = uuid.uuid4().hex
+        if not redis_available():
+            return token
+        try:
+            acquired = get_redis().set(self._lease_key(key), token, nx=True, px=int(self.lease_ttl * 1000))
+        except redis.RedisError:
+            mark_redis_down()
+            return token
+        return token if acquired else None
+
+    def _lease_held(self, key: str) -> bool:
+        if not redis_available():
+            return False
+        try:
+            return bool(get_redis().exists(self._lease_key(key)))
+        except redis.RedisError:
+            mark_redis_down()
+            return False
+
+    def _release_lease(self, key: str, token: str) -> None:
+        if not redis_available():
+            return
+        try:
+            get_redis().eval(_RELEASE_SCRIPT, 1, self._lease_key(key), token)
+        except redis.RedisError:
+            mark_redis_down()
+
+    # -- Shared-result calls -----------------------------------------------
+
+    def do(self, key: str, fn: Callable[[], Any], reader: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Run `fn` once per key among concurrent callers and return its result.
+
+        `reader` returns the result produced by another worker (or None if it
+        is not there yet); without it, remote followers just wait for the
+        lease to be released and then run `fn`.
+        """
+        with self._mu:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.local_waiters += 1
+
+        if not leader:
+            if not call.event.wait(self.wait_timeout + self.lease_ttl):
+                with self._mu:
+                    self.timeouts += 1
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_leader(key, fn, reader)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._mu:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run_leader(self, key: str, fn: Callable[[], Any], reader: Optional[Callable[[], Any]]) -> Any:
+        token = self._acquire_lease(key)
+        if token is None:
+            with self._mu:
+                self.remote_waits += 1
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                if reader is not None:
+                    value = reader()
+                    if value is not None:
+                        return value
+                if not self._lease_held(key):
+                    break
+            else:
+                with self._mu:
+                    self.timeouts += 1
+
+            if reader is not None:
+                value = reader()
+                if value is not None:
+                    return value
+            token = self._acquire_lease(key)
+
+        try:
+            return fn()
+        finally:
+            if token is not None:
+                self._release_lease(key, token)
+
+    # -- Exclusive sections ------------------------------------------------
+
+    @contextmanager
+    def lock(self, key: str):
+        """
+        Mutual exclusion for `key` across threads and workers.
+
+        Meant for "check, then create" sections: the body should re-check
+        the database after entering and commit before leaving.
+        """
+        with self._mu:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = [threading.Lock(), 0]
+                self._locks[key] = entry
+            entry[1] += 1
+            self.locked_sections += 1
+        local_lock = entry[0]
+
+        local_lock.acquire()
+        token = None
+        try:
+            deadline = time.monotonic() + self.wait_timeout
+            token = self._acquire_lease(key)
+            while token is None and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                token = self._acquire_lease(key)
+            if token is None:
+                # The other worker is taking too long; proceed and rely on DB constraints
+                with self._mu:
+                    self.timeouts += 1
+            yield
+        finally:
+            if token is not None:
+                self._release_lease(key, token)
+            local_lock.release()
+            with self._mu:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._mu:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "local_waiters": self.local_waiters,
+                "remote_waits": self.remote_waits,
+                "timeouts": self.timeouts,
+                "locked_sections": self.locked_sections,
+            }
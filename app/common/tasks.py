@@ -26,7 +26,10 @@ def handle_domain_event(self, event_data: dict):
         "loan.created": handle_loan_created,
         "loan.returned": handle_loan_returned,
         "loan.renewed": handle_loan_renewed,
+        "loan.overdue": handle_loans_overdue,
+        "loan.batch": handle_loans_batch,
         "waitlist.added": handle_waitlist_added,
+        "waitlist.held": handle_waitlist_held,
         "user.registered": handle_user_registered,
     }
     
@@ -69,6 +72,19 @@ def handle_loan_renewed(payload: dict):
     print(f"[EVENT] Loan #{loan_id} renewed for user #{user_id}, new due date: {new_due_date}")
 
 
+def handle_loans_overdue(payload: dict):
+    """Handle a batch of newly overdue loans"""
+    loans = payload.get("loans", [])
+    print(f"[EVENT] {len(loans)} loans became overdue: {[l.get('loan_id') for l in loans[:10]]}...")
+
+
+def handle_loans_batch(payload: dict):
+    """Handle the circulation desk operations of one user"""
+    user_id = payload.get("user_id")
+    counts = {key: len(payload.get(key, [])) for key in ("created", "returned", "renewed")}
+    print(f"[EVENT] Desk batch for user #{user_id}: {counts}")
+
+
 def handle_waitlist_added(payload: dict):
     """Handle waitlist added event"""
     waitlist_id = payload.get("waitlist_id")
@@ -80,6 +96,12 @@ def handle_waitlist_added(payload: dict):
     # Example: Could send notification, update metrics, etc.
 
 
+def handle_waitlist_held(payload: dict):
+    """Handle a batch of waitlist entries promoted to HELD"""
+    holds = payload.get("holds", [])
+    print(f"[EVENT] {len(holds)} waitlist entries held: {[h.get('waitlist_id') for h in holds[:10]]}...")
+
+
 def handle_user_registered(payload: dict):
     """Handle user registered event"""
     user_id = payload.get("user_id")
@@ -89,3 +111,13 @@ def handle_user_registered(payload: dict):
     print(f"[EVENT] New user registered: {full_name} ({email}) - ID: {user_id}")
     
     # Example: Could send welcome email, create onboarding tasks, etc.
+
+
+@celery.task(name="common.purge_idempotency_keys")
+def purge_idempotency_keys():
+    """Delete expired Idempotency-Key responses"""
+    from app.common.idempotency import purge_expired_keys
+
+    deleted = purge_expired_keys()
+    print(f"[IDEMPOTENCY] Purged {deleted} expired keys")
+    return deleted
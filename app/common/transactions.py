@@ -0,0 +1,143 @@
+"""
+Unit of work: run a service function in its own transaction at a chosen
+isolation level, retrying it when the database aborts it for contention.
+
+    @unit_of_work("loans.return")
+    def return_loan(loan_id, credential_id): ...
+
+    run_in_transaction("waitlist.hold", hold_copy, waitlist_id, isolation="SERIALIZABLE")
+
+  - Every transaction the function opens runs at `isolation` (by default
+    TX_ISOLATION_LEVEL, SERIALIZABLE). On Postgres this is a
+    `SET TRANSACTION ISOLATION LEVEL` issued as the first statement of each
+    transaction; SQLite serializes writers on its own and is left as is.
+  - Serialization failures (40001), deadlocks (40P01), NOWAIT lock failures
+    (55P03) and SQLite's "database is locked" roll back and re-run the whole
+    function, up to TX_RETRY_ATTEMPTS times, sleeping a random delay up to
+    TX_RETRY_BASE_DELAY * 2^attempt (capped at TX_RETRY_MAX_DELAY) in between.
+    Any other exception is raised at once.
+  - The function is re-run from scratch, so it must commit its writes once,
+    at the end, and publish events only after that commit.
+  - A unit of work called inside another one joins it: only the outermost
+    retries.
+
+Per-name counters (calls, retries by reason, aborts after the last attempt)
+are kept per process; `transaction_stats()` returns them.
+"""
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from app.extensions import db
+
+T = TypeVar("T")
+
+ISOLATION_LEVELS = ("READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE")
+RETRYABLE_SQLSTATES = {
+    "40001": "serialization_failure",
+    "40P01": "deadlock",
+    "55P03": "lock_not_available",
+}
+
+_isolation: ContextVar[Optional[str]] = ContextVar("unit_of_work_isolation", default=None)
+_stats: Dict[str, Counter] = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+@event.listens_for(db.session, "after_begin")
+def _apply_isolation(session, transaction, connection):
+    level = _isolation.get()
+    if level and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET TRANSACTION ISOLATION LEVEL {level}")
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why the database aborted the transaction, if retrying it can succeed; None otherwise."""
+    if not isinstance(error, DBAPIError):
+        return None
+    original = error.orig
+    sqlstate = getattr(original, "sqlstate", None) or getattr(original, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return RETRYABLE_SQLSTATES[sqlstate]
+    if "database is locked" in str(original):
+        return "lock_timeout"
+    return None
+
+
+def _count(name: str, **increments: int) -> None:
+    with _stats_lock:
+        _stats[name].update(increments)
+
+
+def transaction_stats() -> Dict[str, Dict[str, int]]:
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in sorted(_stats.items())}
+
+
+def _start_clean() -> None:
+    """The unit of work owns its transaction from the first statement."""
+    session = db.session()
+    if not session.in_transaction():
+        return
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError("unit of work started with uncommitted changes in the session")
+    # Only a read snapshot left open by the caller
+    session.rollback()
+
+
+def run_in_transaction(name: str, fn: Callable[..., T], *args: Any, isolation: Optional[str] = None,
+                       attempts: Optional[int] = None, **kwargs: Any) -> T:
+    """Run `fn(*args, **kwargs)` as a unit of work named `name` (see the module docstring)."""
+    if _isolation.get() is not None:
+        return fn(*args, **kwargs)
+
+    config = current_app.config
+    level = (isolation or config.get("TX_ISOLATION_LEVEL", "SERIALIZABLE")).upper()
+    if level not in ISOLATION_LEVELS:
+        raise ValueError(f"unknown isolation level {level!r}")
+    attempts = max(1, attempts or config.get("TX_RETRY_ATTEMPTS", 5))
+    base_delay = config.get("TX_RETRY_BASE_DELAY", 0.02)
+    max_delay = config.get("TX_RETRY_MAX_DELAY", 0.5)
+
+    _count(name, calls=1)
+    _start_clean()
+    token = _isolation.set(level)
+    try:
+        for attempt in range(attempts):
+            try:
+                result = fn(*args, **kwargs)
+                if db.session().in_transaction():
+                    db.session.commit()
+                return result
+            except Exception as e:
+                db.session.rollback()
+                reason = retry_reason(e)
+                if reason is None:
+                    _count(name, errors=1)
+                    raise
+                if attempt + 1 == attempts:
+                    _count(name, aborts=1, **{reason: 1})
+                    print(f"[TX] {name}: {reason}, giving up after {attempts} attempts")
+                    raise
+                _count(name, retries=1, **{reason: 1})
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+    finally:
+        _isolation.reset(token)
+
+
+def unit_of_work(name: str, isolation: Optional[str] = None, attempts: Optional[int] = None):
+    """Decorator form of `run_in_transaction`."""
+    def decorator(fn: Callable[..., T]) -> Callable[..., T]:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            return run_in_transaction(name, fn, *args, isolation=isolation, attempts=attempts, **kwargs)
+        return wrapper
+    return decorator
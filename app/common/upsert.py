@@ -0,0 +1,17 @@
+"""
+Dialect-specific INSERT for upserts (`on_conflict_do_nothing`,
+`on_conflict_do_update`), for the Postgres and SQLite databases the app runs on.
+"""
+from app.extensions import db
+
+
+def dialect_insert(model):
+    """`insert(model)` of the session's dialect, with the ON CONFLICT clauses."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert not supported for dialect {dialect}")
+    return insert(model)
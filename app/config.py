@@ -22,4 +22,89 @@ class Config:
 
     # Google Books API
     GOOGLE_BOOKS_API_KEY = os.getenv("GOOGLE_BOOKS_API_KEY")
+    # Permite apuntar a un servidor falso (benchmarks/fake_google_books.py)
+    GOOGLE_BOOKS_API_URL = os.getenv("GOOGLE_BOOKS_API_URL", "https://www.googleapis.com/books/v1/volumes")
+    # Cliente HTTP: timeouts (segundos), reintentos y tamaño del pool
+    GOOGLE_BOOKS_CONNECT_TIMEOUT = float(os.getenv("GOOGLE_BOOKS_CONNECT_TIMEOUT", "3.05"))
+    GOOGLE_BOOKS_READ_TIMEOUT = float(os.getenv("GOOGLE_BOOKS_READ_TIMEOUT", "10"))
+    GOOGLE_BOOKS_MAX_RETRIES = int(os.getenv("GOOGLE_BOOKS_MAX_RETRIES", "2"))
+    GOOGLE_BOOKS_BACKOFF_BASE = float(os.getenv("GOOGLE_BOOKS_BACKOFF_BASE", "0.25"))
+    GOOGLE_BOOKS_BACKOFF_MAX = float(os.getenv("GOOGLE_BOOKS_BACKOFF_MAX", "4"))
+    GOOGLE_BOOKS_POOL_SIZE = int(os.getenv("GOOGLE_BOOKS_POOL_SIZE", "10"))
+    # Circuit breaker: se abre si en la ventana (segundos) hay al menos MIN_CALLS
+    # llamadas y la tasa de errores o de llamadas lentas supera el umbral
+    GOOGLE_BOOKS_CB_FAILURE_RATE = float(os.getenv("GOOGLE_BOOKS_CB_FAILURE_RATE", "0.5"))
+    GOOGLE_BOOKS_CB_SLOW_CALL_MS = float(os.getenv("GOOGLE_BOOKS_CB_SLOW_CALL_MS", "4000"))
+    GOOGLE_BOOKS_CB_SLOW_CALL_RATE = float(os.getenv("GOOGLE_BOOKS_CB_SLOW_CALL_RATE", "0.8"))
+    GOOGLE_BOOKS_CB_MIN_CALLS = int(os.getenv("GOOGLE_BOOKS_CB_MIN_CALLS", "10"))
+    GOOGLE_BOOKS_CB_WINDOW = int(os.getenv("GOOGLE_BOOKS_CB_WINDOW", "30"))
+    GOOGLE_BOOKS_CB_OPEN_SECONDS = float(os.getenv("GOOGLE_BOOKS_CB_OPEN_SECONDS", "30"))
 
+    # Redis usado como caché compartida entre workers
+    REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL", "redis://localhost:6379/2")
+
+    # Caché de volúmenes de Google Books (segundos / nº de entradas por proceso)
+    VOLUME_CACHE_SIZE = int(os.getenv("VOLUME_CACHE_SIZE", "2048"))
+    VOLUME_CACHE_TTL = int(os.getenv("VOLUME_CACHE_TTL", "86400"))
+    VOLUME_CACHE_NEGATIVE_TTL = int(os.getenv("VOLUME_CACHE_NEGATIVE_TTL", "600"))
+
+    # Caché de listados (búsqueda, categoría, populares): frescura y ventana "stale"
+    CATALOG_QUERY_FRESH_TTL = int(os.getenv("CATALOG_QUERY_FRESH_TTL", "300"))
+    CATALOG_QUERY_STALE_TTL = int(os.getenv("CATALOG_QUERY_STALE_TTL", "3600"))
+    CATALOG_QUERY_CACHE_SIZE = int(os.getenv("CATALOG_QUERY_CACHE_SIZE", "256"))
+
+    # Importación masiva: hilos de descarga, tamaño máximo del lote y umbral
+    # a partir del cual se procesa en segundo plano con Celery
+    BULK_IMPORT_WORKERS = int(os.getenv("BULK_IMPORT_WORKERS", "8"))
+    BULK_IMPORT_MAX_ITEMS = int(os.getenv("BULK_IMPORT_MAX_ITEMS", "2000"))
+    BULK_IMPORT_SYNC_LIMIT = int(os.getenv("BULK_IMPORT_SYNC_LIMIT", "50"))
+
+    # Portadas: caché en disco (por defecto instance/covers), tope de tamaño,
+    # Cache-Control max-age de las respuestas y tamaño máximo por imagen
+    COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR")
+    COVER_CACHE_MAX_BYTES = int(os.getenv("COVER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    COVER_MAX_AGE = int(os.getenv("COVER_MAX_AGE", str(30 * 86400)))
+    COVER_NEGATIVE_TTL = int(os.getenv("COVER_NEGATIVE_TTL", "86400"))
+    COVER_MAX_IMAGE_BYTES = int(os.getenv("COVER_MAX_IMAGE_BYTES", str(2 * 1024 * 1024)))
+
+    # Refresco de metadatos de `books` (catalog.refresh_books_async): antigüedad
+    # máxima, reintento de los incompletos, hilos y peticiones/segundo a Google
+    BOOK_REFRESH_MAX_AGE_DAYS = int(os.getenv("BOOK_REFRESH_MAX_AGE_DAYS", "30"))
+    BOOK_REFRESH_INCOMPLETE_RETRY_DAYS = int(os.getenv("BOOK_REFRESH_INCOMPLETE_RETRY_DAYS", "1"))
+    BOOK_REFRESH_WORKERS = int(os.getenv("BOOK_REFRESH_WORKERS", "4"))
+    BOOK_REFRESH_RATE = float(os.getenv("BOOK_REFRESH_RATE", "5"))
+
+    # Barrido de vencimientos (loans.sweep_due_dates, programado con Celery beat
+    # cada LOAN_SWEEP_INTERVAL_SECONDS): antelación del recordatorio y tamaño
+    # de los lotes de eventos loan.overdue
+    LOAN_REMINDER_LEAD_HOURS = int(os.getenv("LOAN_REMINDER_LEAD_HOURS", "48"))
+    LOAN_OVERDUE_EVENT_BATCH = int(os.getenv("LOAN_OVERDUE_EVENT_BATCH", "1000"))
+
+    # Archivo de préstamos (loans.archive_returned_loans): días desde la
+    # devolución para mover un préstamo a loans_archive, y meses de
+    # particiones que se crean por adelantado en Postgres
+    LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", "365"))
+    LOAN_PARTITION_MONTHS_AHEAD = int(os.getenv("LOAN_PARTITION_MONTHS_AHEAD", "3"))
+
+    # Personal del mostrador (rol "staff" en el token, necesario para
+    # POST /loans/batch): correos separados por comas
+    STAFF_EMAILS = os.getenv("STAFF_EMAILS", "")
+
+    # Cabecera Idempotency-Key (app/common/idempotency.py): vida de las
+    # respuestas guardadas, plazo tras el que una petición sin terminar se
+    # da por abandonada y espera máxima de un duplicado simultáneo
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+    # Unidades de trabajo de circulación (app/common/transactions.py):
+    # aislamiento de cada transacción en Postgres y reintentos ante fallos de
+    # serialización/deadlocks (espera aleatoria creciente, en segundos)
+    TX_ISOLATION_LEVEL = os.getenv("TX_ISOLATION_LEVEL", "SERIALIZABLE")
+    TX_RETRY_ATTEMPTS = int(os.getenv("TX_RETRY_ATTEMPTS", "5"))
+    TX_RETRY_BASE_DELAY = float(os.getenv("TX_RETRY_BASE_DELAY", "0.02"))
+    TX_RETRY_MAX_DELAY = float(os.getenv("TX_RETRY_MAX_DELAY", "0.5"))
+
+    # Crear al arrancar las tablas, columnas e índices que falten
+    # (app/common/schema.py); con false, ejecutar `flask ensure-schema` en el despliegue
+    SCHEMA_AUTO_UPGRADE = os.getenv("SCHEMA_AUTO_UPGRADE", "true").lower() == "true"
@@ -1,12 +1,39 @@
 from typing import Optional, List
 import random
+from sqlalchemy import select, update
 from app.common.models import Book, Inventory, Loan, LoanStatus
+from app.common.transactions import unit_of_work
 from app.extensions import db
-from app.catalog.service import get_book_by_volume_id
+from app.catalog.importer import import_book, ensure_inventory, random_stock, BookImportError
+from app.common.upsert import dialect_insert
+from app.waitlist.promotion import promote_waitlist, publish_holds
 from werkzeug.exceptions import NotFound
 from .dtos import UpdateStockIn, InventoryBookOut
 
 
+def _book_with_stock(book: Book) -> InventoryBookOut:
+    """Stock y préstamos de un libro que ya está en la BD local."""
+    # Si no tiene registro de inventario, crearlo con stock aleatorio
+    ensure_inventory(book, random_stock(0, 5))
+    inventory = book.inventory
+
+    total_loans = Loan.query.filter_by(book_id=book.id).count()
+    active_loans = Loan.query.filter_by(
+        book_id=book.id,
+        status=LoanStatus.ACTIVE
+    ).count()
+
+    return InventoryBookOut(
+        book_id=book.id,
+        volume_id=book.volume_id,
+        title=book.title,
+        author=book.author,
+        available_copies=inventory.available_copies,
+        total_loans=total_loans,
+        message=f"{active_loans} préstamos activos, {inventory.available_copies} copias disponibles"
+    )
+
+
 def get_book_by_volume_id_with_stock(volume_id: str) -> Optional[InventoryBookOut]:
     """
     Busca un libro por volume_id en Google Books API y muestra su stock local.
@@ -17,96 +44,29 @@ def get_book_by_volume_id_with_stock(volume_id: str) -> Optional[InventoryBookOu
     
     if book:
         # Ya existe en la BD local, retornar con su stock
-        inventory = book.inventory
-        if not inventory:
-            # Si no tiene registro de inventario, crearlo con stock aleatorio
-            random_stock = random.randint(0, 5)
-            inventory = Inventory(
-                book_id=book.id, 
-                available_copies=random_stock, 
-                reserved_copies=0, 
-                damaged_copies=0, 
-                total_copies=random_stock
-            )
-            db.session.add(inventory)
-            db.session.commit()
-        
-        total_loans = Loan.query.filter_by(book_id=book.id).count()
-        active_loans = Loan.query.filter_by(
-            book_id=book.id,
-            status=LoanStatus.ACTIVE
-        ).count()
-        
-        return InventoryBookOut(
-            book_id=book.id,
-            volume_id=book.volume_id,
-            title=book.title,
-            author=book.author,
-            available_copies=inventory.available_copies,
-            total_loans=total_loans,
-            message=f"{active_loans} préstamos activos, {inventory.available_copies} copias disponibles"
-        )
+        return _book_with_stock(book)
     
-    # No existe localmente, buscar en Google Books API y crearlo
+    # No existe localmente, buscar en Google Books API y crearlo con stock aleatorio
     try:
-        google_book_data = get_book_by_volume_id(volume_id)
-        
-        if not google_book_data:
-            return None
-        
-        # Crear el libro en la BD local con stock aleatorio
-        random_stock = random.randint(0, 5)
-        
-        # Usar isbn_13 o isbn_10 si está disponible
-        isbn = google_book_data.get("isbn_13") or google_book_data.get("isbn_10")
-        
-        # Extraer año de publicación
-        published_date = google_book_data.get("published_date", "")
-        publication_year = None
-        if published_date:
-            try:
-                publication_year = int(published_date.split("-")[0])
-            except:
-                pass
-        
-        new_book = Book(
-            volume_id=google_book_data.get("id"),
-            title=google_book_data.get("title", "Título no disponible"),
-            author=", ".join(google_book_data.get("authors", [])) if google_book_data.get("authors") else "Autor desconocido",
-            isbn=isbn,
-            pages=google_book_data.get("page_count") or 0,
-            publication_year=publication_year,
-            description=google_book_data.get("description")
-        )
-        db.session.add(new_book)
-        db.session.flush()  # Para obtener el ID del libro
-        
-        # Crear el inventario con stock aleatorio
-        new_inventory = Inventory(
-            book_id=new_book.id,
-            available_copies=random_stock,
-            reserved_copies=0,
-            damaged_copies=0,
-            total_copies=random_stock
-        )
-        db.session.add(new_inventory)
-        db.session.commit()
-        
-        return InventoryBookOut(
-            book_id=new_book.id,
-            volume_id=new_book.volume_id,
-            title=new_book.title,
-            author=new_book.author,
-            available_copies=random_stock,
-            total_loans=0,
-            message=f"Libro agregado al inventario con {random_stock} copias disponibles"
-        )
-    except NotFound:
-        return None
-    except Exception as e:
-        db.session.rollback()
+        book, created = import_book(volume_id, initial_stock=random_stock(0, 5))
+    except (NotFound, BookImportError):
         return None
 
+    if not created:
+        # Ya existía: otra petición lo importó mientras tanto, o es el mismo ISBN
+        # con otro volume_id (que no se volvería a encontrar buscando por `volume_id`)
+        return _book_with_stock(book)
+
+    return InventoryBookOut(
+        book_id=book.id,
+        volume_id=book.volume_id,
+        title=book.title,
+        author=book.author,
+        available_copies=book.inventory.available_copies,
+        total_loans=0,
+        message=f"Libro agregado al inventario con {book.inventory.available_copies} copias disponibles"
+    )
+
 
 def list_all_inventory() -> List[InventoryBookOut]:
     """
@@ -149,37 +109,52 @@ def list_all_inventory() -> List[InventoryBookOut]:
     return result
 
 
+@unit_of_work("inventory.restock")
 def update_stock_by_volume_id(volume_id: str, data: UpdateStockIn) -> Optional[InventoryBookOut]:
     """
     Añade ejemplares al stock de un libro existente por su volume_id.
-    El libro debe existir en la BD local.
+    El libro debe existir en la BD local. Las copias nuevas pasan antes a las
+    reservas PENDING del libro (FIFO), en la misma transacción.
     """
     book = Book.query.filter_by(volume_id=volume_id).first()
     if not book:
         return None
 
-    # Obtener o crear registro de inventario
-    inventory = book.inventory
-    if not inventory:
-        inventory = Inventory(book_id=book.id, available_copies=0, reserved_copies=0, damaged_copies=0, total_copies=0)
-        db.session.add(inventory)
-
-    # Lógica corregida: Incrementar el stock
-    inventory.available_copies += data.quantity_to_add
-    inventory.total_copies += data.quantity_to_add
-    
-    db.session.commit()
-
+    # Obtener o crear registro de inventario (sin commit: todo va en una transacción)
+    db.session.execute(
+        dialect_insert(Inventory)
+        .values(book_id=book.id, available_copies=0, reserved_copies=0, damaged_copies=0, total_copies=0)
+        .on_conflict_do_nothing()
+    )
+    # Incrementar el stock (UPDATE relativo, sin leer-modificar-escribir)
+    db.session.execute(
+        update(Inventory)
+        .where(Inventory.book_id == book.id)
+        .values(
+            available_copies=Inventory.available_copies + data.quantity_to_add,
+            total_copies=Inventory.total_copies + data.quantity_to_add,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    holds = promote_waitlist([book.id])
+    available_copies = db.session.execute(
+        select(Inventory.available_copies).where(Inventory.book_id == book.id)
+    ).scalar()
     total_loans = Loan.query.filter_by(book_id=book.id).count()
+    db.session.commit()
+    publish_holds(holds)
 
+    message = f"Stock actualizado para '{book.title}'. Se añadieron {data.quantity_to_add} copias."
+    if holds:
+        message += f" {len(holds)} se reservaron para la lista de espera."
     return InventoryBookOut(
         book_id=book.id,
         volume_id=book.volume_id,
         title=book.title,
         author=book.author,
-        available_copies=inventory.available_copies,
+        available_copies=available_copies,
         total_loans=total_loans,
-        message=f"Stock actualizado para '{book.title}'. Se añadieron {data.quantity_to_add} copias."
+        message=message
     )
 
 
@@ -0,0 +1,408 @@
+"""
+Mostrador de circulación: `POST /loans/batch`.
+
+El personal registra de una vez varias devoluciones, renovaciones y
+préstamos de distintos usuarios. Todo el lote va en una sola transacción y
+con un número fijo de sentencias, sea cual sea su tamaño:
+
+  - las comprobaciones se resuelven con una consulta por tipo (libros,
+    usuarios, contadores de préstamos, reservas, stock) en vez de una por operación,
+  - el stock se ajusta con un único UPDATE por conjunto (CASE por libro),
+    condicionado a que sigan quedando copias,
+  - préstamos, historial y notificaciones se insertan en bloque.
+
+Se procesan primero las devoluciones, luego las renovaciones y por último
+los préstamos. Las copias devueltas pasan antes a las reservas PENDING de
+cada libro (`app/waitlist/promotion.py`); lo que sobra ya se puede prestar
+en el mismo lote.
+Cada operación tiene su propio resultado: las que no cumplen una regla
+(sin copias, límite de préstamos...) se rechazan sin afectar al resto. La
+caché del dashboard se invalida una vez por usuario y, tras el commit, se
+publica un único evento `loan.batch` por usuario.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, delete, insert, select, tuple_, update
+
+from app.common.models import (
+    Book, Credential, Inventory, Loan, LoanEventType, LoanHistory, LoanStatus, Notification,
+    NotificationType, Report, ReportType, UserLoanCounters, Waitlist, WaitlistStatus
+)
+from app.extensions import db
+from app.waitlist.promotion import promote_waitlist, publish_holds
+from infrastructure.events import publish_loans_batch
+from .counters import apply_counter_deltas, ensure_counters
+from .dtos import BatchOperationIn
+from .service import LOAN_DURATION_DAYS, MAX_ACTIVE_LOANS
+
+OUT_STATUSES = (LoanStatus.ACTIVE, LoanStatus.RENEWED)
+
+ERROR_MESSAGES = {
+    "DUPLICATE_OPERATION": "El préstamo ya aparece en otra operación del lote.",
+    "LOAN_NOT_FOUND": "Préstamo no encontrado.",
+    "INVALID_STATUS": "El préstamo no está en un estado que permita la operación.",
+    "ALREADY_RENEWED": "Este préstamo ya fue renovado anteriormente.",
+    "LOAN_OVERDUE": "No se puede renovar un préstamo vencido.",
+    "WAITLIST_EXISTS": "No se puede renovar porque hay usuarios esperando este libro.",
+    "USER_NOT_FOUND": "Usuario no encontrado o desactivado.",
+    "BOOK_NOT_FOUND": "El libro no está en el catálogo local.",
+    "ALREADY_BORROWED": "El usuario ya tiene un préstamo activo de este libro.",
+    "ALREADY_IN_WAITLIST": "El usuario está en la lista de espera de este libro.",
+    "MAX_LOANS_EXCEEDED": "El usuario alcanzó el límite máximo de préstamos activos.",
+    "NO_COPIES_AVAILABLE": "No quedan copias disponibles de este libro.",
+}
+
+
+class _Batch:
+    """Estado del lote: resultados por índice y filas a insertar al final."""
+
+    def __init__(self, operations: List[BatchOperationIn], now: datetime):
+        self.operations = operations
+        self.now = now
+        self.results: List[Optional[dict]] = [None] * len(operations)
+        self.history: List[dict] = []
+        self.notifications: List[dict] = []
+        self.events: Dict[int, Dict[str, list]] = defaultdict(lambda: {"created": [], "returned": [], "renewed": []})
+        # Ajustes de user_loan_counters, aplicados en un solo UPDATE al final
+        self.counters: Dict[int, Counter] = defaultdict(Counter)
+
+    def indexes(self, op: str) -> List[int]:
+        return [i for i, o in enumerate(self.operations) if o.op == op and self.results[i] is None]
+
+    def fail(self, i: int, code: str) -> None:
+        self.results[i] = {"index": i, "op": self.operations[i].op, "status": "error",
+                           "code": code, "message": ERROR_MESSAGES[code]}
+
+    def succeed(self, i: int, **data) -> None:
+        self.results[i] = {"index": i, "op": self.operations[i].op, "status": "ok", **data}
+
+
+def _load_loans(batch: _Batch) -> dict:
+    """Préstamos citados por devoluciones y renovaciones (una consulta); repetidos -> DUPLICATE_OPERATION."""
+    seen = set()
+    for i, operation in enumerate(batch.operations):
+        if operation.op == "checkout":
+            continue
+        if operation.loan_id in seen:
+            batch.fail(i, "DUPLICATE_OPERATION")
+        seen.add(operation.loan_id)
+    if not seen:
+        return {}
+    rows = db.session.execute(
+        select(Loan.id, Loan.credential_id, Loan.book_id, Loan.status, Loan.due_date, Loan.renewed,
+               Book.title.label("book_title"))
+        .outerjoin(Book, Book.id == Loan.book_id)
+        .where(Loan.id.in_(seen))
+    ).all()
+    return {row.id: row for row in rows}
+
+
+def _target_loan(batch: _Batch, i: int, loans: dict):
+    operation = batch.operations[i]
+    loan = loans.get(operation.loan_id)
+    # Con user_id, el préstamo además tiene que ser de ese usuario
+    if loan is None or (operation.user_id and loan.credential_id != operation.user_id):
+        batch.fail(i, "LOAN_NOT_FOUND")
+        return None
+    return loan
+
+
+def _returns(batch: _Batch, loans: dict) -> set:
+    """Devuelve los libros que recuperan copias."""
+    candidates = {}
+    for i in batch.indexes("return"):
+        loan = _target_loan(batch, i, loans)
+        if loan is None:
+            continue
+        if loan.status not in OUT_STATUSES:
+            batch.fail(i, "INVALID_STATUS")
+            continue
+        candidates[loan.id] = i
+    if not candidates:
+        return set()
+
+    # Condicionado al estado: un préstamo devuelto mientras tanto no suma stock dos veces
+    returned = db.session.execute(
+        update(Loan)
+        .where(Loan.id.in_(candidates), Loan.status.in_(OUT_STATUSES))
+        .values(status=LoanStatus.RETURNED, return_date=batch.now)
+        .returning(Loan.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    for loan_id in set(candidates) - set(returned):
+        batch.fail(candidates[loan_id], "INVALID_STATUS")
+
+    per_book = Counter(loans[loan_id].book_id for loan_id in returned)
+    if per_book:
+        db.session.execute(
+            update(Inventory)
+            .where(Inventory.book_id.in_(per_book))
+            .values(available_copies=Inventory.available_copies + case(per_book, value=Inventory.book_id))
+            .execution_options(synchronize_session=False)
+        )
+
+    for loan_id in returned:
+        loan = loans[loan_id]
+        batch.succeed(candidates[loan_id], loan_id=loan_id, user_id=loan.credential_id,
+                      book_id=loan.book_id, book_title=loan.book_title, return_date=batch.now)
+        batch.counters[loan.credential_id].update(active_loans=-1, returned_loans=1)
+        batch.history.append({"loan_id": loan_id, "event_type": LoanEventType.RETURNED,
+                              "timestamp": batch.now, "notes": "Libro devuelto en mostrador"})
+        batch.notifications.append({
+            "credential_id": loan.credential_id, "type": NotificationType.SUCCESS, "title": "Libro Devuelto",
+            "message": f"Has devuelto exitosamente '{loan.book_title}'. ¡Gracias por utilizar nuestra biblioteca!",
+            "is_read": False, "created_at": batch.now,
+        })
+        batch.events[loan.credential_id]["returned"].append(
+            {"loan_id": loan_id, "book_id": loan.book_id, "book_title": loan.book_title}
+        )
+    return set(per_book)
+
+
+def _renewals(batch: _Batch, loans: dict) -> None:
+    candidates = {}
+    for i in batch.indexes("renew"):
+        loan = _target_loan(batch, i, loans)
+        if loan is None:
+            continue
+        if loan.status != LoanStatus.ACTIVE:
+            batch.fail(i, "INVALID_STATUS")
+        elif loan.renewed:
+            batch.fail(i, "ALREADY_RENEWED")
+        elif loan.due_date < batch.now:
+            batch.fail(i, "LOAN_OVERDUE")
+        else:
+            candidates[loan.id] = i
+    if not candidates:
+        return
+
+    contested = set(db.session.execute(
+        select(Waitlist.book_id).distinct()
+        .where(Waitlist.book_id.in_({loans[loan_id].book_id for loan_id in candidates}),
+               Waitlist.status == WaitlistStatus.PENDING)
+    ).scalars())
+    for loan_id in [loan_id for loan_id in candidates if loans[loan_id].book_id in contested]:
+        batch.fail(candidates.pop(loan_id), "WAITLIST_EXISTS")
+    if not candidates:
+        return
+
+    new_due = {loan_id: loans[loan_id].due_date + timedelta(days=LOAN_DURATION_DAYS) for loan_id in candidates}
+    renewed = db.session.execute(
+        update(Loan)
+        .where(Loan.id.in_(candidates), Loan.status == LoanStatus.ACTIVE, Loan.renewed.is_(False))
+        .values(due_date=case(new_due, value=Loan.id), renewed=True, status=LoanStatus.RENEWED)
+        .returning(Loan.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    for loan_id in set(candidates) - set(renewed):
+        batch.fail(candidates[loan_id], "INVALID_STATUS")
+
+    for loan_id in renewed:
+        loan = loans[loan_id]
+        due_date = new_due[loan_id]
+        batch.succeed(candidates[loan_id], loan_id=loan_id, user_id=loan.credential_id, book_id=loan.book_id,
+                      book_title=loan.book_title, old_due_date=loan.due_date, new_due_date=due_date)
+        batch.history.append({
+            "loan_id": loan_id, "event_type": LoanEventType.RENEWED, "timestamp": batch.now,
+            "notes": f"Préstamo renovado. Nueva fecha de devolución: {due_date.strftime('%d/%m/%Y')}",
+        })
+        batch.events[loan.credential_id]["renewed"].append(
+            {"loan_id": loan_id, "book_id": loan.book_id, "new_due_date": due_date.isoformat()}
+        )
+
+
+def _checkouts(batch: _Batch) -> None:
+    pending = batch.indexes("checkout")
+    if not pending:
+        return
+    operations = batch.operations
+
+    books = {row.volume_id: row for row in db.session.execute(
+        select(Book.id, Book.title, Book.volume_id)
+        .where(Book.volume_id.in_({operations[i].volume_id for i in pending}))
+    )}
+    users = set(db.session.execute(
+        select(Credential.id)
+        .where(Credential.id.in_({operations[i].user_id for i in pending}), Credential.is_active.is_(True))
+    ).scalars())
+
+    requests = {}  # índice -> (user_id, book_id)
+    for i in pending:
+        book = books.get(operations[i].volume_id)
+        if operations[i].user_id not in users:
+            batch.fail(i, "USER_NOT_FOUND")
+        elif book is None:
+            batch.fail(i, "BOOK_NOT_FOUND")
+        else:
+            requests[i] = (operations[i].user_id, book.id)
+    if not requests:
+        return
+
+    pairs = set(requests.values())
+    user_ids = {user_id for user_id, _ in pairs}
+    book_ids = {book_id for _, book_id in pairs}
+
+    # Préstamos activos según los contadores (bloqueados hasta el commit), menos lo devuelto en el lote
+    active = {
+        user_id: count + batch.counters[user_id]["active_loans"]
+        for user_id, count in db.session.execute(
+            select(UserLoanCounters.credential_id, UserLoanCounters.active_loans)
+            .where(UserLoanCounters.credential_id.in_(user_ids))
+            .with_for_update()
+        ).all()
+    }
+    borrowed = set(db.session.execute(
+        select(Loan.credential_id, Loan.book_id)
+        .where(tuple_(Loan.credential_id, Loan.book_id).in_(pairs), Loan.status == LoanStatus.ACTIVE)
+    ).tuples())
+    waitlist = {}
+    for row in db.session.execute(
+        select(Waitlist.id, Waitlist.credential_id, Waitlist.book_id, Waitlist.status)
+        .where(tuple_(Waitlist.credential_id, Waitlist.book_id).in_(pairs),
+               Waitlist.status.in_((WaitlistStatus.PENDING, WaitlistStatus.HELD)))
+        .order_by(Waitlist.id)
+    ):
+        waitlist.setdefault((row.credential_id, row.book_id), row)
+    # En PostgreSQL bloquea las filas de stock hasta el commit: el reparto de abajo no se queda viejo
+    available = dict(db.session.execute(
+        select(Inventory.book_id, Inventory.available_copies)
+        .where(Inventory.book_id.in_(book_ids))
+        .with_for_update()
+    ).all())
+
+    # Reparto en el orden del lote, con las mismas reglas que POST /loans
+    granted = {}  # índice -> id de la reserva HELD que se confirma, o None si sale del stock
+    for i, pair in requests.items():
+        entry = waitlist.get(pair)
+        if pair in borrowed:
+            batch.fail(i, "ALREADY_BORROWED")
+        elif entry is not None and entry.status == WaitlistStatus.PENDING:
+            batch.fail(i, "ALREADY_IN_WAITLIST")
+        elif active.get(pair[0], 0) >= MAX_ACTIVE_LOANS:
+            batch.fail(i, "MAX_LOANS_EXCEEDED")
+        elif entry is None and not available.get(pair[1]):
+            batch.fail(i, "NO_COPIES_AVAILABLE")
+        else:
+            if entry is None:
+                available[pair[1]] -= 1
+            granted[i] = entry.id if entry is not None else None
+            borrowed.add(pair)
+            active[pair[0]] = active.get(pair[0], 0) + 1
+    if not granted:
+        return
+
+    _take_copies(batch, requests, granted)
+    if not granted:
+        return
+
+    loan_date = batch.now
+    due_date = loan_date + timedelta(days=LOAN_DURATION_DAYS)
+    order = list(granted)
+    loan_ids = db.session.execute(
+        insert(Loan).returning(Loan.id, sort_by_parameter_order=True),
+        [{"credential_id": requests[i][0], "book_id": requests[i][1], "status": LoanStatus.ACTIVE,
+          "loan_date": loan_date, "due_date": due_date, "renewed": False} for i in order],
+    ).scalars().all()
+
+    titles = {row.id: row.title for row in books.values()}
+    for i, loan_id in zip(order, loan_ids):
+        user_id, book_id = requests[i]
+        title = titles[book_id]
+        from_waitlist = granted[i] is not None
+        batch.succeed(i, loan_id=loan_id, user_id=user_id, book_id=book_id, book_title=title,
+                      loan_date=loan_date, due_date=due_date, from_waitlist=from_waitlist)
+        batch.counters[user_id].update(active_loans=1, total_loans=1, held_waitlist=-1 if from_waitlist else 0)
+        batch.history.append({"loan_id": loan_id, "event_type": LoanEventType.CREATED,
+                              "timestamp": loan_date, "notes": "Préstamo creado en mostrador"})
+        batch.notifications.append({
+            "credential_id": user_id, "type": NotificationType.SUCCESS, "title": "Préstamo Confirmado",
+            "message": f"Has obtenido el libro '{title}'. Fecha de devolución: {due_date.strftime('%d/%m/%Y')}. "
+                       f"Tienes {LOAN_DURATION_DAYS} días para disfrutarlo.",
+            "is_read": False, "created_at": loan_date,
+        })
+        batch.events[user_id]["created"].append(
+            {"loan_id": loan_id, "book_id": book_id, "book_title": title, "due_date": due_date.isoformat()}
+        )
+
+
+def _take_copies(batch: _Batch, requests: dict, granted: dict) -> None:
+    """
+    Aplica el reparto: confirma las reservas HELD y descuenta el stock con un
+    único UPDATE condicionado. Lo que ya no se pudo tomar (otra transacción se
+    adelantó) se rechaza con NO_COPIES_AVAILABLE.
+    """
+    held = {waitlist_id: i for i, waitlist_id in granted.items() if waitlist_id is not None}
+    if held:
+        confirmed = set(db.session.execute(
+            update(Waitlist)
+            .where(Waitlist.id.in_(held), Waitlist.status == WaitlistStatus.HELD)
+            .values(status=WaitlistStatus.CONFIRMED)
+            .returning(Waitlist.id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+        for waitlist_id in set(held) - confirmed:
+            batch.fail(held[waitlist_id], "NO_COPIES_AVAILABLE")
+            del granted[held[waitlist_id]]
+
+    per_book = Counter(requests[i][1] for i, waitlist_id in granted.items() if waitlist_id is None)
+    if not per_book:
+        return
+    wanted = case(per_book, value=Inventory.book_id)
+    taken = set(db.session.execute(
+        update(Inventory)
+        .where(Inventory.book_id.in_(per_book), Inventory.available_copies >= wanted)
+        .values(available_copies=Inventory.available_copies - wanted)
+        .returning(Inventory.book_id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    for i in [i for i, waitlist_id in granted.items() if waitlist_id is None and requests[i][1] not in taken]:
+        batch.fail(i, "NO_COPIES_AVAILABLE")
+        del granted[i]
+
+
+def process_batch(operations: List[BatchOperationIn], now: Optional[datetime] = None) -> dict:
+    """
+    Ejecuta el lote en una transacción y devuelve `{"results": [...], "summary": {...}}`,
+    con un resultado por operación en el mismo orden de entrada.
+    """
+    batch = _Batch(operations, now or datetime.utcnow())
+    try:
+        loans = _load_loans(batch)
+        # Filas de contadores que falten, antes de escribir nada (ver app/loans/counters.py)
+        ensure_counters({o.user_id for o in operations if o.op == "checkout"}
+                        | {loan.credential_id for loan in loans.values()})
+        holds = promote_waitlist(_returns(batch, loans), now=batch.now)
+        _renewals(batch, loans)
+        _checkouts(batch)
+
+        if batch.history:
+            db.session.execute(insert(LoanHistory), batch.history)
+        if batch.notifications:
+            db.session.execute(insert(Notification), batch.notifications)
+        apply_counter_deltas(batch.counters)
+        if batch.events:
+            # Una invalidación del dashboard por usuario, no una por operación
+            db.session.execute(
+                delete(Report)
+                .where(Report.credential_id.in_(batch.events), Report.report_type == ReportType.DASHBOARD)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Después del commit: un evento por usuario con todas sus operaciones
+    for user_id, changes in batch.events.items():
+        try:
+            publish_loans_batch(user_id, **changes)
+        except Exception as e:
+            print(f"[LOANS] No se pudo publicar loan.batch del usuario {user_id}: {e}")
+    publish_holds(holds)
+
+    ok = sum(1 for r in batch.results if r["status"] == "ok")
+    summary = {"total": len(operations), "ok": ok, "failed": len(operations) - ok, "users": len(batch.events)}
+    print(f"[LOANS] Lote de mostrador: {summary}")
+    return {"results": batch.results, "summary": summary}
@@ -0,0 +1,201 @@
+"""
+Contadores de préstamos y reservas por usuario (`user_loan_counters`).
+
+El límite de préstamos y el dashboard leen una fila por usuario en vez de
+contar `loans` y `waitlist` en cada petición. Cada transición (préstamo,
+devolución, alta/baja/retención/confirmación en la lista de espera) ajusta
+la fila con un UPDATE relativo (`col = col + n`) en su misma transacción, y
+el límite de préstamos activos es un UPDATE condicionado
+(`... WHERE active_loans < límite`), no una lectura previa.
+
+Si un usuario aún no tiene fila, se crea calculándola desde `loans`,
+`loans_archive` y `waitlist`. Por eso los ajustes se hacen ANTES de
+escribir la transición: así la fila calculada refleja el estado previo y
+el ajuste no se cuenta dos veces.
+
+`reconcile_counters` recalcula los contadores por bloques y repara las
+filas que se hayan desviado (job `loans.reconcile_counters`).
+"""
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+from sqlalchemy import case, func, literal, select, update
+
+from app.common.models import (
+    Credential, Loan, LoanArchive, LoanStatus, UserLoanCounters, Waitlist, WaitlistStatus
+)
+from app.common.upsert import dialect_insert
+from app.extensions import db
+
+COUNTER_COLUMNS = ("active_loans", "pending_waitlist", "held_waitlist", "total_loans", "returned_loans")
+OUT_STATUSES = (LoanStatus.ACTIVE, LoanStatus.RENEWED)
+
+
+def _expected(credential_id):
+    """
+    Valor real de cada contador para `credential_id` (columna correlacionada),
+    calculado desde las tablas. Los préstamos archivados siguen contando como
+    totales y devueltos.
+    """
+    def loans(*conditions):
+        return (select(func.count(Loan.id))
+                .where(Loan.credential_id == credential_id, *conditions).scalar_subquery())
+
+    archived = (select(func.count(LoanArchive.id))
+                .where(LoanArchive.credential_id == credential_id).scalar_subquery())
+
+    def waitlist(status):
+        return (select(func.count(Waitlist.id))
+                .where(Waitlist.credential_id == credential_id, Waitlist.status == status).scalar_subquery())
+
+    return {
+        "active_loans": loans(Loan.status.in_(OUT_STATUSES)),
+        "pending_waitlist": waitlist(WaitlistStatus.PENDING),
+        "held_waitlist": waitlist(WaitlistStatus.HELD),
+        "total_loans": loans() + archived,
+        "returned_loans": loans(Loan.status == LoanStatus.RETURNED) + archived,
+    }
+
+
+def ensure_counters(credential_ids: Iterable[int]) -> int:
+    """Crea (calculadas) las filas que falten. Llamar antes de escribir la transición."""
+    ids = set(credential_ids)
+    if not ids:
+        return 0
+    expected = _expected(Credential.id)
+    with db.session.no_autoflush:
+        return db.session.execute(
+            dialect_insert(UserLoanCounters)
+            .from_select(
+                ["credential_id", *expected, "updated_at"],
+                select(Credential.id, *expected.values(), literal(datetime.utcnow()))
+                .where(Credential.id.in_(ids)),
+            )
+            .on_conflict_do_nothing()
+            # Sin ella el INSERT no conserva el rowcount (psycopg devuelve -1)
+            .execution_options(preserve_rowcount=True)
+        ).rowcount
+
+
+def adjust_counters(credential_id: int, **deltas: int) -> None:
+    """Suma `deltas` (p.ej. `pending_waitlist=-1, held_waitlist=1`) a los contadores del usuario."""
+    statement = (
+        update(UserLoanCounters)
+        .where(UserLoanCounters.credential_id == credential_id)
+        .values(updated_at=datetime.utcnow(),
+                **{column: getattr(UserLoanCounters, column) + delta for column, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+    with db.session.no_autoflush:
+        if db.session.execute(statement).rowcount == 0:
+            ensure_counters([credential_id])
+            db.session.execute(statement)
+
+
+def apply_counter_deltas(deltas: Dict[int, Dict[str, int]]) -> None:
+    """Ajusta los contadores de varios usuarios en un solo UPDATE (CASE por usuario). Las filas deben existir."""
+    deltas = {uid: changes for uid, changes in deltas.items() if any(changes.values())}
+    if not deltas:
+        return
+    columns = {column for changes in deltas.values() for column, delta in changes.items() if delta}
+    values = {
+        column: getattr(UserLoanCounters, column) + case(
+            {uid: changes.get(column, 0) for uid, changes in deltas.items()},
+            value=UserLoanCounters.credential_id, else_=0,
+        )
+        for column in columns
+    }
+    db.session.execute(
+        update(UserLoanCounters)
+        .where(UserLoanCounters.credential_id.in_(deltas))
+        .values(updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reserve_loan_slot(credential_id: int, limit: int) -> bool:
+    """
+    Ocupa un hueco de préstamo activo si el usuario está por debajo de `limit`
+    (UPDATE condicionado: dos préstamos simultáneos no pueden pasarse del límite).
+    """
+    statement = (
+        update(UserLoanCounters)
+        .where(UserLoanCounters.credential_id == credential_id, UserLoanCounters.active_loans < limit)
+        .values(active_loans=UserLoanCounters.active_loans + 1, total_loans=UserLoanCounters.total_loans + 1,
+                updated_at=datetime.utcnow())
+        .returning(UserLoanCounters.active_loans)
+        .execution_options(synchronize_session=False)
+    )
+    with db.session.no_autoflush:
+        if db.session.execute(statement).first():
+            return True
+        # Puede que aún no tenga fila: crearla y reintentar (si ya existía, el límite decide)
+        ensure_counters([credential_id])
+        return db.session.execute(statement).first() is not None
+
+
+def get_counters(credential_id: int) -> Dict[str, int]:
+    """Contadores del usuario; si aún no tiene fila se calculan (sin escribir)."""
+    row = db.session.execute(
+        select(*(getattr(UserLoanCounters, c) for c in COUNTER_COLUMNS))
+        .where(UserLoanCounters.credential_id == credential_id)
+    ).first()
+    if row is None:
+        row = db.session.execute(select(*_expected(literal(credential_id)).values())).one()
+    return dict(zip(COUNTER_COLUMNS, row))
+
+
+def reconcile_counters(chunk_size: int = 1000, after_id: int = 0,
+                       progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Recalcula los contadores de los usuarios con id > `after_id`, en bloques
+    de `chunk_size` (keyset por id), y repara los que no coinciden.
+
+    Las filas del bloque se bloquean antes de contar: las transiciones en
+    curso (que ajustan el contador antes de escribir) terminan primero y las
+    nuevas esperan al commit, así el recuento no se queda viejo.
+    """
+    summary = {"scanned": 0, "created": 0, "repaired": 0, "last_id": after_id}
+    expected = _expected(Credential.id)
+
+    while True:
+        ids = db.session.execute(
+            select(Credential.id).where(Credential.id > summary["last_id"])
+            .order_by(Credential.id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        current = {
+            row.credential_id: tuple(getattr(row, c) for c in COUNTER_COLUMNS)
+            for row in db.session.execute(
+                select(UserLoanCounters.credential_id, *(getattr(UserLoanCounters, c) for c in COUNTER_COLUMNS))
+                .where(UserLoanCounters.credential_id.in_(ids))
+                .with_for_update()
+            )
+        }
+        now = datetime.utcnow()
+        missing, drifted = [], []
+        for row in db.session.execute(select(Credential.id, *expected.values()).where(Credential.id.in_(ids))):
+            values = dict(zip(COUNTER_COLUMNS, row[1:]))
+            if row.id not in current:
+                missing.append({"credential_id": row.id, **values, "updated_at": now})
+            elif current[row.id] != tuple(values.values()):
+                print(f"[COUNTERS] usuario {row.id}: {dict(zip(COUNTER_COLUMNS, current[row.id]))} -> {values}")
+                drifted.append({"credential_id": row.id, **values, "updated_at": now})
+
+        if missing:
+            db.session.execute(dialect_insert(UserLoanCounters).on_conflict_do_nothing(), missing)
+        if drifted:
+            db.session.execute(update(UserLoanCounters), drifted)
+        db.session.commit()
+
+        summary["scanned"] += len(ids)
+        summary["created"] += len(missing)
+        summary["repaired"] += len(drifted)
+        summary["last_id"] = ids[-1]
+        if progress:
+            progress(dict(summary))
+
+    print(f"[COUNTERS] {summary}")
+    return summary
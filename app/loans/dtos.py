@@ -1,6 +1,6 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Literal, Optional
 
 class CreateLoanIn(BaseModel):
     volume_id: str
@@ -61,3 +61,37 @@ class RenewLoanOut(BaseModel):
     old_due_date: datetime
     new_due_date: datetime
     message: str
+
+
+class RenewAllOut(BaseModel):
+    renewed: List[RenewLoanOut]
+    count: int
+    message: str
+
+
+MAX_BATCH_OPERATIONS = 100
+
+
+class BatchOperationIn(BaseModel):
+    """Una operación del mostrador: checkout (user_id + volume_id), return o renew (loan_id)."""
+    op: Literal["checkout", "return", "renew"]
+    user_id: Optional[int] = None
+    volume_id: Optional[str] = None
+    loan_id: Optional[int] = None
+
+    @field_validator('volume_id')
+    @classmethod
+    def strip_volume_id(cls, v):
+        return v.strip() if v else v
+
+    @model_validator(mode='after')
+    def require_target(self):
+        if self.op == "checkout" and (not self.user_id or not self.volume_id):
+            raise ValueError('checkout requiere user_id y volume_id')
+        if self.op != "checkout" and not self.loan_id:
+            raise ValueError(f'{self.op} requiere loan_id')
+        return self
+
+
+class LoanBatchIn(BaseModel):
+    operations: List[BatchOperationIn] = Field(..., min_length=1, max_length=MAX_BATCH_OPERATIONS)
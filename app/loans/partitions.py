@@ -0,0 +1,199 @@
+"""
+Particionado mensual de `loans` y `loan_history` en Postgres.
+
+- `partition_tables()` convierte cada tabla en una tabla particionada por
+  rango (`loan_date` / `timestamp`) sin copiar datos. La tabla actual pasa
+  a ser la partición `<tabla>_legacy`, que cubre todo hasta el mes siguiente
+  al último registro. A partir de ahí hay una partición por mes
+  (`<tabla>_pYYYY_MM`) y una DEFAULT de respaldo. Es idempotente, pero
+  bloquea las tablas en exclusiva mientras valida la partición antigua:
+  ejecutarla en una ventana de mantenimiento
+  (`flask --app app.wsgi loans partition-tables`).
+- `ensure_monthly_partitions()` crea por adelantado las particiones de los
+  próximos LOAN_PARTITION_MONTHS_AHEAD meses (job `loans.maintain_partitions`).
+
+La clave primaria de una tabla particionada debe incluir la columna de
+partición: pasa a ser (id, loan_date) / (id, timestamp), también en
+`<tabla>_legacy`, que no puede conservar la suya. Por eso se elimina la FK
+`loan_history.loan_id -> loans.id`; el historial se escribe siempre en la
+misma transacción que su préstamo.
+
+En SQLite (o en Postgres sin convertir) las tablas siguen siendo normales y
+estas funciones no hacen nada.
+"""
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from app.common.models import Loan, LoanHistory
+from app.extensions import db
+
+# Tabla -> (modelo, columna de partición)
+PARTITIONED = {
+    "loans": (Loan, "loan_date"),
+    "loan_history": (LoanHistory, "timestamp"),
+}
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _execute(sql: str, **params):
+    return db.session.execute(text(sql), params)
+
+
+def _is_postgres() -> bool:
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def _month_start(moment: datetime, months: int = 0) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned(table: str) -> bool:
+    if not _is_postgres():
+        return False
+    return _execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)",
+        table=table,
+    ).first() is not None
+
+
+def _legacy_bound(table: str) -> Optional[datetime]:
+    """Límite superior de `<tabla>_legacy`: las particiones mensuales empiezan ahí."""
+    expression = _execute(
+        "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c WHERE c.relname = :name AND c.relispartition",
+        name=f"{table}_legacy",
+    ).scalar()
+    match = _UPPER_BOUND.search(expression or "")
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+def _drop_foreign_keys_to(table: str) -> None:
+    for constraint, owner in _execute(
+        "SELECT c.conname, r.relname FROM pg_constraint c JOIN pg_class r ON r.oid = c.conrelid "
+        "WHERE c.contype = 'f' AND c.confrelid = to_regclass(:table)",
+        table=table,
+    ).all():
+        _execute(f'ALTER TABLE {owner} DROP CONSTRAINT "{constraint}"')
+
+
+def _convert(table: str, model, key: str, now: datetime) -> None:
+    legacy = f"{table}_legacy"
+    _execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+
+    # La columna de partición no admite NULL
+    if table == "loans":
+        _execute('UPDATE loans SET loan_date = due_date WHERE loan_date IS NULL')
+    else:
+        _execute(
+            'UPDATE loan_history h SET "timestamp" = COALESCE('
+            '(SELECT l.loan_date FROM loans l WHERE l.id = h.loan_id), now()) WHERE h."timestamp" IS NULL'
+        )
+    newest = _execute(f'SELECT max("{key}") FROM {table}').scalar()
+    bound = _month_start(max(newest or now, now), 1)
+
+    # La tabla actual (con sus índices) se queda como partición antigua
+    for index in _execute("SELECT indexname FROM pg_indexes WHERE tablename = :table", table=table).scalars():
+        _execute(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"')
+    _execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    _execute(f'ALTER TABLE {legacy} ALTER COLUMN "{key}" SET NOT NULL')
+    # Una partición no puede tener su propia clave primaria: pasa a la de la tabla particionada
+    primary_key = _execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'", table=legacy
+    ).scalar()
+    if primary_key:
+        _execute(f'ALTER TABLE {legacy} DROP CONSTRAINT "{primary_key}"')
+    _execute(f'ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY (id, "{key}")')
+
+    _execute(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ("{key}")')
+    _execute(f'ALTER TABLE {table} ALTER COLUMN "{key}" SET NOT NULL')
+    _execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, "{key}")')
+    sequence = _execute("SELECT pg_get_serial_sequence(:table, 'id')", table=legacy).scalar()
+    if sequence:
+        _execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    for fk in model.__table__.foreign_key_constraints:
+        if fk.referred_table.name in PARTITIONED:
+            continue
+        columns = ", ".join(c.name for c in fk.columns)
+        referred = ", ".join(e.column.name for e in fk.elements)
+        _execute(f"ALTER TABLE {table} ADD FOREIGN KEY ({columns}) REFERENCES {fk.referred_table.name} ({referred})")
+    for index in model.__table__.indexes:
+        index.create(db.session.connection())
+
+    _execute(f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{bound.isoformat()}')")
+    _execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def partition_tables(months_ahead: int = 3) -> List[str]:
+    """Convierte `loans` y `loan_history` en tablas particionadas por mes. Devuelve las convertidas."""
+    if not _is_postgres():
+        return []
+    now = datetime.utcnow()
+    converted = []
+    try:
+        if not is_partitioned("loans"):
+            _drop_foreign_keys_to("loans")
+        for table, (model, key) in PARTITIONED.items():
+            if not is_partitioned(table):
+                _convert(table, model, key, now)
+                converted.append(table)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    ensure_monthly_partitions(months_ahead, now)
+    print(f"[PARTITIONS] Tablas convertidas: {converted or 'ninguna'}")
+    return converted
+
+
+def _create_partition(table: str, name: str, start: datetime, end: datetime) -> None:
+    key = PARTITIONED[table][1]
+    lower, upper = start.isoformat(), end.isoformat()
+    bounds = f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    in_range = f"\"{key}\" >= '{lower}' AND \"{key}\" < '{upper}'"
+    if _execute(f"SELECT 1 FROM {table}_default WHERE {in_range} LIMIT 1").first() is None:
+        _execute(f"CREATE TABLE {name} PARTITION OF {table} {bounds}")
+        return
+    # La DEFAULT ya tiene filas del mes (el job no se ejecutó a tiempo): Postgres
+    # rechazaría la partición, así que se mueven a ella antes de adjuntarla
+    _execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    _execute(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE {in_range} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    )
+    _execute(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}")
+
+
+def ensure_monthly_partitions(months_ahead: int = 3, now: Optional[datetime] = None) -> List[str]:
+    """
+    Crea las particiones del mes actual y de los `months_ahead` siguientes
+    que falten. Si la partición DEFAULT ya tiene filas de ese mes (el job
+    lleva tiempo sin ejecutarse) se mueven a la partición nueva.
+    """
+    if not _is_postgres():
+        return []
+    now = now or datetime.utcnow()
+    created = []
+    try:
+        for table in PARTITIONED:
+            if not is_partitioned(table):
+                continue
+            start = max(_month_start(now), _legacy_bound(table) or _month_start(now))
+            end = _month_start(now, months_ahead + 1)
+            while start < end:
+                upper = _month_start(start, 1)
+                name = f"{table}_p{start:%Y_%m}"
+                if _execute("SELECT to_regclass(:name)", name=name).scalar() is None:
+                    _create_partition(table, name, start, upper)
+                    created.append(name)
+                start = upper
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if created:
+        print(f"[PARTITIONS] Particiones creadas: {created}")
+    return created
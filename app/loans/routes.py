@@ -1,14 +1,21 @@
-from flask import Blueprint, request
+import click
+from flask import Blueprint, request, url_for
 from pydantic import ValidationError
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .dtos import CreateLoanIn
+from app.common.idempotency import idempotent
+from app.common.security import role_required
+from .dtos import CreateLoanIn, LoanBatchIn
 from .service import (
     create_loan as create_loan_uc,
     get_user_loans as get_user_loans_uc,
     get_loan_details as get_loan_details_uc,
     return_loan as return_loan_uc,
     renew_loan as renew_loan_uc,
-    get_overdue_loans as get_overdue_loans_uc
+    renew_all_loans as renew_all_loans_uc,
+    get_overdue_loans as get_overdue_loans_uc,
+    InvalidLoansCursor,
+    DEFAULT_LOANS_PAGE_SIZE,
+    MAX_LOANS_PAGE_SIZE
 )
 
 bp = Blueprint("loans", __name__)
@@ -16,6 +23,7 @@ bp = Blueprint("loans", __name__)
 
 @bp.post("/")
 @jwt_required()
+@idempotent
 def create_loan():
     try:
         data = CreateLoanIn.model_validate(request.get_json() or {})
@@ -48,14 +56,53 @@ def create_loan():
 
 
 
+@bp.post("/batch")
+@role_required("staff")
+@idempotent
+def batch_circulation():
+    """
+    Mostrador de circulación (rol "staff"): préstamos, devoluciones y
+    renovaciones de varios usuarios en una sola transacción.
+    Usage: POST /loans/batch {"operations": [{"op": "return", "loan_id": 7},
+           {"op": "checkout", "user_id": 3, "volume_id": "zvQYMgAACAAJ"}]}
+    """
+    from .batch import process_batch
+
+    try:
+        data = LoanBatchIn.model_validate(request.get_json() or {})
+    except ValidationError as e:
+        errors = [{"field": ".".join(map(str, err["loc"])), "message": err["msg"]} for err in e.errors()]
+        return {"code": "VALIDATION_ERROR", "errors": errors}, 422
+
+    return process_batch(data.operations), 200
+
+
 @bp.get("/")
 @jwt_required()
 def list_loans():
+    """
+    Préstamos del usuario, paginados con cursor. La página siguiente se pide
+    con el valor de la cabecera `X-Next-Cursor` (o el enlace `Link: rel="next"`).
+    Con `history=full` incluye los préstamos archivados.
+    Usage: GET /loans?status=ACTIVE&limit=50  ->  GET /loans?cursor=<X-Next-Cursor>
+    """
     uid = int(get_jwt_identity())
     status_filter = request.args.get("status")
-    
-    loans = get_user_loans_uc(uid, status_filter)
-    return [loan.model_dump() for loan in loans], 200
+    limit = max(1, min(request.args.get("limit", DEFAULT_LOANS_PAGE_SIZE, type=int), MAX_LOANS_PAGE_SIZE))
+    full_history = request.args.get("history") == "full"
+
+    try:
+        loans, next_cursor = get_user_loans_uc(uid, status_filter, limit=limit, cursor=request.args.get("cursor"),
+                                               full_history=full_history)
+    except InvalidLoansCursor as e:
+        return {"code": "INVALID_CURSOR", "message": str(e)}, 400
+
+    headers = {}
+    if next_cursor:
+        args = {k: v for k, v in request.args.items() if k != "cursor"}
+        next_url = url_for("loans.list_loans", cursor=next_cursor, **args)
+        headers = {"X-Next-Cursor": next_cursor, "Link": f'<{next_url}>; rel="next"'}
+    return loans, 200, headers
 
 
 @bp.get("/<int:loan_id>")
@@ -72,6 +119,7 @@ def get_loan(loan_id: int):
 
 @bp.post("/<int:loan_id>/return")
 @jwt_required()
+@idempotent
 def return_book(loan_id: int):
     uid = int(get_jwt_identity())
     out = return_loan_uc(loan_id, uid)
@@ -91,8 +139,17 @@ def return_book(loan_id: int):
     return out.model_dump(), 200
 
 
+@bp.post("/renew-all")
+@jwt_required()
+@idempotent
+def renew_all():
+    uid = int(get_jwt_identity())
+    return renew_all_loans_uc(uid).model_dump(), 200
+
+
 @bp.post("/<int:loan_id>/renew")
 @jwt_required()
+@idempotent
 def renew_book(loan_id: int):
     uid = int(get_jwt_identity())
     out = renew_loan_uc(loan_id, uid)
@@ -131,5 +188,76 @@ def renew_book(loan_id: int):
 @jwt_required()
 def list_overdue():
     uid = int(get_jwt_identity())
-    loans = get_overdue_loans_uc(uid)
-    return [loan.model_dump() for loan in loans], 200
+    return get_overdue_loans_uc(uid), 200
+
+
+@bp.get("/metrics")
+@role_required("staff")
+def loans_metrics():
+    """
+    Contadores de las unidades de trabajo de circulación (por proceso):
+    llamadas, reintentos por motivo y abortos tras el último intento.
+    Usage: GET /loans/metrics
+    """
+    from app.common.transactions import transaction_stats
+
+    return {"transactions": transaction_stats()}, 200
+
+
+@bp.cli.command("ensure-schema")
+def ensure_schema_command():
+    """
+    Alias de `flask --app app.wsgi ensure-schema` (app/common/schema.py). Los
+    contadores se rellenan con `loans reconcile-counters`.
+    Usage: flask --app app.wsgi loans ensure-schema
+    """
+    from app.common.schema import ensure_schema
+
+    ensure_schema(force=True)
+    click.echo("Índices de préstamos actualizados.")
+
+
+@bp.cli.command("reconcile-counters")
+@click.option("--chunk-size", default=1000, show_default=True)
+def reconcile_counters_command(chunk_size: int):
+    """
+    Recalcula `user_loan_counters` desde `loans` y `waitlist` y repara las
+    diferencias (también crea las filas que falten).
+    Usage: flask --app app.wsgi loans reconcile-counters
+    """
+    from .counters import reconcile_counters
+
+    summary = reconcile_counters(chunk_size=chunk_size)
+    click.echo(f"{summary['scanned']} usuarios revisados, {summary['created']} creados, "
+               f"{summary['repaired']} reparados.")
+
+
+@bp.cli.command("partition-tables")
+def partition_tables_command():
+    """
+    Convierte `loans` y `loan_history` en tablas particionadas por mes (solo
+    Postgres; bloquea ambas tablas mientras dura).
+    Usage: flask --app app.wsgi loans partition-tables
+    """
+    from flask import current_app
+    from .partitions import partition_tables
+
+    converted = partition_tables(current_app.config.get("LOAN_PARTITION_MONTHS_AHEAD", 3))
+    click.echo(f"Tablas convertidas: {', '.join(converted) or 'ninguna'}.")
+
+
+@bp.cli.command("archive")
+@click.option("--older-than-days", type=int, default=None, help="Por defecto LOAN_ARCHIVE_AFTER_DAYS")
+@click.option("--chunk-size", default=1000, show_default=True)
+def archive_command(older_than_days, chunk_size: int):
+    """
+    Mueve a `loans_archive` los préstamos devueltos hace más de N días.
+    Usage: flask --app app.wsgi loans archive --older-than-days 365
+    """
+    from flask import current_app
+    from .archive import archive_returned_loans
+
+    if older_than_days is None:
+        older_than_days = current_app.config.get("LOAN_ARCHIVE_AFTER_DAYS", 365)
+    summary = archive_returned_loans(older_than_days=older_than_days, chunk_size=chunk_size)
+    click.echo(f"{summary['archived']} préstamos archivados ({summary['history_events']} eventos de historial).")
@@ -1,227 +1,281 @@
-from typing import Optional, List
+import base64
+import binascii
+import json
+from typing import Optional, List, Tuple
 from datetime import datetime, timedelta
 from app.common.models import Loan, LoanStatus, Book, Inventory, Credential, Waitlist, WaitlistStatus, LoanHistory, LoanEventType, Report, ReportType
+from app.common.transactions import run_in_transaction, unit_of_work
+from app.waitlist.promotion import promote_waitlist, publish_holds
 from app.extensions import db
-from infrastructure.events import publish_loan_created, publish_loan_returned, publish_loan_renewed
+from sqlalchemy import case, exists, insert, select, tuple_, update
+from infrastructure.events import publish_loan_created, publish_loan_returned, publish_loan_renewed, publish_loans_batch
+from .archive import user_loans_source
+from .counters import adjust_counters, reserve_loan_slot
 from .dtos import (
     CreateLoanIn, CreateLoanOut, LoanDetailOut, LoanListItemOut,
-    ReturnLoanOut, RenewLoanOut
+    ReturnLoanOut, RenewLoanOut, RenewAllOut
 )
 
 MAX_ACTIVE_LOANS = 5
 LOAN_DURATION_DAYS = 14
 MAX_RENEWALS = 1
+DEFAULT_LOANS_PAGE_SIZE = 50
+MAX_LOANS_PAGE_SIZE = 100
 
 
-def invalidate_dashboard_cache(credential_id: int):
+def invalidate_dashboard_cache(credential_id: int, commit: bool = True):
     """Elimina el cache del dashboard para un usuario específico"""
     Report.query.filter_by(
         credential_id=credential_id,
         report_type=ReportType.DASHBOARD
-    ).delete()
-    db.session.commit()
+    ).delete(synchronize_session=False)
+    if commit:
+        db.session.commit()
 
 
-from app.catalog.service import get_book_by_volume_id
+from app.catalog.importer import import_book, BookImportError
 from werkzeug.exceptions import NotFound
 
+
+def _checkout_eligibility(credential_id: int, book_id: int):
+    """
+    Todas las comprobaciones previas al préstamo en una sola consulta:
+    préstamo activo del mismo libro, reserva pendiente, reserva retenida (HELD)
+    y copias disponibles. El límite de préstamos activos lo aplica
+    `reserve_loan_slot` sobre los contadores del usuario.
+    """
+    def loan_exists(*conditions):
+        return exists().where(Loan.credential_id == credential_id, *conditions)
+
+    def waitlist_entry(status):
+        return (
+            select(Waitlist.id)
+            .where(Waitlist.credential_id == credential_id, Waitlist.book_id == book_id, Waitlist.status == status)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    return db.session.execute(select(
+        loan_exists(Loan.book_id == book_id, Loan.status == LoanStatus.ACTIVE).label("already_borrowed"),
+        waitlist_entry(WaitlistStatus.PENDING).label("pending_waitlist_id"),
+        waitlist_entry(WaitlistStatus.HELD).label("held_waitlist_id"),
+        select(Inventory.available_copies)
+        .where(Inventory.book_id == book_id)
+        .scalar_subquery().label("available_copies"),
+    )).one()
+
+
+def _take_copy(book_id: int, held_waitlist_id: Optional[int]) -> Optional[str]:
+    """
+    Reserva la copia del préstamo dentro de la transacción en curso, sin
+    leer-modificar-escribir: confirma la reserva HELD o decrementa el stock
+    solo si queda alguna copia. Devuelve de dónde salió la copia, o None.
+    """
+    if held_waitlist_id is not None:
+        confirmed = db.session.execute(
+            update(Waitlist)
+            .where(Waitlist.id == held_waitlist_id, Waitlist.status == WaitlistStatus.HELD)
+            .values(status=WaitlistStatus.CONFIRMED)
+            .returning(Waitlist.id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if confirmed:
+            return "waitlist"
+
+    taken = db.session.execute(
+        update(Inventory)
+        .where(Inventory.book_id == book_id, Inventory.available_copies > 0)
+        .values(available_copies=Inventory.available_copies - 1)
+        .returning(Inventory.available_copies)
+        .execution_options(synchronize_session=False)
+    ).first()
+    return "stock" if taken else None
+
+
 def create_loan(credential_id: int, data: CreateLoanIn) -> Optional[CreateLoanOut]:
     # Buscar libro por volume_id en la base de datos local
-    book = Book.query.filter_by(volume_id=data.volume_id).first()
+    book = db.session.execute(
+        select(Book.id, Book.title).where(Book.volume_id == data.volume_id)
+    ).first()
 
-    # Si el libro no existe localmente, importarlo de Google Books
+    # Si el libro no existe localmente, importarlo de Google Books (con stock 0).
+    # Fuera de la unidad de trabajo: la llamada HTTP y su commit no se repiten en cada reintento
     if not book:
         try:
-            google_book_data = get_book_by_volume_id(data.volume_id)
-            if not google_book_data:
-                return "BOOK_NOT_FOUND_ON_GOOGLE"
-            
-            # Validar que tenemos los datos mínimos necesarios
-            if not google_book_data.get("id") or not google_book_data.get("title"):
-                print(f"Datos incompletos del libro de Google Books: {google_book_data}")
-                return "BOOK_IMPORT_FAILED"
-            
-            # Crear el libro en la base de datos local
-            published_date = google_book_data.get("published_date", "")
-            publication_year = published_date[:4] if published_date and len(published_date) >= 4 else None
-            
-            book = Book(
-                volume_id=google_book_data.get("id"),
-                title=google_book_data.get("title", "Título no disponible"),
-                author=", ".join(google_book_data.get("authors", [])) if google_book_data.get("authors") else "Autor desconocido",
-                description=google_book_data.get("description"),
-                isbn=google_book_data.get("isbn_13") or google_book_data.get("isbn_10"),
-                pages=google_book_data.get("page_count", 0),
-                publication_year=publication_year
-            )
-            db.session.add(book)
-            db.session.flush() # Para obtener el ID del nuevo libro
-            
-            # Crear registro de inventario con stock 0
-            inventory = Inventory(book_id=book.id, available_copies=0, reserved_copies=0, damaged_copies=0, total_copies=0)
-            db.session.add(inventory)
-            db.session.flush()
+            book = import_book(data.volume_id, initial_stock=0).book
         except NotFound:
             return "BOOK_NOT_FOUND_ON_GOOGLE"
-        except Exception as e:
+        except BookImportError as e:
             print(f"Error al importar libro de Google Books: {str(e)}")
-            db.session.rollback()
             return "BOOK_IMPORT_FAILED"
 
-    # --- Lógica de préstamo existente (con el libro ya cargado) ---
+    return run_in_transaction("loans.create", _checkout, credential_id, book.id, book.title)
 
-    # Verificar si ya tiene un préstamo activo de este libro
-    existing_active_loan = Loan.query.filter_by(
-        credential_id=credential_id,
-        book_id=book.id,
-        status=LoanStatus.ACTIVE
-    ).first()
-    
-    if existing_active_loan:
+
+def _checkout(credential_id: int, book_id: int, book_title: str) -> Optional[CreateLoanOut]:
+    eligibility = _checkout_eligibility(credential_id, book_id)
+    if eligibility.already_borrowed:
         return "ALREADY_BORROWED"
-    
-    # Verificar si ya tiene una reserva activa de este libro
-    existing_waitlist = Waitlist.query.filter_by(
-        credential_id=credential_id,
-        book_id=book.id
-    ).filter(
-        Waitlist.status.in_([WaitlistStatus.PENDING])
-    ).first()
-    
-    if existing_waitlist:
+    if eligibility.pending_waitlist_id is not None:
         return "ALREADY_IN_WAITLIST"
-    
-    held_waitlist = Waitlist.query.filter_by(
-        credential_id=credential_id,
-        book_id=book.id,
-        status=WaitlistStatus.HELD
-    ).first()
-    
-    # Si no hay copias disponibles y no tiene reserva, agregar a waitlist automáticamente
-    inventory = book.inventory
-    if not inventory:
-        inventory = Inventory(book_id=book.id, available_copies=0, reserved_copies=0, damaged_copies=0, total_copies=0)
-        db.session.add(inventory)
-        db.session.flush()
-    
-    if not held_waitlist and inventory.available_copies <= 0:
-        from app.waitlist.service import add_to_waitlist
-        
-        # Verificar si ya está en waitlist
-        existing_waitlist = Waitlist.query.filter_by(
-            credential_id=credential_id,
-            book_id=book.id
-        ).filter(
-            Waitlist.status.in_([WaitlistStatus.PENDING, WaitlistStatus.HELD])
-        ).first()
-        
-        if existing_waitlist:
-            return "ALREADY_IN_WAITLIST"
-        
-        # Agregar a waitlist automáticamente
-        waitlist_id = add_to_waitlist(credential_id, book.id)
-        
-        return "ADDED_TO_WAITLIST"
-    
-    active_loans_count = Loan.query.filter_by(
-        credential_id=credential_id,
-        status=LoanStatus.ACTIVE
-    ).count()
-    
-    if active_loans_count >= MAX_ACTIVE_LOANS:
+
+    held_waitlist_id = eligibility.held_waitlist_id
+    if held_waitlist_id is None and not eligibility.available_copies:
+        db.session.rollback()
+        return _join_waitlist(credential_id, book_id)
+
+    # --- Transacción única: hueco de préstamo + copia + préstamo + historial + notificación ---
+    if not reserve_loan_slot(credential_id, MAX_ACTIVE_LOANS):
+        db.session.rollback()
         return "MAX_LOANS_EXCEEDED"
-    
+
+    source = _take_copy(book_id, held_waitlist_id)
+    if source is None:
+        # Otro usuario se llevó la última copia entre la comprobación y el UPDATE
+        db.session.rollback()
+        return _join_waitlist(credential_id, book_id)
+    if source == "waitlist":
+        adjust_counters(credential_id, held_waitlist=-1)
+
     loan_date = datetime.utcnow()
     due_date = loan_date + timedelta(days=LOAN_DURATION_DAYS)
-    
+
     new_loan = Loan(
         credential_id=credential_id,
-        book_id=book.id,
+        book_id=book_id,
         status=LoanStatus.ACTIVE,
+        loan_date=loan_date,
         due_date=due_date,
         renewed=False
     )
-    
     new_loan.history.append(
         LoanHistory(event_type=LoanEventType.CREATED, notes="Préstamo creado en el sistema")
     )
-    
-    if held_waitlist:
-        held_waitlist.status = WaitlistStatus.CONFIRMED
-    else:
-        inventory.available_copies -= 1
-    
-    db.session.add(new_loan)
-    db.session.commit()
-    
-    message = "Préstamo creado exitosamente"
-    if held_waitlist:
-        message = "Préstamo creado desde lista de espera"
-    
+
     from app.common.models import Notification, NotificationType
     loan_notification = Notification(
         credential_id=credential_id,
         type=NotificationType.SUCCESS,
         title="Préstamo Confirmado",
-        message=f"Has obtenido el libro '{book.title}'. Fecha de devolución: {due_date.strftime('%d/%m/%Y')}. Tienes {LOAN_DURATION_DAYS} días para disfrutarlo.",
+        message=f"Has obtenido el libro '{book_title}'. Fecha de devolución: {due_date.strftime('%d/%m/%Y')}. Tienes {LOAN_DURATION_DAYS} días para disfrutarlo.",
         is_read=False
     )
-    db.session.add(loan_notification)
-    db.session.commit()
-    
-    # Invalidar cache del dashboard
-    invalidate_dashboard_cache(credential_id)
-    
-    publish_loan_created(
-        loan_id=new_loan.id,
-        user_id=credential_id,
-        book_id=book.id,
-        book_title=book.title,
-        due_date=due_date.isoformat()
-    )
-    
+    db.session.add_all([new_loan, loan_notification])
+
+    # Invalidar cache del dashboard (en la misma transacción)
+    invalidate_dashboard_cache(credential_id, commit=False)
+    try:
+        db.session.flush()
+        loan_id = new_loan.id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # El préstamo ya está confirmado: un fallo del broker no debe convertirlo en error
+    try:
+        publish_loan_created(
+            loan_id=loan_id,
+            user_id=credential_id,
+            book_id=book_id,
+            book_title=book_title,
+            due_date=due_date.isoformat()
+        )
+    except Exception as e:
+        print(f"[LOANS] No se pudo publicar loan.created del préstamo {loan_id}: {e}")
+
     return CreateLoanOut(
-        loan_id=new_loan.id,
-        book_id=book.id,
-        book_title=book.title,
-        loan_date=new_loan.loan_date,
-        due_date=new_loan.due_date,
-        status=new_loan.status.value,
-        message=message
+        loan_id=loan_id,
+        book_id=book_id,
+        book_title=book_title,
+        loan_date=loan_date,
+        due_date=due_date,
+        status=LoanStatus.ACTIVE.value,
+        message="Préstamo creado desde lista de espera" if source == "waitlist" else "Préstamo creado exitosamente"
     )
 
 
-def get_user_loans(credential_id: int, status_filter: Optional[str] = None) -> List[LoanListItemOut]:
-    query = Loan.query.filter_by(credential_id=credential_id)
-    
+def _join_waitlist(credential_id: int, book_id: int) -> str:
+    """Sin copias disponibles: agregar a la lista de espera automáticamente (un solo commit)."""
+    from app.waitlist.service import add_waitlist_entry, publish_waitlist_entry
+
+    entry = add_waitlist_entry(credential_id, book_id)
+    db.session.commit()
+    publish_waitlist_entry(entry)
+    return "ADDED_TO_WAITLIST"
+
+
+class InvalidLoansCursor(ValueError):
+    """El cursor de paginación de préstamos no se pudo decodificar."""
+
+
+def encode_loans_cursor(loan_date: datetime, loan_id: int) -> str:
+    raw = json.dumps([loan_date.isoformat(), loan_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_loans_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Lanza InvalidLoansCursor si el cursor no es válido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        loan_date, loan_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(loan_date), int(loan_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidLoansCursor("El cursor no es válido")
+
+
+def _loan_rows(*conditions, source=None):
+    """Préstamos (de `loans` o de `source`) con el título del libro en una sola consulta (sin N+1)."""
+    loans = Loan.__table__ if source is None else source
+    return (
+        select(loans.c.id, loans.c.book_id, loans.c.loan_date, loans.c.due_date, loans.c.status, Book.title)
+        .outerjoin(Book, Book.id == loans.c.book_id)
+        .where(*conditions)
+    )
+
+
+def _loan_item(row, now: datetime, overdue: Optional[bool] = None) -> dict:
+    # Mismas claves que LoanListItemOut, sin construir un modelo Pydantic por fila
+    return {
+        "loan_id": row.id,
+        "book_id": row.book_id,
+        "book_title": row.title if row.title is not None else "Desconocido",
+        "loan_date": row.loan_date,
+        "due_date": row.due_date,
+        "status": row.status.value,
+        "is_overdue": overdue if overdue is not None else (
+            row.status == LoanStatus.ACTIVE and row.due_date < now
+        ),
+    }
+
+
+def get_user_loans(credential_id: int, status_filter: Optional[str] = None, limit: int = DEFAULT_LOANS_PAGE_SIZE,
+                   cursor: Optional[str] = None, full_history: bool = False) -> Tuple[List[dict], Optional[str]]:
+    """
+    Préstamos del usuario, del más reciente al más antiguo, paginados por
+    keyset sobre (loan_date, id). Devuelve la página y el cursor de la
+    siguiente (None si no hay más). Con `full_history` incluye los préstamos
+    archivados (`loans_archive`).
+    """
+    loans = user_loans_source(credential_id, full_history)
+    conditions = []
     if status_filter:
         try:
-            status_enum = LoanStatus(status_filter.upper())
-            query = query.filter_by(status=status_enum)
+            conditions.append(loans.c.status == LoanStatus(status_filter.upper()))
         except ValueError:
             pass
-    
-    loans = query.order_by(Loan.loan_date.desc()).all()
-    
-    result = []
-    for loan in loans:
-        book = Book.query.get(loan.book_id)
-        is_overdue = (
-            loan.status == LoanStatus.ACTIVE and 
-            loan.due_date < datetime.utcnow()
-        )
-        
-        result.append(LoanListItemOut(
-            loan_id=loan.id,
-            book_id=loan.book_id,
-            book_title=book.title if book else "Desconocido",
-            loan_date=loan.loan_date,
-            due_date=loan.due_date,
-            status=loan.status.value,
-            is_overdue=is_overdue
-        ))
-    
-    return result
+    if cursor:
+        conditions.append(tuple_(loans.c.loan_date, loans.c.id) < decode_loans_cursor(cursor))
+
+    rows = db.session.execute(
+        _loan_rows(*conditions, source=loans)
+        .order_by(loans.c.loan_date.desc(), loans.c.id.desc()).limit(limit + 1)
+    ).all()
+
+    now = datetime.utcnow()
+    page = rows[:limit]
+    next_cursor = encode_loans_cursor(page[-1].loan_date, page[-1].id) if len(rows) > limit else None
+    return [_loan_item(row, now) for row in page], next_cursor
 
 
 def get_loan_details(loan_id: int, credential_id: int) -> Optional[LoanDetailOut]:
@@ -253,6 +307,7 @@ def get_loan_details(loan_id: int, credential_id: int) -> Optional[LoanDetailOut
     )
 
 
+@unit_of_work("loans.return")
 def return_loan(loan_id: int, credential_id: int) -> Optional[ReturnLoanOut]:
     loan = Loan.query.filter_by(id=loan_id, credential_id=credential_id).first()
     if not loan:
@@ -264,7 +319,9 @@ def return_loan(loan_id: int, credential_id: int) -> Optional[ReturnLoanOut]:
     book = Book.query.get(loan.book_id)
     if not book:
         return None
-    
+
+    # Antes de modificar el préstamo (ver app/loans/counters.py)
+    adjust_counters(credential_id, active_loans=-1, returned_loans=1)
     loan.status = LoanStatus.RETURNED
     loan.return_date = datetime.utcnow()
     
@@ -273,12 +330,15 @@ def return_loan(loan_id: int, credential_id: int) -> Optional[ReturnLoanOut]:
         LoanHistory(event_type=LoanEventType.RETURNED, notes="Libro devuelto por el usuario")
     )
 
-    # Incrementar stock en tabla inventory
-    inventory = book.inventory
-    if inventory:
-        inventory.available_copies += 1
-    
-    db.session.commit()
+    # Incrementar stock en tabla inventory (UPDATE relativo, sin leer-modificar-escribir)
+    db.session.execute(
+        update(Inventory)
+        .where(Inventory.book_id == book.id)
+        .values(available_copies=Inventory.available_copies + 1)
+        .execution_options(synchronize_session=False)
+    )
+    # La copia devuelta pasa antes a la lista de espera del libro, en la misma transacción
+    holds = promote_waitlist([book.id])
     
     from app.common.models import Notification, NotificationType
     return_notification = Notification(
@@ -289,11 +349,11 @@ def return_loan(loan_id: int, credential_id: int) -> Optional[ReturnLoanOut]:
         is_read=False
     )
     db.session.add(return_notification)
+
+    # Invalidar cache del dashboard (en la misma transacción: un solo commit)
+    invalidate_dashboard_cache(credential_id, commit=False)
     db.session.commit()
     
-    # Invalidar cache del dashboard
-    invalidate_dashboard_cache(credential_id)
-    
     # Publish loan returned event
     publish_loan_returned(
         loan_id=loan.id,
@@ -301,6 +361,7 @@ def return_loan(loan_id: int, credential_id: int) -> Optional[ReturnLoanOut]:
         book_id=book.id,
         book_title=book.title
     )
+    publish_holds(holds)
     
     return ReturnLoanOut(
         loan_id=loan.id,
@@ -370,25 +431,80 @@ def renew_loan(loan_id: int, credential_id: int) -> Optional[RenewLoanOut]:
     )
 
 
-def get_overdue_loans(credential_id: int) -> List[LoanListItemOut]:
+def renew_all_loans(credential_id: int) -> RenewAllOut:
+    """
+    Renueva de una vez todos los préstamos renovables del usuario: ACTIVE,
+    sin renovar, no vencidos y sin nadie esperando el libro (anti-join con
+    `waitlist`). Una consulta, un UPDATE, un INSERT de historial y un evento.
+    """
     now = datetime.utcnow()
-    loans = Loan.query.filter(
-        Loan.credential_id == credential_id,
-        Loan.status == LoanStatus.ACTIVE,
-        Loan.due_date < now
-    ).order_by(Loan.due_date.asc()).all()
-    
-    result = []
-    for loan in loans:
-        book = Book.query.get(loan.book_id)
-        result.append(LoanListItemOut(
-            loan_id=loan.id,
-            book_id=loan.book_id,
-            book_title=book.title if book else "Desconocido",
-            loan_date=loan.loan_date,
-            due_date=loan.due_date,
-            status=loan.status.value,
-            is_overdue=True
-        ))
-    
-    return result
+    contested = exists().where(Waitlist.book_id == Loan.book_id, Waitlist.status == WaitlistStatus.PENDING)
+    eligible = {row.id: row for row in db.session.execute(
+        select(Loan.id, Loan.book_id, Loan.due_date, Book.title.label("book_title"))
+        .join(Book, Book.id == Loan.book_id)
+        .where(
+            Loan.credential_id == credential_id,
+            Loan.status == LoanStatus.ACTIVE,
+            Loan.renewed.is_(False),
+            Loan.due_date >= now,
+            ~contested,
+        )
+        .order_by(Loan.due_date.asc(), Loan.id.asc())
+        .with_for_update(of=Loan)
+    )}
+    if not eligible:
+        db.session.rollback()
+        return RenewAllOut(renewed=[], count=0, message="No hay préstamos renovables")
+
+    new_due = {loan_id: row.due_date + timedelta(days=LOAN_DURATION_DAYS) for loan_id, row in eligible.items()}
+    try:
+        renewed = set(db.session.execute(
+            update(Loan)
+            .where(Loan.id.in_(eligible), Loan.status == LoanStatus.ACTIVE, Loan.renewed.is_(False))
+            .values(due_date=case(new_due, value=Loan.id), renewed=True, status=LoanStatus.RENEWED)
+            .returning(Loan.id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+        rows = [row for loan_id, row in eligible.items() if loan_id in renewed]
+        if rows:
+            db.session.execute(insert(LoanHistory), [{
+                "loan_id": row.id, "event_type": LoanEventType.RENEWED, "timestamp": now,
+                "notes": f"Préstamo renovado. Nueva fecha de devolución: {new_due[row.id].strftime('%d/%m/%Y')}",
+            } for row in rows])
+            invalidate_dashboard_cache(credential_id, commit=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if rows:
+        try:
+            publish_loans_batch(credential_id, created=[], returned=[], renewed=[
+                {"loan_id": row.id, "book_id": row.book_id, "new_due_date": new_due[row.id].isoformat()}
+                for row in rows
+            ])
+        except Exception as e:
+            print(f"[LOANS] No se pudo publicar loan.batch del usuario {credential_id}: {e}")
+
+    return RenewAllOut(
+        renewed=[
+            RenewLoanOut(loan_id=row.id, book_id=row.book_id, book_title=row.book_title,
+                         old_due_date=row.due_date, new_due_date=new_due[row.id],
+                         message="Préstamo renovado exitosamente")
+            for row in rows
+        ],
+        count=len(rows),
+        message=f"{len(rows)} préstamo(s) renovado(s)" if rows else "No hay préstamos renovables",
+    )
+
+
+def get_overdue_loans(credential_id: int) -> List[dict]:
+    now = datetime.utcnow()
+    rows = db.session.execute(
+        _loan_rows(
+            Loan.credential_id == credential_id,
+            Loan.status == LoanStatus.ACTIVE,
+            Loan.due_date < now
+        ).order_by(Loan.due_date.asc())
+    ).all()
+    return [_loan_item(row, now, overdue=True) for row in rows]
@@ -0,0 +1,150 @@
+"""
+Barrido periódico de vencimientos de préstamos (Celery beat).
+
+En cada ejecución:
+  - recordatorio a los préstamos que entran en la ventana "vence pronto"
+    (vencen en menos de `reminder_lead`),
+  - aviso a los préstamos que acaban de vencer,
+  - evento `loan.overdue` por lotes con los recién vencidos.
+
+Todo se hace por conjuntos en la base de datos (`INSERT ... SELECT` sobre el
+índice `(status, due_date)`), sin cargar los préstamos uno a uno en Python.
+La marca `job_checkpoints` guarda el instante de la última ejecución: cada
+barrido solo procesa los préstamos cuyo vencimiento cruzó un umbral desde
+entonces, así que nadie recibe el mismo aviso dos veces.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import String, cast, func, insert, literal, select
+
+from app.common.models import (
+    Book, JobCheckpoint, Loan, LoanEventType, LoanHistory, LoanStatus, Notification, NotificationType
+)
+from app.common.upsert import dialect_insert
+from app.extensions import db
+from infrastructure.events import publish_loans_overdue
+
+CHECKPOINT_NAME = "loans.due_date_sweep"
+# Un préstamo renovado sigue fuera de la biblioteca
+OUT_STATUSES = (LoanStatus.ACTIVE, LoanStatus.RENEWED)
+
+
+def _due_between(lower: Optional[datetime], upper: datetime):
+    conditions = [Loan.status.in_(OUT_STATUSES), Loan.due_date <= upper]
+    if lower is not None:
+        conditions.append(Loan.due_date > lower)
+    return conditions
+
+
+def _insert_history(conditions, now: datetime, note: str) -> int:
+    event_type = LoanHistory.__table__.c.event_type.type
+    return db.session.execute(
+        insert(LoanHistory).from_select(
+            ["loan_id", "event_type", "timestamp", "notes"],
+            select(Loan.id, literal(LoanEventType.REMINDER_SENT, event_type), literal(now), literal(note))
+            .where(*conditions),
+        )
+        # Sin esta opción el INSERT de Core no conserva el rowcount del driver (psycopg devuelve -1)
+        .execution_options(preserve_rowcount=True)
+    ).rowcount
+
+
+def _insert_notifications(conditions, now: datetime, notification_type: NotificationType,
+                          title: str, before: str, after: str) -> int:
+    """Una notificación por préstamo: `before` + título del libro + `after` + fecha de vencimiento."""
+    type_column = Notification.__table__.c.type.type
+    message = literal(before) + Book.title + literal(after) + cast(func.date(Loan.due_date), String) + literal(".")
+    return db.session.execute(
+        insert(Notification).from_select(
+            ["credential_id", "type", "title", "message", "is_read", "created_at"],
+            select(
+                Loan.credential_id, literal(notification_type, type_column), literal(title),
+                message, literal(False), literal(now),
+            )
+            .join(Book, Book.id == Loan.book_id)
+            .where(*conditions),
+        )
+        .execution_options(preserve_rowcount=True)
+    ).rowcount
+
+
+def _publish_overdue(conditions, batch_size: int) -> int:
+    """Publica los recién vencidos en eventos de `batch_size` préstamos (lectura en streaming)."""
+    batches = 0
+    result = db.session.execute(
+        select(Loan.id, Loan.credential_id, Loan.book_id, Loan.due_date)
+        .where(*conditions)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in result.partitions():
+        publish_loans_overdue([
+            {"loan_id": r.id, "user_id": r.credential_id, "book_id": r.book_id, "due_date": r.due_date.isoformat()}
+            for r in partition
+        ])
+        batches += 1
+    return batches
+
+
+def sweep_due_dates(now: Optional[datetime] = None, reminder_lead: timedelta = timedelta(days=2),
+                    initial_lookback: timedelta = timedelta(days=1), batch_size: int = 1000) -> dict:
+    """
+    Envía recordatorios y avisos de vencimiento de los préstamos que cruzaron
+    un umbral desde la última ejecución.
+
+    Args:
+        reminder_lead: antelación del recordatorio "vence pronto".
+        initial_lookback: en la primera ejecución (sin marca), cuánto hacia
+            atrás se consideran "recién vencidos". Esa primera ejecución
+            recuerda todos los préstamos que vencen dentro de `reminder_lead`.
+        batch_size: préstamos por evento `loan.overdue`.
+    """
+    now = now or datetime.utcnow()
+
+    # Fila de la marca bloqueada durante el barrido: dos ejecuciones solapadas se serializan
+    first_run = db.session.execute(
+        dialect_insert(JobCheckpoint)
+        .values(name=CHECKPOINT_NAME, high_water=now - initial_lookback, updated_at=now)
+        .on_conflict_do_nothing()
+        .execution_options(preserve_rowcount=True)
+    ).rowcount == 1
+    checkpoint = db.session.execute(
+        select(JobCheckpoint).where(JobCheckpoint.name == CHECKPOINT_NAME).with_for_update()
+    ).scalar_one()
+    last_run = checkpoint.high_water
+    if last_run >= now:
+        db.session.rollback()
+        return {"reminders": 0, "overdue": 0, "events": 0, "from": last_run.isoformat(), "to": now.isoformat()}
+
+    # Vence pronto: el vencimiento entró en (última ejecución + antelación, ahora + antelación],
+    # sin incluir los que ya vencieron (esos reciben el aviso de vencido). Sin marca previa,
+    # todo lo que vence dentro de la antelación: nadie lo avisó antes
+    reminder_from = now if first_run else max(last_run + reminder_lead, now)
+    reminder = _due_between(reminder_from, now + reminder_lead)
+    overdue = _due_between(last_run, now)
+
+    try:
+        reminders = _insert_history(reminder, now, "Recordatorio: el préstamo vence pronto")
+        _insert_notifications(
+            reminder, now, NotificationType.INFO, "Tu préstamo vence pronto",
+            "Recuerda devolver '", "' antes del ",
+        )
+        overdue_count = _insert_history(overdue, now, "Aviso: el préstamo está vencido")
+        _insert_notifications(
+            overdue, now, NotificationType.WARNING, "Préstamo vencido",
+            "El plazo de '", "' venció el ",
+        )
+        checkpoint.high_water = now
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Después del commit: los eventos solo salen si los avisos quedaron guardados
+    events = _publish_overdue(overdue, batch_size) if overdue_count else 0
+    db.session.rollback()
+
+    summary = {"reminders": reminders, "overdue": overdue_count, "events": events,
+               "from": last_run.isoformat(), "to": now.isoformat()}
+    print(f"[SWEEP] {summary}")
+    return summary
@@ -0,0 +1,63 @@
+from infrastructure.celery_app import celery
+
+
+@celery.task(
+    name="loans.sweep_due_dates",
+    bind=True,
+    max_retries=3,
+)
+def sweep_due_dates_async(self):
+    from datetime import timedelta
+    from flask import current_app
+    from app.loans.sweep import sweep_due_dates
+
+    config = current_app.config
+    return sweep_due_dates(
+        reminder_lead=timedelta(hours=config.get("LOAN_REMINDER_LEAD_HOURS", 48)),
+        batch_size=config.get("LOAN_OVERDUE_EVENT_BATCH", 1000),
+    )
+
+
+@celery.task(
+    name="loans.reconcile_counters",
+    bind=True,
+    max_retries=3,
+)
+def reconcile_counters_async(self, chunk_size: int = 1000, after_id: int = 0):
+    from app.loans.counters import reconcile_counters
+
+    def report(summary):
+        self.update_state(state="PROGRESS", meta=summary)
+
+    return reconcile_counters(chunk_size=chunk_size, after_id=after_id, progress=report)
+
+
+@celery.task(
+    name="loans.maintain_partitions",
+    bind=True,
+    max_retries=3,
+)
+def maintain_partitions_async(self):
+    from flask import current_app
+    from app.loans.partitions import ensure_monthly_partitions
+
+    return {"created": ensure_monthly_partitions(current_app.config.get("LOAN_PARTITION_MONTHS_AHEAD", 3))}
+
+
+@celery.task(
+    name="loans.archive_returned_loans",
+    bind=True,
+    max_retries=3,
+)
+def archive_returned_loans_async(self, chunk_size: int = 1000):
+    from flask import current_app
+    from app.loans.archive import archive_returned_loans
+
+    def report(summary):
+        self.update_state(state="PROGRESS", meta=summary)
+
+    return archive_returned_loans(
+        older_than_days=current_app.config.get("LOAN_ARCHIVE_AFTER_DAYS", 365),
+        chunk_size=chunk_size,
+        progress=report,
+    )
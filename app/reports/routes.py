@@ -1,4 +1,4 @@
-from flask import Blueprint, Response
+from flask import Blueprint, Response, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .service import (
     get_my_dashboard as get_my_dashboard_uc,
@@ -36,7 +36,8 @@ def all_categories():
 @jwt_required()
 def export_pdf():
     uid = int(get_jwt_identity())
-    pdf_content = export_my_history_pdf_uc(uid)
+    # history=full incluye los préstamos archivados
+    pdf_content = export_my_history_pdf_uc(uid, full_history=request.args.get("history") == "full")
     
     return Response(
         pdf_content,
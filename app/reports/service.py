@@ -1,12 +1,14 @@
 from typing import Optional
 from datetime import datetime, timedelta
 from collections import Counter
-from sqlalchemy import func
+from sqlalchemy import func, select
 from app.common.models import (
     Credential, UserProfile, Book, Inventory, BookCategory, Loan, LoanStatus, 
     Waitlist, WaitlistStatus, Report, ReportType
 )
 from app.extensions import db
+from app.loans.archive import user_loans_source
+from app.loans.counters import get_counters
 from .dtos import (
     CategoryReadingItem, MyDashboardOut,
     ReadBookItem, MyReadingHistoryOut,
@@ -33,29 +35,34 @@ CATEGORY_NAMES = {
 }
 
 
-def get_my_reading_history(credential_id: int) -> MyReadingHistoryOut:
-    loans = Loan.query.filter_by(credential_id=credential_id).order_by(Loan.loan_date.desc()).all()
-    
+def _history_rows(credential_id: int, full_history: bool):
+    """Préstamos del usuario (con los archivados si `full_history`) junto a su libro, del más reciente al más antiguo."""
+    loans = user_loans_source(credential_id, full_history)
+    return db.session.execute(
+        select(loans.c.loan_date, loans.c.return_date, loans.c.status,
+               Book.id.label("book_id"), Book.title, Book.author, Book.category, Book.pages)
+        .join(Book, Book.id == loans.c.book_id)
+        .order_by(loans.c.loan_date.desc())
+    ).all()
+
+
+def get_my_reading_history(credential_id: int, full_history: bool = False) -> MyReadingHistoryOut:
     books_read = []
     total_pages = 0
     currently_reading = 0
     
-    for loan in loans:
-        book = Book.query.get(loan.book_id)
-        if not book:
-            continue
-            
+    for loan in _history_rows(credential_id, full_history):
         if loan.status == LoanStatus.RETURNED:
-            total_pages += book.pages or 0
+            total_pages += loan.pages or 0
         elif loan.status in [LoanStatus.ACTIVE, LoanStatus.RENEWED]:
             currently_reading += 1
             
         books_read.append(ReadBookItem(
-            book_id=book.id,
-            title=book.title,
-            author=book.author,
-            category=book.category.value if book.category else "UNKNOWN",
-            pages=book.pages or 0,
+            book_id=loan.book_id,
+            title=loan.title,
+            author=loan.author,
+            category=loan.category.value if loan.category else "UNKNOWN",
+            pages=loan.pages or 0,
             loan_date=loan.loan_date,
             return_date=loan.return_date,
             status=loan.status.value
@@ -323,23 +330,13 @@ def get_my_dashboard(credential_id: int, use_cache: bool = True) -> MyDashboardO
         if cached and cached.expires_at and cached.expires_at > datetime.utcnow():
             return MyDashboardOut(**cached.data)
     
-    active_loans = Loan.query.filter(
-        Loan.credential_id == credential_id,
-        Loan.status.in_([LoanStatus.ACTIVE, LoanStatus.RENEWED])
-    ).count()
-    
-    waitlist_count = Waitlist.query.filter(
-        Waitlist.credential_id == credential_id,
-        Waitlist.status.in_([WaitlistStatus.PENDING, WaitlistStatus.HELD])
-    ).count()
-    
-    history_count = Loan.query.filter_by(credential_id=credential_id).count()
-    
-    books_read = Loan.query.filter_by(
-        credential_id=credential_id,
-        status=LoanStatus.RETURNED
-    ).count()
-    
+    # Una fila de contadores en vez de cuatro COUNT (app/loans/counters.py)
+    counters = get_counters(credential_id)
+    active_loans = counters["active_loans"]
+    waitlist_count = counters["pending_waitlist"] + counters["held_waitlist"]
+    history_count = counters["total_loans"]
+    books_read = counters["returned_loans"]
+
     all_loans = Loan.query.filter_by(credential_id=credential_id).all()
     categories = []
     for loan in all_loans:
@@ -379,7 +376,7 @@ def get_my_dashboard(credential_id: int, use_cache: bool = True) -> MyDashboardO
     return result
 
 
-def export_my_history_pdf(credential_id: int, save_report: bool = True) -> bytes:
+def export_my_history_pdf(credential_id: int, save_report: bool = True, full_history: bool = False) -> bytes:
     from io import BytesIO
     from reportlab.lib import colors
     from reportlab.lib.pagesizes import letter, A4
@@ -411,18 +408,14 @@ def export_my_history_pdf(credential_id: int, save_report: bool = True) -> bytes
     elements.append(Paragraph(f"<b>Fecha:</b> {datetime.utcnow().strftime('%d/%m/%Y')}", info_style))
     elements.append(Spacer(1, 20))
     
-    loans = Loan.query.filter_by(credential_id=credential_id).order_by(Loan.loan_date.desc()).all()
+    loans = _history_rows(credential_id, full_history)
     
     data = [["Título", "Autor", "Categoría", "Fecha", "Estado"]]
     
     for loan in loans:
-        book = Book.query.get(loan.book_id)
-        if not book:
-            continue
-        
-        title = book.title[:30] + "..." if len(book.title) > 30 else book.title
-        author = (book.author or "N/A")[:20]
-        category = CATEGORY_NAMES.get(book.category.value, book.category.value) if book.category else "N/A"
+        title = loan.title[:30] + "..." if len(loan.title) > 30 else loan.title
+        author = (loan.author or "N/A")[:20]
+        category = CATEGORY_NAMES.get(loan.category.value, loan.category.value) if loan.category else "N/A"
         loan_date = loan.loan_date.strftime("%d/%m/%Y") if loan.loan_date else "N/A"
         status = "Leído" if loan.status.value == "RETURNED" else "Activo"
         
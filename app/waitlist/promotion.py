@@ -0,0 +1,120 @@
+"""
+Promoción de la lista de espera: cuando se libera stock, las copias pasan a
+las reservas PENDING más antiguas del libro (FIFO por `created_at`).
+
+`promote_waitlist(book_ids)` se llama dentro de la transacción que libera
+las copias (devolución, lote del mostrador, cancelación de una reserva HELD,
+reposición de stock) y no hace commit: el stock devuelto y las reservas que
+lo toman se confirman juntos o no se confirma nada. Por cada libro, en orden
+de id para no cruzar bloqueos:
+
+  - bloquea su fila de `inventory` con un UPDATE sin cambios que devuelve
+    las copias libres (en Postgres y en SQLite, donde FOR UPDATE no existe),
+  - toma hasta ese número de reservas PENDING con
+    `FOR UPDATE SKIP LOCKED`: dos workers nunca retienen la misma reserva
+    ni más copias de las que hay.
+
+Después aplica todo en bloque: un UPDATE de stock (CASE por libro), uno de
+reservas, los contadores, las notificaciones y la invalidación del
+dashboard. Devuelve las reservas retenidas para que el llamador publique
+`publish_waitlist_held` tras el commit.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, insert, select, update
+
+from app.common.models import (
+    Book, Inventory, Notification, NotificationType, Report, ReportType, Waitlist, WaitlistStatus
+)
+from app.extensions import db
+from app.loans.counters import apply_counter_deltas, ensure_counters
+from infrastructure.events import publish_waitlist_held
+
+
+def promote_waitlist(book_ids: Iterable[int], now: Optional[datetime] = None) -> List[Dict]:
+    """
+    Retiene copias libres para las reservas PENDING más antiguas de cada libro,
+    en la transacción en curso. Devuelve `[{waitlist_id, user_id, book_id, book_title}]`.
+    """
+    now = now or datetime.utcnow()
+    entries = []
+    for book_id in sorted(set(book_ids)):
+        available = db.session.execute(
+            update(Inventory)
+            .where(Inventory.book_id == book_id, Inventory.available_copies > 0)
+            .values(available_copies=Inventory.available_copies)
+            .returning(Inventory.available_copies)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if not available:
+            continue
+        entries += db.session.execute(
+            select(Waitlist.id, Waitlist.credential_id, Waitlist.book_id)
+            .where(Waitlist.book_id == book_id, Waitlist.status == WaitlistStatus.PENDING)
+            .order_by(Waitlist.created_at, Waitlist.id)
+            .limit(available)
+            .with_for_update(skip_locked=True)
+        ).all()
+    if not entries:
+        return []
+
+    users = {entry.credential_id for entry in entries}
+    # Antes de escribir la transición (ver app/loans/counters.py)
+    ensure_counters(users)
+
+    per_book = Counter(entry.book_id for entry in entries)
+    db.session.execute(
+        update(Inventory)
+        .where(Inventory.book_id.in_(per_book))
+        .values(available_copies=Inventory.available_copies - case(per_book, value=Inventory.book_id))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(Waitlist)
+        .where(Waitlist.id.in_([entry.id for entry in entries]), Waitlist.status == WaitlistStatus.PENDING)
+        .values(status=WaitlistStatus.HELD)
+        .execution_options(synchronize_session=False)
+    )
+
+    deltas = defaultdict(Counter)
+    for entry in entries:
+        deltas[entry.credential_id].update(pending_waitlist=-1, held_waitlist=1)
+    apply_counter_deltas(deltas)
+
+    titles = dict(db.session.execute(select(Book.id, Book.title).where(Book.id.in_(per_book))).all())
+    db.session.execute(insert(Notification), [{
+        "credential_id": entry.credential_id,
+        "type": NotificationType.SUCCESS,
+        "title": "Libro Disponible",
+        "message": f"'{titles.get(entry.book_id) or 'El libro solicitado'}' ya está disponible y te lo hemos "
+                   f"reservado. Confirma tu reserva desde la lista de espera para recogerlo.",
+        "is_read": False,
+        "created_at": now,
+    } for entry in entries])
+    # Una invalidación del dashboard para todos los usuarios retenidos
+    db.session.execute(
+        delete(Report)
+        .where(Report.credential_id.in_(users), Report.report_type == ReportType.DASHBOARD)
+        .execution_options(synchronize_session=False)
+    )
+
+    holds = [{
+        "waitlist_id": entry.id,
+        "user_id": entry.credential_id,
+        "book_id": entry.book_id,
+        "book_title": titles.get(entry.book_id),
+    } for entry in entries]
+    print(f"[WAITLIST] {len(holds)} reservas retenidas en {len(per_book)} libros")
+    return holds
+
+
+def publish_holds(holds: List[Dict]) -> None:
+    """Publica las retenciones de una promoción; llamar después del commit."""
+    if not holds:
+        return
+    try:
+        publish_waitlist_held(holds)
+    except Exception as e:
+        print(f"[WAITLIST] No se pudo publicar waitlist.held: {e}")
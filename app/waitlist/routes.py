@@ -1,10 +1,13 @@
-from flask import Blueprint, request
+from flask import Blueprint, abort, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from pydantic import ValidationError, BaseModel, field_validator
 from ..extensions import db
+from ..common.idempotency import idempotent
 from ..common.models import Waitlist, WaitlistStatus, Book, Inventory, Credential, Notification, NotificationType
-from .service import add_to_waitlist
-from ..catalog.service import get_book_by_volume_id, add_book_to_catalog
+from .service import add_to_waitlist, cancel_waitlist, confirm_waitlist
+from werkzeug.exceptions import NotFound
+from ..catalog.service import add_book_to_catalog
+from ..catalog.importer import BookImportError
 
 bp = Blueprint("waitlist", __name__)
 
@@ -20,6 +23,7 @@ class AddToWaitlistIn(BaseModel):
 
 @bp.post("")
 @jwt_required()
+@idempotent
 def add_to_waitlist_route():
     try:
         data = AddToWaitlistIn.model_validate(request.get_json() or {})
@@ -41,16 +45,10 @@ def add_to_waitlist_route():
     # Si el libro no existe localmente, importarlo desde Google Books
     if not book:
         try:
-            # Verificar que existe en Google Books
-            google_book = get_book_by_volume_id(volume_id)
-            if not google_book:
-                return {"code": "BOOK_NOT_FOUND_ON_GOOGLE", "message": f"No se encontró el libro con volume_id {volume_id} en Google Books"}, 404
-            
-            # Importar el libro al catálogo local
-            book = add_book_to_catalog(volume_id)
-            if not book:
-                return {"code": "BOOK_IMPORT_FAILED", "message": "No se pudo importar el libro al catálogo local"}, 500
-        except Exception as e:
+            book = add_book_to_catalog(volume_id).book
+        except NotFound:
+            return {"code": "BOOK_NOT_FOUND_ON_GOOGLE", "message": f"No se encontró el libro con volume_id {volume_id} en Google Books"}, 404
+        except BookImportError as e:
             return {"code": "BOOK_IMPORT_FAILED", "message": f"Error al importar el libro: {str(e)}"}, 500
     
     # Verificar si ya está en la lista de espera
@@ -159,78 +157,37 @@ def get_waitlist_details(wid: int):
 
 @bp.post("/<int:wid>/cancel")
 @jwt_required()
+@idempotent
 def cancel(wid: int):
     uid = int(get_jwt_identity())
-    w = Waitlist.query.get_or_404(wid)
-    
-    if w.credential_id != uid:
+    out = cancel_waitlist(uid, wid)
+
+    if out == "NOT_FOUND":
+        abort(404)
+    if out == "FORBIDDEN":
         return {"msg": "No tienes permiso para cancelar esta waitlist"}, 403
-    
-    if w.status in [WaitlistStatus.CONFIRMED, WaitlistStatus.CANCELLED]:
-        return {"msg": f"No se puede cancelar una waitlist en estado {w.status.value}"}, 409
-    
-    if w.status == WaitlistStatus.HELD:
-        book = Book.query.get(w.book_id)
-        if book and book.inventory:
-            book.inventory.available_copies += 1
-    
-    w.status = WaitlistStatus.CANCELLED
-    db.session.commit()
-    
-    book = Book.query.get(w.book_id)
-    cancel_notification = Notification(
-        credential_id=uid,
-        type=NotificationType.WARNING,
-        title="Lista de Espera Cancelada",
-        message=f"Has cancelado tu lista de espera para '{book.title if book else 'el libro solicitado'}'. Ya no recibirás notificaciones sobre este libro.",
-        is_read=False
-    )
-    db.session.add(cancel_notification)
-    db.session.commit()
-    
-    # Invalidar cache del dashboard
-    from .service import invalidate_dashboard_cache
-    invalidate_dashboard_cache(uid)
-    
-    return {"status": w.status.value, "message": "Lista de espera cancelada exitosamente"}, 200
+    if out == "INVALID_STATUS":
+        status = db.session.get(Waitlist, wid).status
+        return {"msg": f"No se puede cancelar una waitlist en estado {status.value}"}, 409
+
+    return {"status": out["status"], "message": "Lista de espera cancelada exitosamente"}, 200
 
 @bp.post("/<int:wid>/confirm")
 @jwt_required()
+@idempotent
 def confirm(wid: int):
     uid = int(get_jwt_identity())
-    w = Waitlist.query.get_or_404(wid)
-    
-    if w.credential_id != uid:
+    out = confirm_waitlist(uid, wid)
+
+    if out == "NOT_FOUND":
+        abort(404)
+    if out == "FORBIDDEN":
         return {"code": "FORBIDDEN", "message": "No tienes permiso para confirmar esta waitlist"}, 403
-    
-    if w.status != WaitlistStatus.HELD:
+    if out == "INVALID_STATUS":
+        status = db.session.get(Waitlist, wid).status
         return {
             "code": "INVALID_STATUS",
-            "message": f"Solo se pueden confirmar reservas en estado HELD. Estado actual: {w.status.value}"
+            "message": f"Solo se pueden confirmar reservas en estado HELD. Estado actual: {status.value}"
         }, 409
-    
-    w.status = WaitlistStatus.CONFIRMED
-    db.session.commit()
-    
-    book = Book.query.get(w.book_id)
-    confirm_notification = Notification(
-        credential_id=uid,
-        type=NotificationType.SUCCESS,
-        title="Reserva Confirmada",
-        message=f"Tu reserva para '{book.title if book else 'el libro solicitado'}' ha sido confirmada. Puedes recogerlo en la biblioteca.",
-        is_read=False
-    )
-    db.session.add(confirm_notification)
-    db.session.commit()
-    
-    # Invalidar cache del dashboard
-    from .service import invalidate_dashboard_cache
-    invalidate_dashboard_cache(uid)
-    
-    return {
-        "waitlist_id": w.id,
-        "book_id": w.book_id,
-        "book_title": book.title if book else "Unknown",
-        "status": w.status.value,
-        "message": "Reserva confirmada exitosamente"
-    }, 200
+
+    return {**out, "message": "Reserva confirmada exitosamente"}, 200
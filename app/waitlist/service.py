@@ -1,30 +1,128 @@
-from ..common.models import Waitlist, WaitlistStatus, Report, ReportType
+from typing import Dict, Union
+from sqlalchemy import select, update
+from ..common.models import (
+    Waitlist, WaitlistStatus, Report, ReportType, Book, Inventory, Notification, NotificationType
+)
+from ..common.transactions import unit_of_work
 from ..extensions import db
 from infrastructure.events import publish_waitlist_added
+from app.loans.counters import adjust_counters
+from .promotion import promote_waitlist, publish_holds
 from .tasks import hold_copy_async
 
-def invalidate_dashboard_cache(credential_id: int):
+def invalidate_dashboard_cache(credential_id: int, commit: bool = True):
     """Elimina el cache del dashboard para un usuario específico"""
     Report.query.filter_by(
         credential_id=credential_id,
         report_type=ReportType.DASHBOARD
     ).delete()
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
-def add_to_waitlist(credential_id: int, book_id: int) -> int:
+def add_waitlist_entry(credential_id: int, book_id: int) -> Dict:
+    """
+    Agrega la reserva PENDING dentro de la transacción en curso, sin commit.
+    Después del commit, `publish_waitlist_entry` con lo que devuelve.
+    """
+    adjust_counters(credential_id, pending_waitlist=1)
     w = Waitlist(credential_id=credential_id, book_id=book_id, status=WaitlistStatus.PENDING)
     db.session.add(w)
+    db.session.flush()
+    invalidate_dashboard_cache(credential_id, commit=False)
+    return {"waitlist_id": w.id, "user_id": credential_id, "book_id": book_id}
+
+
+def publish_waitlist_entry(entry: Dict) -> None:
+    """Encola la retención de copia y publica waitlist.added; llamar después del commit."""
+    try:
+        hold_copy_async.delay(entry["waitlist_id"])
+        publish_waitlist_added(**entry)
+    except Exception as e:
+        # La reserva ya está guardada: sigue PENDING y se promociona al liberarse una copia
+        print(f"[WAITLIST] No se pudo publicar waitlist.added de la reserva {entry['waitlist_id']}: {e}")
+
+
+def add_to_waitlist(credential_id: int, book_id: int) -> int:
+    entry = add_waitlist_entry(credential_id, book_id)
+    db.session.commit()
+    publish_waitlist_entry(entry)
+    return entry["waitlist_id"]
+
+
+def _owned_waitlist(credential_id: int, waitlist_id: int) -> Union[Waitlist, str]:
+    w = db.session.get(Waitlist, waitlist_id)
+    if not w:
+        return "NOT_FOUND"
+    if w.credential_id != credential_id:
+        return "FORBIDDEN"
+    return w
+
+
+@unit_of_work("waitlist.cancel")
+def cancel_waitlist(credential_id: int, waitlist_id: int) -> Union[dict, str]:
+    """
+    Cancela la reserva; si estaba HELD la copia vuelve al stock y pasa a la
+    siguiente reserva PENDING del libro. Un solo commit.
+    """
+    w = _owned_waitlist(credential_id, waitlist_id)
+    if isinstance(w, str):
+        return w
+    if w.status in [WaitlistStatus.CONFIRMED, WaitlistStatus.CANCELLED]:
+        return "INVALID_STATUS"
+
+    if w.status == WaitlistStatus.HELD:
+        adjust_counters(credential_id, held_waitlist=-1)
+        db.session.execute(
+            update(Inventory)
+            .where(Inventory.book_id == w.book_id)
+            .values(available_copies=Inventory.available_copies + 1)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        adjust_counters(credential_id, pending_waitlist=-1)
+    freed = w.status == WaitlistStatus.HELD
+    w.status = WaitlistStatus.CANCELLED
+    holds = promote_waitlist([w.book_id]) if freed else []
+
+    book_title = db.session.execute(select(Book.title).where(Book.id == w.book_id)).scalar()
+    db.session.add(Notification(
+        credential_id=credential_id,
+        type=NotificationType.WARNING,
+        title="Lista de Espera Cancelada",
+        message=f"Has cancelado tu lista de espera para '{book_title or 'el libro solicitado'}'. Ya no recibirás notificaciones sobre este libro.",
+        is_read=False
+    ))
+    invalidate_dashboard_cache(credential_id, commit=False)
+    db.session.commit()
+    publish_holds(holds)
+    return {"status": WaitlistStatus.CANCELLED.value}
+
+
+@unit_of_work("waitlist.confirm")
+def confirm_waitlist(credential_id: int, waitlist_id: int) -> Union[dict, str]:
+    """Confirma una reserva HELD. Un solo commit."""
+    w = _owned_waitlist(credential_id, waitlist_id)
+    if isinstance(w, str):
+        return w
+    if w.status != WaitlistStatus.HELD:
+        return "INVALID_STATUS"
+
+    adjust_counters(credential_id, held_waitlist=-1)
+    w.status = WaitlistStatus.CONFIRMED
+
+    book_title = db.session.execute(select(Book.title).where(Book.id == w.book_id)).scalar()
+    db.session.add(Notification(
+        credential_id=credential_id,
+        type=NotificationType.SUCCESS,
+        title="Reserva Confirmada",
+        message=f"Tu reserva para '{book_title or 'el libro solicitado'}' ha sido confirmada. Puedes recogerlo en la biblioteca.",
+        is_read=False
+    ))
+    invalidate_dashboard_cache(credential_id, commit=False)
     db.session.commit()
-    hold_copy_async.delay(w.id)
-    
-    # Invalidar cache del dashboard
-    invalidate_dashboard_cache(credential_id)
-    
-    # Publish waitlist added event
-    publish_waitlist_added(
-        waitlist_id=w.id,
-        user_id=credential_id,
-        book_id=book_id
-    )
-    
-    return w.id
+    return {
+        "waitlist_id": waitlist_id,
+        "book_id": w.book_id,
+        "book_title": book_title or "Unknown",
+        "status": WaitlistStatus.CONFIRMED.value,
+    }
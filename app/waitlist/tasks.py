@@ -8,23 +8,33 @@ from infrastructure.celery_app import celery
     max_retries=3,
 )
 def hold_copy_async(self, waitlist_id: int):
-    from app.extensions import db
-    from app.common.models import Waitlist, WaitlistStatus, Book, Inventory
+    from app.common.transactions import run_in_transaction
 
     try:
-        with db.session.begin():
-            w = db.session.get(Waitlist, waitlist_id)
-            if not w or w.status != WaitlistStatus.PENDING:
-                return {"status": "ignored", "id": waitlist_id}
+        return run_in_transaction("waitlist.hold", _hold_copy, waitlist_id)
+    except Exception as e:
+        return {"status": "error", "id": waitlist_id, "error": str(e)}
+
 
-            book = db.session.get(Book, w.book_id)
-            inventory = book.inventory if book else None
-            if not book or not inventory or (inventory.available_copies or 0) <= 0:
-                return {"status": "no_stock_yet", "id": waitlist_id, "message": "Mantiene PENDING hasta que haya stock"}
+def _hold_copy(waitlist_id: int) -> dict:
+    """Promueve la cola del libro de la reserva (ver app/waitlist/promotion.py)."""
+    from sqlalchemy import select
+    from app.extensions import db
+    from app.common.models import Waitlist, WaitlistStatus
+    from app.waitlist.promotion import promote_waitlist, publish_holds
 
-            inventory.available_copies -= 1
-            w.status = WaitlistStatus.HELD
+    w = db.session.execute(
+        select(Waitlist.book_id, Waitlist.status).where(Waitlist.id == waitlist_id)
+    ).first()
+    if not w or w.status != WaitlistStatus.PENDING:
+        return {"status": "ignored", "id": waitlist_id}
 
-        return {"status": "held", "id": waitlist_id, "book_id": w.book_id}
-    except Exception as e:
-        return {"status": "error", "id": waitlist_id, "error": str(e)}
+    # FIFO: si hay copias van primero a las reservas más antiguas del libro, no a esta
+    holds = promote_waitlist([w.book_id])
+    db.session.commit()
+    publish_holds(holds)
+
+    if any(hold["waitlist_id"] == waitlist_id for hold in holds):
+        return {"status": "held", "id": waitlist_id, "book_id": w.book_id, "promoted": len(holds)}
+    return {"status": "no_stock_yet", "id": waitlist_id, "promoted": len(holds),
+            "message": "Mantiene PENDING hasta que haya stock"}
@@ -0,0 +1 @@
+# Benchmarks and load-test helpers (not shipped in the Docker images)
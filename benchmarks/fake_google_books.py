@@ -0,0 +1,384 @@
+"""
+Servidor falso de Google Books (`/books/v1/volumes`) para benchmarks y pruebas de carga.
+
+Sirve fichas grabadas en JSON (`benchmarks/fixtures/google_books.json`):
+  - GET /books/v1/volumes/<id>          -> ficha del volumen (404 si no existe)
+  - GET /books/v1/volumes?q=...         -> búsqueda; entiende `subject:`, `isbn:`,
+                                           `intitle:`, `inauthor:`, `startIndex`
+                                           y `maxResults`
+  - GET /covers/<id>.png                -> portada (PNG generado)
+  - GET /__stats                        -> contadores de peticiones
+  - POST /__config                      -> cambia latencia / errores en caliente
+
+La latencia, la tasa de errores 5xx y la de 429 son configurables, para
+reproducir una API lenta o que limita nuestra clave.
+
+Uso:
+    python -m benchmarks.fake_google_books --port 8765 \\
+        --latency lognormal:120:0.6 --error-rate 0.02 --rate-429 0.05
+    GOOGLE_BOOKS_API_URL=http://localhost:8765/books/v1/volumes GOOGLE_BOOKS_API_KEY=fake ...
+
+    # Regrabar fixtures contra la API real
+    python -m benchmarks.fake_google_books record --api-key $GOOGLE_BOOKS_API_KEY \\
+        --query "clean code" --query "subject:Fiction" --volume zvQYMgAACAAJ
+
+    # Catálogo sintético grande (p.ej. importaciones masivas)
+    python -m benchmarks.fake_google_books --synthetic 50000
+
+Formatos de latencia: `fixed:MS`, `uniform:MIN:MAX`, `lognormal:MEDIANA_MS:SIGMA`.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "google_books.json")
+API_PREFIX = "/books/v1/volumes"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Devuelve una función que genera latencias en segundos según `spec`."""
+    kind, *args = (spec or "fixed:0").split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(max(median, 0.001)), sigma) / 1000
+    raise ValueError(f"Distribución de latencia desconocida: {spec}")
+
+
+def _png(seed: str, size: int = 8) -> bytes:
+    """PNG de un color derivado del id, sin dependencias."""
+    digest = zlib.crc32(seed.encode())
+    pixel = bytes([(digest >> 16) & 0xFF, (digest >> 8) & 0xFF, digest & 0xFF])
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+class FixtureStore:
+    """Volúmenes grabados y búsquedas resueltas sobre ellos."""
+
+    def __init__(self, volumes: List[dict], searches: Optional[Dict[str, List[str]]] = None):
+        self.volumes: Dict[str, dict] = {v["id"]: v for v in volumes}
+        self.searches = {self._normalize(q): ids for q, ids in (searches or {}).items()}
+        self._haystack = {vid: self._text(v) for vid, v in self.volumes.items()}
+
+    @classmethod
+    def load(cls, path: str) -> "FixtureStore":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("volumes", []), data.get("searches"))
+
+    @classmethod
+    def synthetic(cls, size: int, seed: int = 42) -> "FixtureStore":
+        from benchmarks.local_search import WORDS, AUTHORS
+
+        categories = ["Fiction", "Computers", "History", "Science", "Business & Economics",
+                      "Education", "Poetry", "Biography & Autobiography", "Self-Help"]
+        volumes = []
+        for i in range(size):
+            rnd = random.Random(seed + i)
+            volumes.append({
+                "kind": "books#volume",
+                "id": f"syn{i:09d}",
+                "volumeInfo": {
+                    "title": " ".join(rnd.choices(WORDS, k=rnd.randint(2, 5))).capitalize(),
+                    "authors": [f"{rnd.choice(AUTHORS)} {rnd.choice(AUTHORS)}"],
+                    "publisher": "Editorial Sintética",
+                    "publishedDate": str(rnd.randint(1950, 2024)),
+                    "description": " ".join(rnd.choices(WORDS, k=rnd.randint(15, 40))),
+                    "industryIdentifiers": [{"type": "ISBN_13", "identifier": f"979{i:010d}"}],
+                    "pageCount": rnd.randint(80, 900),
+                    "categories": [rnd.choice(categories)],
+                },
+            })
+        return cls(volumes)
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join((query or "").lower().split())
+
+    @staticmethod
+    def _text(volume: dict) -> str:
+        info = volume.get("volumeInfo", {})
+        parts = [info.get("title"), info.get("subtitle"), info.get("description"), *info.get("authors", [])]
+        return " ".join(p for p in parts if p).lower()
+
+    def _matches(self, volume_id: str, field: str, value: str) -> bool:
+        info = self.volumes[volume_id].get("volumeInfo", {})
+        if field == "subject":
+            return any(value in c.lower() for c in info.get("categories", []))
+        if field == "isbn":
+            return any(value == i["identifier"] for i in info.get("industryIdentifiers", []))
+        if field == "intitle":
+            return value in (info.get("title") or "").lower()
+        if field == "inauthor":
+            return any(value in a.lower() for a in info.get("authors", []))
+        return all(word in self._haystack[volume_id] for word in value.split())
+
+    def search(self, query: str) -> List[dict]:
+        normalized = self._normalize(query)
+        if normalized in self.searches:
+            return [self.volumes[i] for i in self.searches[normalized] if i in self.volumes]
+
+        filters = []
+        free_text = []
+        for token in re.findall(r'(\w+):("[^"]+"|\S+)|(\S+)', normalized):
+            field, value, word = token
+            if field:
+                filters.append((field, value.strip('"').replace("-", "")))
+            else:
+                free_text.append(word)
+        if free_text:
+            filters.append(("text", " ".join(free_text)))
+        if not filters:
+            return []
+        return [
+            volume for vid, volume in self.volumes.items()
+            if all(self._matches(vid, field, value) for field, value in filters)
+        ]
+
+
+class FakeGoogleBooks:
+    """Estado compartido del servidor: fixtures, comportamiento y contadores."""
+
+    def __init__(self, store: FixtureStore, latency: str = "fixed:0", error_rate: float = 0.0,
+                 rate_429: float = 0.0, retry_after: int = 1):
+        self.store = store
+        self.base_url = ""
+        self._lock = threading.Lock()
+        self.configure(latency=latency, error_rate=error_rate, rate_429=rate_429, retry_after=retry_after)
+        self.counters = {"requests": 0, "volume": 0, "search": 0, "cover": 0,
+                         "not_found": 0, "errors_5xx": 0, "errors_429": 0}
+
+    def configure(self, latency: Optional[str] = None, error_rate: Optional[float] = None,
+                  rate_429: Optional[float] = None, retry_after: Optional[int] = None) -> None:
+        with self._lock:
+            if latency is not None:
+                self.latency_spec = latency
+                self._latency = parse_latency(latency)
+            if error_rate is not None:
+                self.error_rate = float(error_rate)
+            if rate_429 is not None:
+                self.rate_429 = float(rate_429)
+            if retry_after is not None:
+                self.retry_after = int(retry_after)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "volumes": len(self.store.volumes),
+                "latency": self.latency_spec,
+                "error_rate": self.error_rate,
+                "rate_429": self.rate_429,
+            }
+
+    def with_cover(self, volume: dict) -> dict:
+        volume = json.loads(json.dumps(volume))
+        info = volume.setdefault("volumeInfo", {})
+        info["imageLinks"] = {"thumbnail": f"{self.base_url}/covers/{volume['id']}.png"}
+        return volume
+
+    def fault(self) -> Optional[int]:
+        """Decide si esta petición falla: 429, 503 o None."""
+        roll = random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.error_rate:
+            return 503
+        return None
+
+
+def _make_handler(fake: FakeGoogleBooks):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/json",
+                  headers: Optional[dict] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, payload, headers: Optional[dict] = None) -> None:
+            self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), headers=headers)
+
+        def _error(self, status: int, message: str, headers: Optional[dict] = None) -> None:
+            self._json(status, {"error": {"code": status, "message": message}}, headers)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats":
+                return self._json(200, fake.stats())
+
+            fake.count("requests")
+            time.sleep(fake._latency())
+
+            if url.path.startswith("/covers/"):
+                fake.count("cover")
+                volume_id = url.path[len("/covers/"):].rsplit(".", 1)[0]
+                if volume_id not in fake.store.volumes:
+                    return self._error(404, "Cover not found")
+                return self._send(200, _png(volume_id), "image/png")
+
+            if not url.path.startswith(API_PREFIX):
+                return self._error(404, "Not Found")
+
+            fault = fake.fault()
+            if fault == 429:
+                fake.count("errors_429")
+                return self._error(429, "Rate Limit Exceeded", {"Retry-After": str(fake.retry_after)})
+            if fault:
+                fake.count("errors_5xx")
+                return self._error(fault, "Backend Error")
+
+            volume_id = url.path[len(API_PREFIX):].strip("/")
+            if volume_id:
+                fake.count("volume")
+                volume = fake.store.volumes.get(volume_id)
+                if volume is None:
+                    fake.count("not_found")
+                    return self._error(404, "The volume ID could not be found.")
+                return self._json(200, fake.with_cover(volume))
+
+            fake.count("search")
+            params = parse_qs(url.query)
+            query = params.get("q", [""])[0]
+            if not query:
+                return self._error(400, "Missing query.")
+            start = int(params.get("startIndex", ["0"])[0])
+            max_results = min(int(params.get("maxResults", ["10"])[0]), 40)
+            matches = fake.store.search(query)
+            page = matches[start:start + max_results]
+            payload = {"kind": "books#volumes", "totalItems": len(matches)}
+            if page:
+                payload["items"] = [fake.with_cover(v) for v in page]
+            return self._json(200, payload)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/__config":
+                return self._error(404, "Not Found")
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                fake.configure(**json.loads(self.rfile.read(length) or b"{}"))
+            except (TypeError, ValueError) as e:
+                return self._error(400, str(e))
+            return self._json(200, fake.stats())
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_fake_server(store: Optional[FixtureStore] = None, host: str = "127.0.0.1", port: int = 0,
+                      **behaviour):
+    """
+    Arranca el servidor en un hilo y devuelve `(server, fake)`.
+    La URL para `GOOGLE_BOOKS_API_URL` es `fake.base_url + "/books/v1/volumes"`.
+    """
+    fake = FakeGoogleBooks(store or FixtureStore.load(DEFAULT_FIXTURES), **behaviour)
+    server = ThreadingHTTPServer((host, port), _make_handler(fake))
+    server.daemon_threads = True
+    fake.base_url = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def record(api_key: str, queries: List[str], volume_ids: List[str], output: str,
+           api_url: str = "https://www.googleapis.com/books/v1/volumes", max_results: int = 20) -> None:
+    """Graba respuestas reales de Google Books y las añade al fichero de fixtures."""
+    data = {"volumes": [], "searches": {}}
+    if os.path.exists(output):
+        with open(output, encoding="utf-8") as f:
+            data = json.load(f)
+    volumes = {v["id"]: v for v in data.get("volumes", [])}
+    searches = data.setdefault("searches", {})
+
+    for query in queries:
+        url = f"{api_url}?{urlencode({'q': query, 'maxResults': max_results, 'key': api_key})}"
+        with urlopen(url, timeout=30) as response:
+            items = json.load(response).get("items", [])
+        for item in items:
+            volumes[item["id"]] = {"kind": item.get("kind"), "id": item["id"], "volumeInfo": item.get("volumeInfo", {})}
+        searches[query] = [item["id"] for item in items]
+        print(f"[RECORD] '{query}': {len(items)} volúmenes")
+
+    for volume_id in volume_ids:
+        with urlopen(f"{api_url}/{volume_id}?{urlencode({'key': api_key})}", timeout=30) as response:
+            item = json.load(response)
+        volumes[item["id"]] = {"kind": item.get("kind"), "id": item["id"], "volumeInfo": item.get("volumeInfo", {})}
+        print(f"[RECORD] volumen {volume_id}")
+
+    data["volumes"] = list(volumes.values())
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de Google Books")
+    sub = parser.add_subparsers(dest="command")
+
+    rec = sub.add_parser("record", help="grabar fixtures contra la API real")
+    rec.add_argument("--api-key", default=os.getenv("GOOGLE_BOOKS_API_KEY"))
+    rec.add_argument("--query", action="append", default=[])
+    rec.add_argument("--volume", action="append", default=[])
+    rec.add_argument("--output", default=DEFAULT_FIXTURES)
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--synthetic", type=int, default=0, help="generar N volúmenes en lugar de usar fixtures")
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        if not args.api_key:
+            parser.error("record necesita --api-key o GOOGLE_BOOKS_API_KEY")
+        record(args.api_key, args.query, args.volume, args.output)
+        return
+
+    store = FixtureStore.synthetic(args.synthetic) if args.synthetic else FixtureStore.load(args.fixtures)
+    server, fake = start_fake_server(
+        store, host=args.host, port=args.port, latency=args.latency,
+        error_rate=args.error_rate, rate_429=args.rate_429, retry_after=args.retry_after,
+    )
+    print(f"[FAKE GOOGLE BOOKS] {len(store.volumes)} volúmenes en {fake.base_url}{API_PREFIX}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,35 @@ celery.conf.update(
     task_max_retries=3,
 )
 
-celery.autodiscover_tasks(["app.waitlist", "app.common"])
+celery.conf.beat_schedule = {
+    # Recordatorios y avisos de vencimiento (app/loans/sweep.py)
+    "loans-sweep-due-dates": {
+        "task": "loans.sweep_due_dates",
+        "schedule": float(os.environ.get("LOAN_SWEEP_INTERVAL_SECONDS", "900")),
+    },
+    # Repara la desviación de user_loan_counters (app/loans/counters.py)
+    "loans-reconcile-counters": {
+        "task": "loans.reconcile_counters",
+        "schedule": float(os.environ.get("LOAN_COUNTERS_RECONCILE_INTERVAL_SECONDS", "86400")),
+    },
+    # Particiones mensuales de loans/loan_history en Postgres (app/loans/partitions.py)
+    "loans-maintain-partitions": {
+        "task": "loans.maintain_partitions",
+        "schedule": 86400.0,
+    },
+    # Préstamos devueltos antiguos a loans_archive (app/loans/archive.py)
+    "loans-archive-returned-loans": {
+        "task": "loans.archive_returned_loans",
+        "schedule": float(os.environ.get("LOAN_ARCHIVE_INTERVAL_SECONDS", "86400")),
+    },
+    # Respuestas Idempotency-Key caducadas (app/common/idempotency.py)
+    "common-purge-idempotency-keys": {
+        "task": "common.purge_idempotency_keys",
+        "schedule": 3600.0,
+    },
+}
+
+celery.autodiscover_tasks(["app.waitlist", "app.common", "app.catalog", "app.loans"])
 
 _flask_app = None
 def get_flask_app():
@@ -8,6 +8,7 @@ class DomainEvent(str, Enum):
     LOAN_RETURNED = "loan.returned"
     LOAN_RENEWED = "loan.renewed"
     LOAN_OVERDUE = "loan.overdue"
+    LOAN_BATCH = "loan.batch"
     
     WAITLIST_ADDED = "waitlist.added"
     WAITLIST_HELD = "waitlist.held"
@@ -69,6 +70,25 @@ def publish_loan_renewed(loan_id: int, user_id: int, book_id: int, new_due_date:
     })
 
 
+def publish_loans_overdue(loans: List[Dict[str, Any]]) -> None:
+    """Un único evento para un lote de préstamos recién vencidos."""
+    publish_event(DomainEvent.LOAN_OVERDUE, {
+        "count": len(loans),
+        "loans": loans
+    })
+
+
+def publish_loans_batch(user_id: int, created: List[Dict[str, Any]], returned: List[Dict[str, Any]],
+                        renewed: List[Dict[str, Any]]) -> None:
+    """Un único evento por usuario con sus operaciones de un lote del mostrador."""
+    publish_event(DomainEvent.LOAN_BATCH, {
+        "user_id": user_id,
+        "created": created,
+        "returned": returned,
+        "renewed": renewed
+    })
+
+
 def publish_waitlist_added(waitlist_id: int, user_id: int, book_id: int) -> None:
     publish_event(DomainEvent.WAITLIST_ADDED, {
         "waitlist_id": waitlist_id,
@@ -77,6 +97,14 @@ def publish_waitlist_added(waitlist_id: int, user_id: int, book_id: int) -> None
     })
 
 
+def publish_waitlist_held(holds: List[Dict[str, Any]]) -> None:
+    """Un único evento con todas las reservas retenidas en una promoción de la lista de espera."""
+    publish_event(DomainEvent.WAITLIST_HELD, {
+        "count": len(holds),
+        "holds": holds
+    })
+
+
 def publish_user_registered(user_id: int, email: str, full_name: str) -> None:
     publish_event(DomainEvent.USER_REGISTERED, {
         "user_id": user_id,
@@ -0,0 +1,48 @@
+"""
+Redis Client Module
+Shared per-process Redis connection used for caches, locks and counters
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import redis
+
+_client: Optional[redis.Redis] = None
+_client_pid: Optional[int] = None
+_lock = threading.Lock()
+_down_until = 0.0
+
+
+def get_redis() -> redis.Redis:
+    """
+    Return the Redis client for the current process.
+
+    Timeouts are kept short: Redis is an optimization layer, callers must
+    catch `redis.RedisError` and fall back to the source of truth.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = redis.Redis.from_url(
+                    os.environ.get("REDIS_CACHE_URL", "redis://localhost:6379/2"),
+                    socket_connect_timeout=float(os.environ.get("REDIS_CONNECT_TIMEOUT", "0.25")),
+                    socket_timeout=float(os.environ.get("REDIS_SOCKET_TIMEOUT", "0.5")),
+                    health_check_interval=30,
+                )
+                _client_pid = pid
+    return _client
+
+
+def redis_available() -> bool:
+    """False while a recent failure keeps Redis in back-off."""
+    return time.monotonic() >= _down_until
+
+
+def mark_redis_down(seconds: float = 5.0) -> None:
+    """Skip Redis for a few seconds after an error instead of paying a timeout per call."""
+    global _down_until
+    _down_until = time.monotonic() + seconds
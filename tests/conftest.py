@@ -0,0 +1,5 @@
+import os
+
+# Sin broker real: los eventos y tareas de Celery se quedan en memoria
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "cache+memory://")
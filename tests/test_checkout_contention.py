@@ -0,0 +1,18 @@
+"""
+Muchos hilos piden a la vez un libro con pocas copias (ver
+benchmarks/checkout_contention.py): nunca se prestan más copias de las que
+hay y el resto de usuarios queda en la lista de espera.
+"""
+import pytest
+
+from benchmarks.checkout_contention import run
+
+
+@pytest.mark.parametrize("threads, copies", [(30, 1), (30, 3)])
+def test_concurrent_checkouts_never_oversell(tmp_path, threads, copies):
+    result = run(threads, copies, f"sqlite:///{tmp_path / 'checkout.db'}")
+
+    assert result["loans"] == copies
+    assert result["available_after"] == 0
+    assert result["waitlist"] == threads - copies
+    assert result["outcomes"] == {"LOANED": copies, "ADDED_TO_WAITLIST": threads - copies}
@@ -0,0 +1,53 @@
+"""
+`get_book_by_volume_id_with_stock` con un volumen que Google devuelve con un
+ISBN que ya tiene otro libro local: se usa ese libro, sin volver a importar.
+"""
+import pytest
+
+from app import create_app
+from app.config import Config
+from app.extensions import db
+from app.common.models import Book, Inventory
+import app.catalog.service as catalog_service
+import app.inventory.service as inventory_service
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'inventory.db'}"
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def test_existing_isbn_with_other_volume_id_is_imported_once(app, monkeypatch):
+    book = Book(volume_id="localVol", title="Libro local", author="Autor", isbn="9780000000001", category="FICTION")
+    db.session.add(book)
+    db.session.flush()
+    db.session.add(Inventory(book_id=book.id, available_copies=2, reserved_copies=0, damaged_copies=0,
+                             total_copies=2))
+    db.session.commit()
+
+    monkeypatch.setattr(catalog_service, "get_book_by_volume_id", lambda volume_id: {
+        "id": volume_id, "title": "Libro local", "authors": ["Autor"], "isbn_13": "9780000000001",
+    })
+    calls = []
+    import_book = inventory_service.import_book
+
+    def counting_import(*args, **kwargs):
+        calls.append(args)
+        return import_book(*args, **kwargs)
+
+    monkeypatch.setattr(inventory_service, "import_book", counting_import)
+
+    result = inventory_service.get_book_by_volume_id_with_stock("googleVol")
+
+    assert len(calls) == 1
+    assert result is not None
+    assert result.book_id == book.id
+    assert result.volume_id == "localVol"
+    assert result.available_copies == 2